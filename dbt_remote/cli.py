@@ -1,8 +1,10 @@
 from dbt.cli import main as dbt_cli, params as dbt_p
+from dbt.cli.flags import DEPRECATED_PARAMS
 from dbt.cli.main import global_flags
 import click
 from click_aliases import ClickAliasedGroup
 
+from dbt_remote.src.cli_batch import Batch
 from dbt_remote.src.cli_local_config import LocalCliConfig
 from dbt_remote.src.cli_schedules import Schedules
 from dbt_remote.src.cli_utils import run_and_echo
@@ -22,6 +24,8 @@ list, build, run, run-operation, compile, test, seed, snapshot. (dbt regular com
 
 config: configure dbt-remote. See `dbt-remote config help` for more information.
 
+batch: run several dbt commands sharing one manifest upload, in parallel or as a pipeline. See `dbt-remote batch --help` for more information.
+
 image: build and submit dbt-server image to your Artifact Registry. See `dbt-remote image help` for more information.
 """
 
@@ -68,6 +72,10 @@ def cli(ctx, **kwargs):
 @global_flags
 @click.argument("args", nargs=-1, type=click.UNPROCESSED)
 @p.manifest
+@p.prune_manifest
+@p.coalesce
+@p.shards
+@p.timings
 @dbt_p.target
 @p.project_dir
 @p.dbt_project
@@ -83,6 +91,37 @@ def dbt(ctx, args, **kwargs):
     cli_input = CliInput.from_click_context(ctx)
     run_and_echo(cli_input)
 
+# ------------------ BATCH -------------------- #
+
+@cli.command(
+    "batch",
+    context_settings={"help_option_names": ["-h", "--help"]},
+    no_args_is_help=True,
+)
+@click.pass_context
+@click.argument("batch_file", required=True)
+@p.batch_mode
+@dbt_p.target
+@p.project_dir
+@p.profiles_dir
+@p.extra_packages
+@p.seeds_path
+@p.server_url
+@p.location
+def batch(ctx, **kwargs):
+    """Run the dbt commands of BATCH_FILE with a single manifest and seeds upload."""
+    batch = Batch(ctx.params["batch_file"], ctx.params["mode"])
+    dbt_native_params_overrides = {
+        k: v for k, v in {**ctx.parent.params, "target": ctx.params["target"]}.items()
+        if k not in list(DEPRECATED_PARAMS.keys()) + ["log_path", "server_url", "location"] and v is not None
+    }
+    cli_input = CliInput(
+        user_command="batch",
+        dbt_native_params_overrides=dbt_native_params_overrides,
+        **{key: value for key, value in ctx.params.items() if key in CliInput.__dataclass_fields__.keys()},
+    )
+    batch.run_and_echo(cli_input)
+
 # ------------------ IMAGE -------------------- #
 
 @cli.group(
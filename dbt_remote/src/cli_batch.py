@@ -0,0 +1,74 @@
+import shlex
+from typing import List, Optional
+
+import click
+import yaml
+from dbt.cli import main as dbt_cli
+
+from dbt_remote.src.cli_input import CliInput
+from dbt_remote.src.dbt_server import DbtServer, DbtServerCommand
+
+
+class Batch:
+    """
+        Several dbt commands read from a yaml file, ex:
+            mode: pipeline
+            commands:
+              - seed
+              - run --select my_model+
+              - test --select my_model+
+        Their manifest and seeds are uploaded once and shared by all the jobs of the batch.
+    """
+
+    def __init__(self, batch_file: str, mode: Optional[str] = None):
+        batch = self.read_batch_file(batch_file)
+        self.commands: List[str] = batch.get("commands") or []
+        self.mode: str = mode if mode is not None else batch.get("mode", "parallel")
+        if len(self.commands) == 0:
+            raise click.ClickException(f"{click.style('ERROR', fg='red')}\tNo commands found in batch file '{batch_file}'")
+        for command in self.commands:
+            self.validate_command(command)
+
+    @staticmethod
+    def validate_command(command: str) -> None:
+        args = shlex.split(command)
+        dbt_command = getattr(dbt_cli, args[0].replace("-", "_"), None) if len(args) > 0 else None
+        if dbt_command is None:
+            raise click.ClickException(f"{click.style('ERROR', fg='red')}\tUnknown dbt command in batch: '{command}'")
+        dbt_command.make_context(info_name=args[0], args=args[1:])  # Validates user input
+
+    def run_and_echo(self, cli_input: CliInput) -> None:
+        click.echo(click.style('Config:', blink=True, bold=True))
+        for key, value in cli_input.__dict__.items():
+            click.echo(f"   {key}: {value}")
+        click.echo(f"   mode: {self.mode}")
+        click.echo(f"   commands: {self.commands}")
+
+        click.echo('\nSending batch to server...')
+
+        server = DbtServer(cli_input.server_url)
+        command = DbtServerCommand.from_cli_config(cli_input, server.features)
+        uploaded_artifacts = server.upload_artifacts(command)
+        click.echo(f"Uploaded {len(uploaded_artifacts)} of {len(set(command.artifacts.values()))} artifacts, the others were already on the server")
+        response = server.send_batch(command, self.commands, self.mode)
+
+        click.echo(click.style(response.message, blink=True, bold=True))
+
+        # Logs are kept on the server, jobs of a parallel batch are followed one after the other without losing any
+        for job, user_command in zip(response.jobs, self.commands):
+            click.echo(click.style(f"\n{user_command} ({job.uuid})", bold=True))
+            for log in server.stream_logs(job.links):
+                click.echo(log)
+
+        batch_status = server.get_batch_status(response.batch_id)
+        click.echo(click.style("\nBatch summary:", bold=True))
+        for job in batch_status["jobs"]:
+            click.echo(f"   {job['user_command']}: {job['run_status']}")
+        if batch_status["run_status"] != "success":
+            raise click.ClickException(f"{click.style('ERROR', fg='red')}\tBatch {response.batch_id} {batch_status['run_status']}")
+        click.echo(click.style(f"Batch {response.batch_id} succeeded", fg="green"))
+
+    @staticmethod
+    def read_batch_file(batch_file: str) -> dict:
+        with open(batch_file, 'r') as file:
+            return yaml.safe_load(file) or {}
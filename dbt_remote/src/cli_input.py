@@ -1,6 +1,6 @@
 from pathlib import Path
 import click
-from typing import List, Optional
+from typing import List, Optional, Set
 from dataclasses import dataclass
 
 from dbt.cli.main import dbtRunner, dbtRunnerResult
@@ -10,6 +10,8 @@ from dbt.parser.manifest import write_manifest
 
 from dbt_remote.src.cli_local_config import LocalCliConfig
 from dbt_remote.src.dbt_server_detector import detect_dbt_server_uri
+from dbt_remote.src.manifest_cache import ManifestCache, get_manifest_msgpack
+from dbt_remote.src.manifest_pruning import can_prune, prune_manifest
 
 
 @dataclass
@@ -19,6 +21,12 @@ class CliInput:
     dbt_native_params_overrides: Optional[dict] = None
     command: Optional[str] = None
     manifest: Optional[str] = None
+    manifest_msgpack: Optional[str] = None
+    prune_manifest: Optional[bool] = None
+    selected_seeds: Optional[Set[str]] = None
+    coalesce: Optional[bool] = None
+    shards: Optional[int] = None
+    timings: Optional[bool] = None
     target: Optional[str] = None
     project_dir: Optional[str] = None
     profiles_dir: Optional[str] = None
@@ -34,7 +42,7 @@ class CliInput:
     def from_click_context(cls, ctx):
         dbt_native_params_overrides = {
             k: v for k, v in {**ctx.parent.params, **ctx.params}.items()
-            if k not in list(DEPRECATED_PARAMS.keys()) + ["args", "project_dir", "profiles_dir", "seeds_path", "log_path"] and v is not None
+            if k not in list(DEPRECATED_PARAMS.keys()) + ["args", "project_dir", "profiles_dir", "seeds_path", "log_path", "prune_manifest", "coalesce", "shards", "timings"] and v is not None
         }
 
         return cls(
@@ -42,6 +50,10 @@ class CliInput:
             args=ctx.params.get('args'),
             dbt_native_params_overrides=dbt_native_params_overrides,
             manifest=ctx.params.get('manifest'),
+            prune_manifest=ctx.params.get('prune_manifest'),
+            coalesce=ctx.params.get('coalesce'),
+            shards=ctx.params.get('shards'),
+            timings=ctx.params.get('timings'),
             target=ctx.params.get('target'),
             project_dir=ctx.params.get('project_dir'),
             profiles_dir=ctx.params.get('profiles_dir'),
@@ -63,6 +75,9 @@ class CliInput:
         self.profiles_dir = self.find_profiles_dir()
         self.server_url = self.get_server_url()
         self.manifest = self.resolve_manifest()
+        if self.prune_manifest:
+            self.prune_manifest_to_selection()
+        self.manifest_msgpack = str(get_manifest_msgpack(Path(self.manifest) / "manifest.json"))
 
     def build_command(self) -> str:
         return " ".join([self.user_command] + list(self.args))
@@ -100,15 +115,47 @@ class CliInput:
     def get_server_url(self) -> str:
         return detect_dbt_server_uri(self.location) if self.server_url is None else self.server_url
 
+    def prune_manifest_to_selection(self) -> None:
+        if not can_prune(self.user_command, list(self.args)):
+            click.echo("\nNot pruning the manifest: the command has no selection that can be resolved locally")
+            return
+        pruned_manifest_dir = Path(self.project_dir) / "target" / "dbt_remote_pruned"
+        self.selected_seeds = prune_manifest(
+            self.manifest, list(self.args), self.project_dir, self.profiles_dir, self.target, pruned_manifest_dir
+        )
+        self.manifest = str(pruned_manifest_dir.absolute())
+
+    def get_arg_value(self, arg_name: str) -> Optional[str]:
+        args = list(self.args)
+        for i, arg in enumerate(args):
+            if arg == arg_name and i + 1 < len(args):
+                return args[i + 1]
+            if arg.startswith(arg_name + "="):
+                return arg[len(arg_name) + 1:]
+        return None
+
     def resolve_manifest(self) -> str:
         if self.manifest is not None:
             return str(Path(self.manifest).absolute())
 
-        click.echo("\nGenerating manifest.json")
-        target_dir = Path(self.project_dir) / 'target'
+        project_vars = self.get_arg_value("--vars")
+        manifest_cache = ManifestCache(self.project_dir, self.profiles_dir, self.target, project_vars)
+        target_dir = manifest_cache.target_dir
+        fingerprint = manifest_cache.fingerprint()
+        if manifest_cache.is_valid(fingerprint):
+            click.echo(f"\nManifest cache hit: reusing {manifest_cache.manifest_path}")
+            return str(target_dir.absolute())
+
+        click.echo("\nManifest cache miss: generating manifest.json (with partial parsing)")
         target_dir.mkdir(parents=True, exist_ok=True)
 
-        res: dbtRunnerResult = dbtRunner().invoke(["parse", "--project-dir", self.project_dir, "--profiles-dir", self.profiles_dir, "--target", self.target])
+        parse_args = ["parse", "--partial-parse", "--project-dir", self.project_dir, "--profiles-dir", self.profiles_dir, "--target", self.target]
+        if project_vars is not None:
+            parse_args += ["--vars", str(project_vars)]
+        res: dbtRunnerResult = dbtRunner().invoke(parse_args)
+        if not res.success:
+            raise click.ClickException(f"{click.style('ERROR', fg='red')}\tCould not parse the dbt project: {res.exception}")
         manifest: Manifest = res.result
         write_manifest(manifest, str(target_dir))
+        manifest_cache.save(fingerprint)
         return str(target_dir.absolute())
@@ -26,6 +26,13 @@ manifest = click.option(
     help='Manifest file path (ex: ./target/manifest.json), by default: none and the cli compiles one from current dbt project'
 )
 
+prune_manifest = click.option(
+    '--prune-manifest',
+    is_flag=True,
+    default=None,
+    help='Only send the selected nodes, their upstream nodes and the seeds they use, instead of the whole manifest. The selection (--select, --exclude, --selector) is resolved locally.'
+)
+
 project_dir = click.option(
     '--project-dir',
     envvar='PROJECT_DIR',
@@ -64,6 +71,34 @@ location = click.option(
     help='Location where the dbt server runs, ex: us-central1. Useful for server auto detection. If none is given, dbt-remote will look at all EU and US locations. /!\\ Location should be a Cloud region, not multi region.'
 )
 
+coalesce = click.option(
+    '--coalesce',
+    is_flag=True,
+    default=None,
+    help='If the same command is already running on the server with the same manifest and seeds, follow that run instead of starting a new one.'
+)
+
+batch_mode = click.option(
+    '--mode',
+    type=click.Choice(["parallel", "pipeline"]),
+    default=None,
+    help='How to run the commands of a batch: all at once (parallel), or each one after the previous one succeeded (pipeline). Overrides the mode of the batch file, by default: parallel.'
+)
+
+shards = click.option(
+    '--shards',
+    type=click.IntRange(min=1),
+    default=None,
+    help='Split the selected nodes across this many Cloud Run tasks, respecting their dependencies. For build, run, seed, snapshot and test commands, by default: 1.'
+)
+
+timings = click.option(
+    '--timings',
+    is_flag=True,
+    default=None,
+    help='Print how long each phase of the job took (job creation, container start, manifest loading, dbt...) once it is finished.'
+)
+
 schedule = click.option(
     '--schedule',
     help='Cron expression to schedule a run. Ex: "0 0 * * *" to run every day at midnight. See https://crontab.guru/ for more information.'
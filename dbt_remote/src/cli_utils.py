@@ -11,13 +11,34 @@ def run_and_echo(cli_input: CliInput) -> None:
     click.echo('\nSending request to server...')
 
     server = DbtServer(cli_input.server_url)
-    command = DbtServerCommand.from_cli_config(cli_input)
+    command = DbtServerCommand.from_cli_config(cli_input, server.features)
+    uploaded_artifacts = server.upload_artifacts(command)
+    click.echo(f"Uploaded {len(uploaded_artifacts)} of {len(set(command.artifacts.values()))} artifacts, the others were already on the server")
     response = server.send_command(command)
 
     click.echo(click.style(response.message, blink=True, bold=True))
 
     if response.links is not None and "last_logs" in response.links:
         click.echo('Waiting for job execution...')
-        logs = server.stream_logs(response.links["last_logs"])
+        logs = server.stream_logs(response.links)
         for log in logs:
             click.echo(log)
+
+    if cli_input.timings and response.links is not None and "metrics" in response.links:
+        echo_timings(server.get_metrics(response.links["metrics"]))
+
+
+def echo_timings(metrics: dict) -> None:
+    total_seconds = metrics["total_seconds"]  # None for jobs created before their creation time was recorded
+    if total_seconds is not None:
+        click.echo(click.style(f"\nJob timings (total {total_seconds:.1f}s):", bold=True))
+    else:
+        click.echo(click.style("\nJob timings:", bold=True))
+    if metrics.get("queue_wait_seconds") is not None:
+        click.echo(f"   {'queue_wait':<32}{metrics['queue_wait_seconds']:>9.1f}s")
+    for span in metrics["spans"]:
+        if total_seconds is None:
+            click.echo(f"   {span['name']:<32}{span['duration_seconds']:>9.1f}s")
+            continue
+        share = span["duration_seconds"] / total_seconds if total_seconds > 0 else 0
+        click.echo(f"   {span['name']:<32}{span['duration_seconds']:>9.1f}s {share:>6.1%}")
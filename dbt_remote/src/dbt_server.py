@@ -1,12 +1,15 @@
 from dataclasses import dataclass
 from datetime import datetime, timezone
-import io
+import hashlib
+from itertools import islice
+import json
 from pathlib import Path
 import re
 from subprocess import check_output
 from time import sleep
-from typing import Dict, List, Optional
-import zipfile
+import tarfile
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import zlib
 import requests
 
 from pydantic import BaseModel
@@ -18,6 +21,12 @@ import google.oauth2.id_token
 
 from dbt_remote.version import __version__
 
+ACTIVE_RUN_STATUSES = ["scheduled", "blocked", "queued", "pending", "running"]
+# DbtServerCommand fields that are not form fields: local paths, and artifacts sent as their hashes
+LOCAL_COMMAND_FIELDS = ["manifest", "manifest_msgpack", "seeds", "selected_seeds", "artifacts", "artifact_files"]
+ARTIFACTS_COMPRESSION_LEVEL = 6
+ARTIFACTS_READ_BLOCK_SIZE = 1024 * 1024
+
 @dataclass
 class DbtServerCommand:
     user_command: str
@@ -27,18 +36,29 @@ class DbtServerCommand:
     packages: Optional[Path] | str
     manifest: Path
     seeds: Optional[Path]
-    zipped_artifacts: bytes = None
+    manifest_msgpack: Optional[Path] = None
+    selected_seeds: Optional[Set[str]] = None  # Seed file names, all seeds are sent when None
+    coalesce: Optional[bool] = None
+    shards: Optional[int] = None
+    artifacts: Dict[str, str] = None  # {relative path: sha256}
+    artifact_files: Dict[str, Path] = None
     schedule: Optional[str] = None
     schedule_name: Optional[str] = None
 
     @classmethod
-    def from_cli_config(cls, cli_config):
+    def from_cli_config(cls, cli_config, server_features: List[str] = ()):
+        # Servers that cannot load manifest.msgpack get manifest.json
+        send_manifest_msgpack = cli_config.manifest_msgpack is not None and "manifest_msgpack" in server_features
         return cls(
             user_command=cli_config.command,
             dbt_native_params_overrides=str(cli_config.dbt_native_params_overrides),
             dbt_project=Path(cli_config.project_dir) / "dbt_project.yml",
             profiles=Path(cli_config.profiles_dir) / "profiles.yml",
             manifest=Path(cli_config.manifest) / "manifest.json",
+            manifest_msgpack=Path(cli_config.manifest_msgpack) if send_manifest_msgpack else None,
+            selected_seeds=cli_config.selected_seeds,
+            coalesce=cli_config.coalesce,
+            shards=cli_config.shards,
             packages=Path(cli_config.extra_packages) / "packages.yml" if cli_config.extra_packages is not None else None,
             seeds=Path(cli_config.seeds_path) if cli_config.seeds_path is not None else {},
             schedule=cli_config.schedule,
@@ -49,19 +69,38 @@ class DbtServerCommand:
         self.dbt_project = self.read_file(self.dbt_project)
         self.profiles = self.read_file(self.profiles)
         self.packages = self.read_file(self.packages) if self.packages is not None else {}
-        self.zipped_artifacts = self.zip_artifacts()
-
-    def zip_artifacts(self) -> Path:
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w') as zipf:
-            zipf.writestr('manifest.json', self.read_file(self.manifest))
-            for seed_file in self.seeds.iterdir():
-                if seed_file.name.lower().endswith('.csv'):
-                    seed_name = seed_file.name
-                    seed_content = self.read_file(seed_file)
-                    zipf.writestr('seeds/' + seed_name, seed_content)
-        zip_buffer.seek(0)
-        return zip_buffer
+        self.artifact_files = self.list_artifact_files()
+        self.artifacts = {relative_path: hash_file(file_path) for relative_path, file_path in self.artifact_files.items()}
+
+    def list_artifact_files(self) -> Dict[str, Path]:
+        if self.manifest_msgpack is not None:
+            artifact_files = {'manifest.msgpack': self.manifest_msgpack}
+        else:
+            artifact_files = {'manifest.json': self.manifest}
+        for seed_file in self.seeds.iterdir():
+            if seed_file.name.lower().endswith('.csv') and (self.selected_seeds is None or seed_file.name in self.selected_seeds):
+                artifact_files['seeds/' + seed_file.name] = seed_file
+        return artifact_files
+
+    def stream_artifacts(self, artifact_hashes: List[str]) -> Iterator[bytes]:
+        """
+            Yields a gzipped tar of the artifacts with the given hashes, each one named after its hash as expected
+            by the artifact store. Files are read and compressed block by block, so the archive is never held
+            in memory and can be sent as a chunked request body.
+        """
+        files_by_hash = {artifact_hash: self.artifact_files[relative_path] for relative_path, artifact_hash in self.artifacts.items()}
+        compressor = zlib.compressobj(ARTIFACTS_COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+        for artifact_hash in artifact_hashes:
+            file_path = files_by_hash[artifact_hash]
+            tar_info = tarfile.TarInfo(artifact_hash)
+            tar_info.size = file_path.stat().st_size
+            yield compressor.compress(tar_info.tobuf())
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(min(ARTIFACTS_READ_BLOCK_SIZE, tar_info.size - f.tell())), b''):
+                    yield compressor.compress(block)
+            yield compressor.compress(b"\0" * (-tar_info.size % tarfile.BLOCKSIZE))
+        yield compressor.compress(b"\0" * 2 * tarfile.BLOCKSIZE)  # End of archive
+        yield compressor.flush()
 
     def read_file(self, file_path: Path) -> str:
         with open(file_path, 'r') as f:
@@ -77,6 +116,15 @@ class DbtServerResponse(BaseModel):
     links: Optional[Dict[str, str]] = None
 
 
+class DbtServerBatchResponse(BaseModel):
+    status_code: Optional[str] = None
+    batch_id: Optional[str] = None
+    message: Optional[str] = None
+    detail: Optional[str] = None
+    jobs: Optional[List[DbtServerResponse]] = None
+    links: Optional[Dict[str, str]] = None
+
+
 class DbtServerLogResponse(BaseModel):
     status_code: Optional[str] = None
     run_status: Optional[str] = None
@@ -117,12 +165,14 @@ class DbtServer:
     def __init__(self, server_url: str):
         self.server_url = server_url
         self.auth_session = self.get_auth_session()
+        self.features: List[str] = []
         self.check_version_match()
 
     def check_version_match(self):
         raw_response = self.auth_session.get(url=self.server_url + "version")
         response = raw_response.json()
         server_version = response["version"]
+        self.features = response.get("features", [])
         if server_version != __version__:
             raise ServerVersionMismatch(server_version, __version__)
 
@@ -132,10 +182,11 @@ class DbtServer:
 
         data = {
             "server_url": self.server_url,
-            **{k: v for k, v in command.__dict__.items() if k not in ["manifest", "seeds", "zipped_artifacts"]}
+            **{k: v for k, v in command.__dict__.items() if k not in LOCAL_COMMAND_FIELDS},
+            "artifacts": json.dumps(command.artifacts),
         }
 
-        raw_response = self.auth_session.post(url=url, data=data, files={"zipped_artifacts": command.zipped_artifacts})
+        raw_response = self.auth_session.post(url=url, data=data)
 
         response = DbtServerResponse.parse_raw(raw_response.text)
         response.status_code = raw_response.status_code
@@ -145,9 +196,112 @@ class DbtServer:
 
         return response
 
-    def stream_logs(self, logs_link: str):
+    def send_batch(self, command: DbtServerCommand, commands: List[str], mode: str) -> DbtServerBatchResponse:
+        """
+            Submits several commands sharing the project files and artifacts of `command`, which must be uploaded first.
+        """
+        data = {
+            "server_url": self.server_url,
+            "commands": json.dumps(commands),
+            "mode": mode,
+            "dbt_native_params_overrides": command.dbt_native_params_overrides,
+            "dbt_project": command.dbt_project,
+            "profiles": command.profiles,
+            "packages": command.packages,
+            "artifacts": json.dumps(command.artifacts),
+        }
+
+        raw_response = self.auth_session.post(url=self.server_url + "dbt/batch", data=data)
+
+        response = DbtServerBatchResponse.parse_raw(raw_response.text)
+        response.status_code = raw_response.status_code
+
+        if response.status_code >= 400 or response.detail is not None:
+            raise Exception(f"Error {response.status_code} sending batch to server: {response.detail}")
+
+        return response
+
+    def get_batch_status(self, batch_id: str) -> dict:
+        raw_response = self.auth_session.get(url=f"{self.server_url}batch/{batch_id}")
+        return raw_response.json()
+
+    def upload_artifacts(self, command: DbtServerCommand) -> List[str]:
+        """
+            Uploads the command's artifacts that the server does not already have. Returns their hashes.
+        """
+        artifact_hashes = sorted(set(command.artifacts.values()))
+        raw_response = self.auth_session.post(url=f"{self.server_url}artifacts/missing", json={"hashes": artifact_hashes})
+        if raw_response.status_code >= 400:
+            raise Exception(f"Error {raw_response.status_code} checking artifacts on server: {raw_response.text}")
+        missing_artifacts = raw_response.json()["missing"]
+
+        if len(missing_artifacts) > 0:
+            raw_response = self.auth_session.post(
+                url=f"{self.server_url}artifacts",
+                data=(chunk for chunk in command.stream_artifacts(missing_artifacts) if chunk),
+                headers={"Content-Type": "application/gzip"},
+            )
+            if raw_response.status_code >= 400:
+                raise Exception(f"Error {raw_response.status_code} uploading artifacts to server: {raw_response.text}")
+
+        return missing_artifacts
+
+    def stream_logs(self, links: Dict[str, str]):
+        streamed_logs = 0
+        if "stream" in links:
+            try:
+                for log in self.stream_events(links["stream"]):
+                    streamed_logs += 1
+                    yield log
+                return
+            except LogStreamUnavailable:
+                pass
+        # Polling starts from the first log line, the lines already streamed are not shown twice
+        yield from islice(self.poll_logs(links["last_logs"]), streamed_logs, None)
+
+    def stream_events(self, stream_link: str, max_reconnections: int = 5):
+        """
+            Follows the job's Server-Sent Events stream, reconnecting from the last received event when the
+            connection drops. Raises LogStreamUnavailable if the stream cannot be opened, or if it dropped
+            more than max_reconnections times in a row without sending new logs.
+        """
+        last_event_id = "0"
+        reconnections = 0
+        while True:
+            try:
+                raw_response = self.auth_session.get(
+                    url=stream_link,
+                    headers={"Accept": "text/event-stream", "Last-Event-ID": last_event_id},
+                    stream=True,
+                    timeout=(10, 60),
+                )
+            except requests.RequestException as e:
+                raise LogStreamUnavailable() from e
+            if raw_response.status_code != 200 or not raw_response.headers.get("content-type", "").startswith("text/event-stream"):
+                raise LogStreamUnavailable()
+
+            run_status = None
+            try:
+                with raw_response:
+                    for event, data, event_id in read_server_sent_events(raw_response):
+                        last_event_id = event_id if event_id is not None else last_event_id
+                        if event == "log":
+                            reconnections = 0
+                            yield DbtLogEntry.from_raw_entry(data)
+                        elif event == "status":
+                            run_status = data
+            except requests.RequestException:
+                pass
+
+            if run_status is not None and run_status not in ACTIVE_RUN_STATUSES:
+                return
+            reconnections += 1
+            if reconnections > max_reconnections:
+                raise LogStreamUnavailable()
+
+    def poll_logs(self, logs_link: str):
         run_status = "pending"
-        while run_status in ["pending", "running"]:
+        while run_status in ACTIVE_RUN_STATUSES:
             sleep(1)
             raw_response = self.auth_session.get(url=logs_link)
             response = DbtServerLogResponse.parse_raw(raw_response.text)
@@ -156,6 +310,10 @@ class DbtServer:
             for log in response.run_logs:
                 yield DbtLogEntry.from_raw_entry(log)
 
+    def get_metrics(self, metrics_link: str) -> dict:
+        raw_response = self.auth_session.get(url=metrics_link)
+        return raw_response.json()
+
     def get_logs(self, uuid: str):
         raw_response = self.auth_session.get(url=f"{self.server_url}job/{uuid}/logs")
         response = DbtServerLogResponse.parse_raw(raw_response.text)
@@ -200,6 +358,37 @@ class DbtServer:
         return credentials.service_account_email
 
 
+def hash_file(file_path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def read_server_sent_events(response: requests.Response) -> Iterator[Tuple[str, str, Optional[str]]]:
+    response.encoding = "utf-8"
+    event, data, event_id = "message", [], None
+    for line in response.iter_lines(decode_unicode=True):
+        if line == "":
+            if len(data) > 0:
+                yield event, "\n".join(data), event_id
+            event, data, event_id = "message", [], None
+        elif not line.startswith(":"):
+            field, _, value = line.partition(":")
+            value = value.removeprefix(" ")
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+            elif field == "id":
+                event_id = value
+
+
+class LogStreamUnavailable(Exception):
+    pass
+
+
 class ServerVersionMismatch(Exception):
     def __init__(self, server_version: str, cli_version: str):
         super().__init__(f"Server version {server_version} does not match client version {cli_version}")
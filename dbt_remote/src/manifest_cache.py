@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dbt.version import __version__ as dbt_version
+import msgpack
+import yaml
+
+from dbt_remote.src.dbt_server import hash_file
+
+DEFAULT_PROJECT_PATHS = {
+    "model-paths": ["models"],
+    "macro-paths": ["macros"],
+    "seed-paths": ["seeds"],
+    "snapshot-paths": ["snapshots"],
+    "analysis-paths": ["analyses"],
+    "test-paths": ["tests"],
+    "docs-paths": [],
+}
+DEFAULT_PACKAGES_INSTALL_PATH = "dbt_packages"
+MSGPACK_CACHE_DIR = Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache")) / "dbt-remote" / "manifests"
+MSGPACK_CACHE_SIZE = 5
+
+
+class ManifestCache:
+    """
+        Remembers the fingerprint of the project the manifest in target/ was parsed from. The fingerprint covers
+        the project files, dbt_project.yml, the profile target, the parse-time vars and the dbt version: when none
+        of them changed, the manifest is reused as is instead of parsing the project again.
+        env_var() calls are not part of the fingerprint, pass --manifest explicitly if they change between runs.
+    """
+    CACHE_FILE = "dbt_remote_manifest_cache.json"
+
+    def __init__(self, project_dir: str, profiles_dir: str, target: Optional[str] = None, project_vars: Optional[str] = None):
+        self.project_dir = Path(project_dir)
+        self.profiles_dir = Path(profiles_dir)
+        self.target = target
+        self.project_vars = project_vars
+        self.target_dir = self.project_dir / "target"
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.target_dir / "manifest.json"
+
+    @property
+    def cache_path(self) -> Path:
+        return self.target_dir / self.CACHE_FILE
+
+    def is_valid(self, fingerprint: str) -> bool:
+        if not self.manifest_path.exists() or not self.cache_path.exists():
+            return False
+        try:
+            cache = json.loads(self.cache_path.read_text())
+        except ValueError:
+            return False
+        return cache.get("fingerprint") == fingerprint and cache.get("manifest_sha256") == hash_file(self.manifest_path)
+
+    def save(self, fingerprint: str) -> None:
+        self.cache_path.write_text(json.dumps({
+            "fingerprint": fingerprint,
+            "manifest_sha256": hash_file(self.manifest_path),
+        }))
+
+    def fingerprint(self) -> str:
+        dbt_project = yaml.safe_load((self.project_dir / "dbt_project.yml").read_text()) or {}
+        sha256 = hashlib.sha256()
+        sha256.update(f"dbt=={dbt_version}\n".encode())
+        sha256.update(f"vars={self.project_vars}\n".encode())
+        sha256.update(f"profile={self.profile_fingerprint(dbt_project)}\n".encode())
+        for relative_path, file_hash in sorted(self.project_file_hashes(dbt_project).items()):
+            sha256.update(f"{relative_path}={file_hash}\n".encode())
+        return sha256.hexdigest()
+
+    def project_file_hashes(self, dbt_project: Dict) -> Dict[str, str]:
+        files = [self.project_dir / "dbt_project.yml"]
+        for file_name in ["packages.yml", "dependencies.yml", "selectors.yml"]:
+            if (self.project_dir / file_name).exists():
+                files.append(self.project_dir / file_name)
+        for folder in self.project_folders(dbt_project):
+            if folder.is_dir():
+                files += [file_path for file_path in folder.rglob("*") if file_path.is_file()]
+        return {str(file_path.relative_to(self.project_dir)): hash_file(file_path) for file_path in set(files)}
+
+    def project_folders(self, dbt_project: Dict) -> List[Path]:
+        folders = [dbt_project.get("packages-install-path", DEFAULT_PACKAGES_INSTALL_PATH)]
+        for key, default_paths in DEFAULT_PROJECT_PATHS.items():
+            folders += dbt_project.get(key, default_paths)
+        return [self.project_dir / folder for folder in folders]
+
+    def profile_fingerprint(self, dbt_project: Dict) -> str:
+        """
+            Only the output of the selected target is part of the fingerprint, so that editing another target
+            does not invalidate the manifest. Profiles that cannot be read as plain yaml are hashed as a whole.
+        """
+        profiles_path = self.profiles_dir / "profiles.yml"
+        try:
+            profile = yaml.safe_load(profiles_path.read_text())[dbt_project["profile"]]
+            target = self.target if self.target is not None else profile["target"]
+            output = profile["outputs"][target]
+        except (KeyError, TypeError, yaml.YAMLError):
+            return hash_file(profiles_path)
+        return hashlib.sha256(json.dumps({"target": target, "output": output}, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_manifest_msgpack(manifest_path: Path, cache_dir: Path = MSGPACK_CACHE_DIR) -> Path:
+    """
+        Converts manifest.json to msgpack, which the job loads without going through json. Conversions are cached
+        by manifest hash, so an unchanged manifest is converted once (and, as an artifact, uploaded once).
+    """
+    msgpack_path = cache_dir / f"{hash_file(manifest_path)}.msgpack"
+    if not msgpack_path.exists():
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(manifest_path, 'rb') as f:
+            manifest_dict = json.load(f)
+        temp_path = msgpack_path.with_suffix(f".{os.getpid()}.tmp")
+        temp_path.write_bytes(msgpack.packb(manifest_dict))
+        temp_path.replace(msgpack_path)
+
+    msgpack_path.touch()  # The least recently used conversions are removed
+    cached_files = sorted(cache_dir.glob("*.msgpack"), key=lambda file_path: file_path.stat().st_mtime, reverse=True)
+    for file_path in cached_files[MSGPACK_CACHE_SIZE:]:
+        file_path.unlink(missing_ok=True)
+    return msgpack_path
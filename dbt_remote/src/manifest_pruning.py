@@ -0,0 +1,101 @@
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import click
+from dbt.cli.main import dbtRunner, dbtRunnerResult
+from dbt.contracts.graph.manifest import Manifest
+
+PRUNABLE_COMMANDS = ["build", "compile", "list", "ls", "run", "seed", "show", "snapshot", "test"]
+SELECTION_ARGS = ["--select", "-s", "--models", "--exclude", "--selector", "--resource-type", "--resource-types"]
+UNPRUNABLE_SELECTION_METHODS = ["state:", "result:", "source_status:"]  # Need files of a previous run, which are not sent
+GRAPH_RESOURCES = ["nodes", "sources", "exposures", "metrics", "semantic_models", "saved_queries", "unit_tests"]
+
+
+def get_selection_args(args: List[str]) -> List[str]:
+    selection_args = []
+    for i, arg in enumerate(args):
+        if arg in SELECTION_ARGS:
+            selection_args.append(arg)
+            # Selection options take several values: --select a b --exclude c
+            for value in args[i + 1:]:
+                if value.startswith("-"):
+                    break
+                selection_args.append(value)
+        elif arg.split("=")[0] in SELECTION_ARGS:
+            selection_args.append(arg)
+    return selection_args
+
+
+def can_prune(user_command: str, args: List[str]) -> bool:
+    selection_args = get_selection_args(args)
+    if user_command not in PRUNABLE_COMMANDS or not selection_args:
+        return False
+    return not any(method in arg for arg in selection_args for method in UNPRUNABLE_SELECTION_METHODS)
+
+
+def select_unique_ids(manifest: Manifest, selection_args: List[str], project_dir: str, profiles_dir: str, target: Optional[str]) -> List[str]:
+    ls_args = ["ls", "--quiet", "--output", "json", "--output-keys", "unique_id", "--project-dir", project_dir, "--profiles-dir", profiles_dir]
+    if target is not None:
+        ls_args += ["--target", target]
+    res: dbtRunnerResult = dbtRunner(manifest=manifest).invoke(ls_args + selection_args)
+    if not res.success:
+        raise click.ClickException(f"{click.style('ERROR', fg='red')}\tCould not resolve the selection locally: {res.exception}")
+    return [json.loads(line)["unique_id"] for line in res.result]
+
+
+def get_upstream_closure(manifest_dict: Dict, unique_ids: List[str]) -> Set[str]:
+    parent_map = manifest_dict.get("parent_map", {})
+    closure = set()
+    to_visit = list(unique_ids)
+    while to_visit:
+        unique_id = to_visit.pop()
+        if unique_id not in closure:
+            closure.add(unique_id)
+            to_visit += parent_map.get(unique_id, [])
+    return closure
+
+
+def prune_manifest_dict(manifest_dict: Dict, kept_ids: Set[str]) -> Dict:
+    """
+        Keeps the selected resources and everything upstream of them (refs, sources, metrics...), which the job needs
+        to resolve and run the selection. Macros, docs and other project-wide entries are all kept.
+    """
+    pruned = dict(manifest_dict)
+    for resource_type in GRAPH_RESOURCES:
+        if resource_type in manifest_dict:
+            pruned[resource_type] = {unique_id: resource for unique_id, resource in manifest_dict[resource_type].items() if unique_id in kept_ids}
+    for graph_map in ["parent_map", "child_map"]:
+        if graph_map in manifest_dict:
+            pruned[graph_map] = {
+                unique_id: [related_id for related_id in related_ids if related_id in kept_ids]
+                for unique_id, related_ids in manifest_dict[graph_map].items() if unique_id in kept_ids
+            }
+    return pruned
+
+
+def get_seed_file_names(manifest_dict: Dict) -> Set[str]:
+    return {Path(node["original_file_path"]).name for node in manifest_dict["nodes"].values() if node["resource_type"] == "seed"}
+
+
+def prune_manifest(manifest_dir: str, args: List[str], project_dir: str, profiles_dir: str, target: Optional[str],
+                   output_dir: Path) -> Set[str]:
+    """
+        Writes the manifest pruned to the command's selection in output_dir.
+        Returns the file names of the seeds the pruned manifest uses.
+    """
+    with open(Path(manifest_dir) / "manifest.json", 'rb') as f:
+        manifest_dict = json.load(f)
+
+    selected_ids = select_unique_ids(Manifest.from_dict(manifest_dict), get_selection_args(args), project_dir, profiles_dir, target)
+    pruned_manifest_dict = prune_manifest_dict(manifest_dict, get_upstream_closure(manifest_dict, selected_ids))
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "manifest.json", 'w') as f:
+        json.dump(pruned_manifest_dict, f)
+
+    click.echo(
+        f"Pruned manifest to the selection: {len(pruned_manifest_dict['nodes'])} of {len(manifest_dict['nodes'])} nodes "
+        f"({len(selected_ids)} selected, the others upstream)"
+    )
+    return get_seed_file_names(pruned_manifest_dict)
@@ -1,9 +1,17 @@
-import logging
+from datetime import datetime, timezone
+PROCESS_STARTED_AT = datetime.now(timezone.utc)  # Before the imports below, dbt takes seconds to import
+
+from dataclasses import dataclass
 import os
-from typing import List
-import msgpack
+from typing import List, Optional
 import json
+import mmap
+import msgpack
+import resource
+import signal
+import sys
 import threading
+import time
 
 from click.parser import split_arg_string
 from dbt.cli.main import dbtRunner, dbtRunnerResult
@@ -11,9 +19,17 @@ from dbt.events.base_types import EventMsg
 from dbt.events.functions import msg_to_json
 from dbt.contracts.graph.manifest import Manifest
 from dbt.contracts.graph.nodes import SeedNode
+from dbt.version import __version__ as dbt_version
 from fastapi import HTTPException
+import yaml
 
+from dbt_server.lib.gcs import CloudStorage
 from dbt_server.lib.logger import DbtLogger
+from dbt_server.lib.package_cache import DEFAULT_PACKAGES_INSTALL_PATH, PackageCache, has_packages
+from dbt_server.lib.sharding import (
+    SHARDABLE_COMMANDS, Shard, ShardBarrier, ShardBarrierTimeout, assign_to_shards, get_selection_args, node_selector,
+    plan_waves, remove_selection_args
+)
 from dbt_server.lib.state import State
 
 BUCKET_NAME = os.getenv("BUCKET_NAME")
@@ -21,18 +37,182 @@ DBT_COMMAND = os.getenv("DBT_COMMAND")
 UUID = os.getenv("UUID")
 
 
+# dbt event levels, mapped to the Python logging level and the severity used in run logs
+DBT_LOG_LEVELS = {"debug": 10, "test": 10, "info": 20, "warn": 30, "error": 40, "none": 100}
+DBT_LOG_SEVERITIES = {"debug": "DEBUG", "test": "DEBUG", "info": "INFO", "warn": "WARN", "error": "ERROR"}
+
+
+@dataclass(frozen=True)
+class JobLogConfig:
+    log_format: str = "default"
+    log_level: int = DBT_LOG_LEVELS["info"]
+
+    @classmethod
+    def from_dbt_native_params_overrides(cls, dbt_native_params_overrides: dict):
+        return cls(
+            log_format=dbt_native_params_overrides.get("log_format", "default"),
+            log_level=DBT_LOG_LEVELS[dbt_native_params_overrides.get("log_level", "info").lower()],
+        )
+
+
 callback_lock = threading.Lock()
-logger = DbtLogger(server=False)
-state = State.from_uuid(UUID)
-logger.state = state
+logger: DbtLogger = None
+state: State = None
+log_config: JobLogConfig = None
+shard: Optional[Shard] = None
+
+
+def init_job(uuid: str) -> None:
+    global logger, state, log_config
+    logger = DbtLogger(server=False)
+    state = State.from_uuid(uuid)
+    state.start_log_flusher()
+    logger.state = state
+    log_config = JobLogConfig.from_dbt_native_params_overrides(state.dbt_native_params_overrides)
+
+
+def span_name(name: str) -> str:
+    return name if shard is None else f"shard_{shard.index + 1}_{name}"
+
+
+def span(name: str):
+    return state.span(span_name(name))
 
 
-def prepare_and_execute_job() -> None:
-    state.save_context_to_local()
-    manifest = get_manifest()
-    manifest = override_manifest_with_correct_seed_path(manifest)
-    install_dependencies(manifest)
-    run_dbt_command(manifest, DBT_COMMAND)
+def record_startup_spans(process_started_at: datetime) -> None:
+    """
+        Container start: from the Cloud Run job start request sent by the server to the start of this process,
+        then the imports of this module.
+    """
+    spans = {"container_start": (state.spans.get("cloud_run_job_start", {}).get("end"), process_started_at),
+             "imports": (process_started_at, datetime.now(timezone.utc))}
+    for name, (start, end) in spans.items():
+        if start is not None:
+            state.record_span(span_name(name), start, end)
+
+
+def run_job(uuid: str, dbt_command: str, job_shard: Optional[Shard] = None, process_started_at: datetime = None) -> None:
+    """
+        Runs one job in the current directory, where its context files are downloaded.
+        Used by the Cloud Run job entrypoint below and by the workers (see worker.py).
+    """
+    global shard
+    shard = job_shard
+    init_job(uuid)
+    if process_started_at is not None:
+        record_startup_spans(process_started_at)
+    if job_shard is not None:
+        run_shard(dbt_command, job_shard)
+        return
+
+    logger.log("INFO", f"[job] Job {uuid} started")
+    run_status = "failed"
+    try:
+        prepare_and_execute_job(dbt_command)
+        run_status = "success"
+    finally:
+        # Log streams end on the final run status, the last logs must be written before it
+        state.stop_log_flusher()
+        state.run_status = run_status
+        state.compact_logs()
+
+
+def run_shard(dbt_command: str, job_shard: Shard) -> None:
+    """
+        Runs this task's part of a job started with several Cloud Run tasks (see execute_shard). All the shards log
+        under the job's uuid; once they are all done, the first one sets the job's run status and compacts the logs.
+    """
+    logger.log("INFO", f"[job] Job {state.uuid} started on shard {shard}")
+    barrier = ShardBarrier(state.uuid, shard)
+    shard_status = "failed"
+    try:
+        with span("save_context_to_local"):
+            state.save_context_to_local()
+        with span("get_manifest"):
+            manifest = override_manifest_with_correct_seed_path(get_manifest())
+        with span("install_dependencies"):
+            install_dependencies(manifest)
+        shard_status = execute_shard(manifest, dbt_command, barrier)
+    finally:
+        # Every shard writes its last logs before reporting done, so that they are all written before the run status
+        state.stop_log_flusher()
+        barrier.report("done", shard_status)
+        if shard.index == 0:
+            try:
+                shard_statuses = barrier.wait("done")
+                run_status = "success" if all(status == "success" for status in shard_statuses.values()) else "failed"
+                barrier.delete()  # No shard reads it once they are all done
+            except ShardBarrierTimeout as e:
+                logger.log("ERROR", f"[job] {e}")
+                run_status = "failed"
+            state.run_status = run_status
+            state.compact_logs()
+
+
+def execute_shard(manifest: Manifest, dbt_command: str, barrier: ShardBarrier) -> str:
+    """
+        Every shard computes the same plan: the selected nodes, grouped in waves of nodes that do not depend
+        on each other, and each wave spread over the shards. A shard runs its nodes of a wave, then waits
+        for the other shards to finish theirs before starting the next wave. Returns the shard's status.
+    """
+    with span("build_flat_graph"):
+        manifest.build_flat_graph()
+        manifest.build_parent_and_child_maps()
+    with span("plan_waves"):
+        args_list = split_arg_string(dbt_command)
+        waves = plan_waves(manifest.parent_map, select_unique_ids(manifest, args_list))
+    logger.log("INFO", f"[job] Shard {shard}: {sum(len(wave) for wave in waves)} selected nodes in {len(waves)} waves")
+
+    # A single span for all the waves, split between running dbt and waiting for the other shards
+    waves_started_at = datetime.now(timezone.utc)
+    timings = {"invoke_seconds": 0.0, "wait_seconds": 0.0}
+    try:
+        for wave_number, wave in enumerate(waves):
+            unique_ids = assign_to_shards(wave, shard.count)[shard.index]
+            wave_status = "success"
+            if len(unique_ids) > 0:
+                logger.log("INFO", f"[job] Shard {shard}: running {len(unique_ids)} of {len(wave)} nodes of wave {wave_number + 1}/{len(waves)}")
+                selectors = [node_selector(manifest.nodes[unique_id].fqn, manifest.nodes[unique_id].resource_type) for unique_id in unique_ids]
+                # Tests are planned in their own wave, after all their parents, they must not run along with a parent
+                shard_args = [args_list[0]] + remove_selection_args(args_list[1:]) + ["--indirect-selection", "empty", "--select"] + selectors
+                start = time.perf_counter()
+                wave_status = "success" if invoke_dbt(manifest, shard_args).success else "failed"
+                timings["invoke_seconds"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            barrier.report(str(wave_number), wave_status)
+            wave_statuses = barrier.wait(str(wave_number))
+            timings["wait_seconds"] += time.perf_counter() - start
+            if any(status != "success" for status in wave_statuses.values()):
+                failed_shards = [str(int(index) + 1) for index, status in sorted(wave_statuses.items()) if status != "success"]
+                logger.log("ERROR", f"[job] Shard {shard}: stopping after wave {wave_number + 1}, failed on shards {', '.join(failed_shards)}")
+                return "failed" if wave_status == "failed" else "skipped"
+    finally:
+        state.record_span(span_name("waves"), waves_started_at, datetime.now(timezone.utc), **timings)
+
+    logger.log("INFO", f"[job] Shard {shard} finished successfully")
+    return "success"
+
+
+def select_unique_ids(manifest: Manifest, args_list: List[str]) -> List[str]:
+    resource_types = SHARDABLE_COMMANDS[args_list[0]]
+    ls_args = ["ls", "--quiet", "--output", "json", "--output-keys", "unique_id"] + get_selection_args(args_list[1:])
+    res_dbt: dbtRunnerResult = dbtRunner(manifest=manifest).invoke(ls_args, **state.dbt_native_params_overrides)
+    if not res_dbt.success:
+        handle_exception(res_dbt.exception)
+    unique_ids = [json.loads(line)["unique_id"] for line in res_dbt.result]
+    return [unique_id for unique_id in unique_ids if unique_id in manifest.nodes and manifest.nodes[unique_id].resource_type in resource_types]
+
+
+def prepare_and_execute_job(dbt_command: str) -> None:
+    with span("save_context_to_local"):
+        state.save_context_to_local()
+    with span("get_manifest"):
+        manifest = get_manifest()
+        manifest = override_manifest_with_correct_seed_path(manifest)
+    with span("install_dependencies"):
+        install_dependencies(manifest)
+    run_dbt_command(manifest, dbt_command)
 
     with callback_lock:
         logger.log("INFO", "[job] Command successfully executed")
@@ -45,20 +225,52 @@ def install_dependencies(manifest: Manifest) -> None:
     if check_file:
         with open('packages.yml', 'r') as f:
             packages_str = f.read()
-        if packages_str != '':
-            run_dbt_command(manifest, 'deps')
+        if has_packages(packages_str):
+            start = time.perf_counter()
+            package_cache = PackageCache(CloudStorage(bucket_name=BUCKET_NAME), packages_str, dbt_version)
+            install_path = get_packages_install_path()
+            source = package_cache.restore(install_path)
+            if source is not None:
+                logger.log("INFO", f"[job] dbt packages restored from {source} in {time.perf_counter() - start:.1f}s")
+                return
+
+            logger.log("INFO", "[job] No cached dbt packages, running dbt deps")
+            res_dbt = invoke_dbt(manifest, ['deps'])
+            if not res_dbt.success:
+                logger.log("ERROR", "[job] dbt deps failed")
+                handle_exception(res_dbt.exception)
+            try:
+                package_cache.save(install_path)
+            except Exception as e:
+                logger.log("WARN", f"[job] Could not cache dbt packages: {e}")
+            logger.log("INFO", f"[job] dbt packages installed in {time.perf_counter() - start:.1f}s")
+
+
+def get_packages_install_path() -> str:
+    with open('dbt_project.yml', 'r') as f:
+        dbt_project = yaml.safe_load(f)
+    return dbt_project.get("packages-install-path", DEFAULT_PACKAGES_INSTALL_PATH)
 
 
 def run_dbt_command(manifest: Manifest, dbt_command: str) -> None:
-
-    state.run_status = "running"
-
-    manifest.build_flat_graph()
-    dbt = dbtRunner(manifest=manifest, callbacks=[logger_callback])
-
+    with span("build_flat_graph"):
+        manifest.build_flat_graph()
     args_list = split_arg_string(dbt_command)
     log_selected_nodes(args_list)
+    with span("dbt_invoke"):
+        res_dbt = invoke_dbt(manifest, args_list)
+
+    if res_dbt.success:
+        logger.log("INFO", "[job] dbt command finished successfully")
+    else:
+        logger.log("ERROR", "[job] dbt command failed")
+        with callback_lock:
+            logger.log("INFO", "[job] dbt-remote job finished")
+        handle_exception(res_dbt.exception)
 
+
+def invoke_dbt(manifest: Manifest, args_list: List[str]) -> dbtRunnerResult:
+    dbt = dbtRunner(manifest=manifest, callbacks=[logger_callback])
     dbt_runner_kwargs_override = dict(
         state.dbt_native_params_overrides,
             **{
@@ -69,38 +281,26 @@ def run_dbt_command(manifest: Manifest, dbt_command: str) -> None:
     )
 
     logger.log("DEBUG", f"[job] Invoking dbtRunner with args: {str(args_list)} and kwargs: {str(state.dbt_native_params_overrides)}")
-    res_dbt: dbtRunnerResult = dbt.invoke(
+    return dbt.invoke(
         args_list,
         **dbt_runner_kwargs_override
     )
 
-    if res_dbt.success:
-        logger.log("INFO", "[job] dbt command finished successfully")
-        state.run_status = "success"
-    else:
-        logger.log("ERROR", "[job] dbt command failed")
-        state.run_status = "failed"
-
-        with callback_lock:
-            logger.log("INFO", "[job] dbt-remote job finished")
-        handle_exception(res_dbt.exception)
-
 
 def logger_callback(event: EventMsg):
-    user_log_format = state.dbt_native_params_overrides['log_format'] if 'log_format' in state.dbt_native_params_overrides else "default"
-    user_log_level_str = state.dbt_native_params_overrides['log_level'] if 'log_level' in state.dbt_native_params_overrides else "info"
+    event_level = event.info.level
+    event_log_level = DBT_LOG_LEVELS[event_level]
 
-    if user_log_format == "json":
+    if log_config.log_format == "json":
         msg = msg_to_json(event).replace('\n', '  ')
     else:
         msg = "[dbt] " + event.info.msg.replace('\n', '  ')
+    if shard is not None:
+        msg = f"[shard {shard}] {msg}"
 
-    user_log_level = logging.getLevelName(user_log_level_str.upper())
-    event_log_level = logging.getLevelName(event.info.level.upper())
-
-    if event_log_level >= user_log_level:
+    if event_log_level >= log_config.log_level:
         with callback_lock:
-            logger.log(event.info.level.upper(), msg)
+            logger.log(DBT_LOG_SEVERITIES[event_level], msg)
     else:
         logger.logger.log(event_log_level, msg)
 
@@ -114,10 +314,22 @@ def handle_exception(dbt_exception: BaseException | None):
 
 
 def get_manifest() -> Manifest:
-    with open('manifest.json', 'r') as f:
-        manifest_json = json.loads(f.read())
-    partial_parse = msgpack.packb(manifest_json)
-    manifest: Manifest = Manifest.from_msgpack(partial_parse)
+    """
+        Loads manifest.msgpack, converted by the cli, from a memory map. Older clis only send manifest.json.
+    """
+    start = time.perf_counter()
+    if os.path.isfile('manifest.msgpack'):
+        manifest_file = 'manifest.msgpack'
+        with open(manifest_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as manifest_msgpack:
+            manifest: Manifest = Manifest.from_msgpack(manifest_msgpack)
+    else:
+        # Same loader as for manifest.msgpack: the cli's conversion is msgpack.packb of this json
+        manifest_file = 'manifest.json'
+        with open(manifest_file, 'rb') as f:
+            manifest: Manifest = Manifest.from_msgpack(msgpack.packb(json.load(f)))
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in KiB on Linux
+    logger.log("INFO", f"[job] Manifest loaded from {manifest_file} in {time.perf_counter() - start:.2f}s, peak RSS {peak_rss_mb:.0f} MiB")
     return manifest
 
 
@@ -143,5 +355,7 @@ def log_selected_nodes(args_list: List[str]):
 
 
 if __name__ == "__main__":
-    logger.log("INFO", f"[job] Job {UUID} started")
-    prepare_and_execute_job()
+    # Cloud Run stops timed out or cancelled jobs with SIGTERM, exiting through SystemExit lets pending logs be flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    run_job(UUID, DBT_COMMAND, Shard.from_env(), process_started_at=PROCESS_STARTED_AT)
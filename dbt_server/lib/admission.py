@@ -0,0 +1,165 @@
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import logging
+import os
+import threading
+import traceback
+from typing import Callable, Dict, List, Optional
+from uuid import uuid4
+
+from google.api_core import exceptions
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from dbt_server.lib.firestore import get_client, get_collection
+from dbt_server.lib.metrics import QUEUE_WAIT, backend_call, timed_backend_call
+from dbt_server.lib.state import State
+
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "0"))  # 0 means no limit
+MAX_CONCURRENT_JOBS_PER_TARGET = int(os.getenv("MAX_CONCURRENT_JOBS_PER_TARGET", "0"))
+ADMISSION_INTERVAL = float(os.getenv("ADMISSION_INTERVAL", "2"))
+# Jobs that crashed without a final status stop counting as running after this delay
+ACTIVE_JOB_TIMEOUT = timedelta(seconds=int(os.getenv("ACTIVE_JOB_TIMEOUT", str(6 * 3600))))
+DISPATCHER_LEASE_DURATION = timedelta(seconds=30)
+PRIORITIES = ["interactive", "scheduled"]  # Highest first
+STARTED_RUN_STATUSES = ["pending", "running"]
+WAIT_TIME_SAMPLES = 1000
+
+
+def admission_enabled() -> bool:
+    return MAX_CONCURRENT_JOBS > 0 or MAX_CONCURRENT_JOBS_PER_TARGET > 0
+
+
+class AdmissionController:
+    """
+        Server-side scheduler capping the number of jobs started at once, globally and per dbt target.
+        Submitted jobs are marked queued in their state document, and the queue is the set of queued documents,
+        ordered by priority then submission time. Jobs are started in that order as slots free up; a job
+        waiting on its target's limit does not hold back jobs of other targets.
+        When the server runs several instances, only the holder of a lease document dispatches jobs.
+    """
+
+    def __init__(self, start_job: Callable[[State], None]):
+        self.start_job = start_job
+        self.instance_id = uuid4().hex
+        self.status_collection = get_collection("dbt-status")
+        self.lease = get_collection("dbt-admission").document("dispatcher")
+        self.dispatch_lock = threading.Lock()
+        self.wait_times = deque(maxlen=WAIT_TIME_SAMPLES)
+
+    def enqueue(self, state: State, priority: str) -> None:
+        with state.batch():
+            state.run_status = "queued"
+            state.update({
+                "priority": priority,
+                "target": get_target(state.snapshot),
+                "queued_at": datetime.now(timezone.utc),
+            })
+
+    @timed_backend_call("firestore", "query")
+    def queued_jobs(self) -> List[firestore.DocumentSnapshot]:
+        snapshots = self.status_collection.where(filter=FieldFilter("run_status", "==", "queued")).stream()
+        return sorted(snapshots, key=lambda snapshot: queue_order(snapshot.to_dict()))
+
+    def started_jobs(self) -> List[dict]:
+        oldest_start = datetime.now(timezone.utc) - ACTIVE_JOB_TIMEOUT
+        with backend_call("firestore", "query"):
+            snapshots = self.status_collection.where(filter=FieldFilter("run_status", "in", STARTED_RUN_STATUSES)).stream()
+            jobs = [snapshot.to_dict() for snapshot in snapshots]
+        return [job for job in jobs if started_since(job, oldest_start)]
+
+    def queue_position(self, uuid: str) -> Optional[int]:
+        for position, snapshot in enumerate(self.queued_jobs(), start=1):
+            if snapshot.id == uuid:
+                return position
+        return None
+
+    def dispatch(self) -> List[str]:
+        """
+            Starts the queued jobs that fit in the limits. Returns their uuids.
+        """
+        with self.dispatch_lock:
+            if not self.acquire_lease():
+                return []
+
+            running_per_target: Dict[str, int] = {}
+            for job in self.started_jobs():
+                running_per_target[job.get("target")] = running_per_target.get(job.get("target"), 0) + 1
+            running = sum(running_per_target.values())
+
+            started = []
+            for snapshot in self.queued_jobs():
+                if 0 < MAX_CONCURRENT_JOBS <= running:
+                    break
+                target = snapshot.get("target")
+                if 0 < MAX_CONCURRENT_JOBS_PER_TARGET <= running_per_target.get(target, 0):
+                    continue
+                if self.dispatch_job(snapshot):
+                    running += 1
+                    running_per_target[target] = running_per_target.get(target, 0) + 1
+                    started.append(snapshot.id)
+            return started
+
+    def dispatch_job(self, snapshot: firestore.DocumentSnapshot) -> bool:
+        now = datetime.now(timezone.utc)
+        queue_wait_seconds = (now - snapshot.get("queued_at")).total_seconds()
+        try:
+            # Fails if the job changed since it was listed, e.g. if it was cancelled
+            with backend_call("firestore", "update"):
+                snapshot.reference.update(
+                    {"run_status": "pending", "dispatched_at": now, "queue_wait_seconds": queue_wait_seconds},
+                    option=get_client().write_option(last_update_time=snapshot.update_time),
+                )
+        except (exceptions.FailedPrecondition, exceptions.NotFound):
+            return False
+        self.wait_times.append(queue_wait_seconds)
+        QUEUE_WAIT.observe(queue_wait_seconds)
+
+        state = State.from_uuid(snapshot.id)
+        try:
+            self.start_job(state)
+        except Exception:
+            logging.error(f"Could not start queued job {snapshot.id}\n{traceback.format_exc()}")
+            state.run_status = "failed"
+        return True
+
+    @timed_backend_call("firestore", "transaction")
+    def acquire_lease(self) -> bool:
+        return acquire_lease(get_client().transaction(), self.lease, self.instance_id)
+
+    def wait_time_stats(self) -> dict:
+        wait_times = sorted(self.wait_times)
+        if len(wait_times) == 0:
+            return {"count": 0}
+        return {
+            "count": len(wait_times),
+            "mean": sum(wait_times) / len(wait_times),
+            "p50": wait_times[len(wait_times) // 2],
+            "p95": wait_times[min(len(wait_times) - 1, int(len(wait_times) * 0.95))],
+            "max": wait_times[-1],
+        }
+
+
+@firestore.transactional
+def acquire_lease(transaction: firestore.Transaction, lease: firestore.DocumentReference, instance_id: str) -> bool:
+    now = datetime.now(timezone.utc)
+    snapshot = lease.get(transaction=transaction)
+    if snapshot.exists and snapshot.get("holder") != instance_id and snapshot.get("expires_at") > now:
+        return False
+    transaction.set(lease, {"holder": instance_id, "expires_at": now + DISPATCHER_LEASE_DURATION})
+    return True
+
+
+def started_since(state_document: dict, oldest_start: datetime) -> bool:
+    # Documents written before jobs were timestamped have neither field, they are not counted
+    started_at = state_document.get("dispatched_at", state_document.get("created_at"))
+    return started_at is not None and started_at >= oldest_start
+
+
+def get_target(state_document: dict) -> str:
+    return state_document.get("dbt_native_params_overrides", {}).get("target", "default")
+
+
+def queue_order(state_document: dict) -> tuple:
+    priority = state_document.get("priority", PRIORITIES[-1])
+    return (PRIORITIES.index(priority) if priority in PRIORITIES else len(PRIORITIES), state_document["queued_at"])
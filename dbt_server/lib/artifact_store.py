@@ -0,0 +1,101 @@
+import hashlib
+from pathlib import Path, PurePosixPath
+import re
+import shutil
+import tarfile
+from tempfile import SpooledTemporaryFile
+from typing import IO, Dict, List
+
+from pydantic import BaseModel
+
+from dbt_server.lib.gcs import UPLOAD_CHUNK_SIZE, CloudStorage, map_concurrently
+from dbt_server.lib.metrics import SUBMISSION_BYTES
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class ArtifactHashes(BaseModel):
+    hashes: List[str]
+
+
+class ArtifactStore:
+    """
+        Content-addressed storage of the job artifacts (manifest, seeds) on GCS: each file is stored once
+        under cas/sha256/<hash> and jobs reference their artifacts as a {relative path: hash} mapping.
+    """
+    PREFIX = "cas/sha256/"
+
+    def __init__(self, gcs: CloudStorage):
+        self.gcs = gcs
+
+    def path(self, artifact_hash: str) -> str:
+        return self.PREFIX + artifact_hash
+
+    def missing(self, artifact_hashes: List[str]) -> List[str]:
+        validate_hashes(artifact_hashes)
+        exists = map_concurrently(lambda artifact_hash: self.gcs.exists(self.path(artifact_hash)), artifact_hashes)
+        return [artifact_hash for artifact_hash, artifact_exists in zip(artifact_hashes, exists) if not artifact_exists]
+
+    def save_archive(self, archive: IO[bytes]) -> List[str]:
+        """
+            Stores the members of a compressed tar stream (gzip, bz2 or xz) named after their sha256.
+            The archive is decompressed as it is read: each member is spooled (in memory up to 8 MiB, then on disk)
+            while its hash is computed, and uploaded once its content matches its name.
+        """
+        saved = []
+        extracted_bytes = 0
+        with tarfile.open(fileobj=archive, mode="r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    raise InvalidArtifact(f"Artifact archive member is not a file: {member.name}")
+                validate_hashes([member.name])
+                with SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE) as spooled_member:
+                    sha256 = hashlib.sha256()
+                    member_file = tar.extractfile(member)
+                    for block in iter(lambda: member_file.read(READ_BLOCK_SIZE), b''):
+                        sha256.update(block)
+                        spooled_member.write(block)
+                    if sha256.hexdigest() != member.name:
+                        raise InvalidArtifact(f"Content of artifact {member.name} does not match its hash")
+                    spooled_member.seek(0)
+                    self.gcs.save_stream(self.path(member.name), spooled_member, size=member.size)
+                saved.append(member.name)
+                extracted_bytes += member.size
+        SUBMISSION_BYTES.labels("extracted").observe(extracted_bytes)
+        return saved
+
+    def restore(self, artifacts: Dict[str, str], local_dir: str = ".") -> Dict[str, float]:
+        """
+            Returns the download time of each artifact, keyed by its path in the project.
+        """
+        by_hash = {self.path(artifact_hash): relative_path for relative_path, artifact_hash in artifacts.items()}
+        copies = {relative_path: by_hash[self.path(artifact_hash)] for relative_path, artifact_hash in artifacts.items()}
+        timings = self.gcs.download_many({
+            blob_name: str(Path(local_dir) / relative_path) for blob_name, relative_path in by_hash.items()
+        })
+        for relative_path, source_path in copies.items():
+            if relative_path != source_path:
+                file_path = Path(local_dir) / relative_path
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(Path(local_dir) / source_path, file_path)
+        return {by_hash[blob_name]: seconds for blob_name, seconds in timings.items()}
+
+
+def validate_artifacts(artifacts: Dict[str, str], check_hashes: bool = True) -> None:
+    if check_hashes:
+        validate_hashes(list(artifacts.values()))
+    for relative_path in artifacts.keys():
+        path = PurePosixPath(relative_path)
+        if path.is_absolute() or ".." in path.parts:
+            raise InvalidArtifact(f"Artifact path must be relative to the project: {relative_path}")
+
+
+def validate_hashes(artifact_hashes: List[str]) -> None:
+    for artifact_hash in artifact_hashes:
+        if not SHA256_PATTERN.match(artifact_hash):
+            raise InvalidArtifact(f"Invalid sha256 artifact hash: {artifact_hash}")
+
+
+class InvalidArtifact(Exception):
+    pass
@@ -0,0 +1,136 @@
+from datetime import datetime, timezone
+import logging
+import traceback
+from typing import Callable, List
+from uuid import uuid4
+
+from google.api_core import exceptions
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from dbt_server.lib.firestore import get_client, get_collection
+from dbt_server.lib.metrics import backend_call
+from dbt_server.lib.state import State
+
+BATCH_COLLECTION = "dbt-batch"
+FAILED_RUN_STATUSES = ["failed", "skipped"]
+FINAL_RUN_STATUSES = ["success"] + FAILED_RUN_STATUSES
+
+
+class Batch:
+    """
+        Group of jobs submitted together, stored in the dbt-batch collection. Each job keeps its own state;
+        the batch only records their order and mode, and aggregates their statuses.
+        In a pipeline, the jobs after the first one are blocked until the previous job succeeded,
+        and skipped if it failed.
+    """
+
+    def __init__(self, batch_id: str):
+        self.batch_id = batch_id
+        self.document = get_collection(BATCH_COLLECTION).document(batch_id)
+        self._snapshot: dict = None
+
+    @classmethod
+    def create(cls, mode: str, states: List[State]):
+        batch = cls(str(uuid4()))
+        batch._snapshot = {
+            "batch_id": batch.batch_id,
+            "mode": mode,
+            "jobs": [state.uuid for state in states],
+            "commands": [state.user_command for state in states],
+            "created_at": datetime.now(timezone.utc),
+        }
+        with backend_call("firestore", "set"):
+            batch.document.set(batch._snapshot)
+
+        for i, state in enumerate(states):
+            with state.batch():
+                state.update({"batch_id": batch.batch_id})
+                if mode == "pipeline" and i > 0:
+                    state.run_status = "blocked"
+        return batch
+
+    @property
+    def snapshot(self) -> dict:
+        if self._snapshot is None:
+            with backend_call("firestore", "get"):
+                self._snapshot = self.document.get().to_dict()
+        return self._snapshot
+
+    @property
+    def exists(self) -> bool:
+        return self.snapshot is not None
+
+    @property
+    def mode(self) -> str:
+        return self.snapshot["mode"]
+
+    @property
+    def jobs(self) -> List[str]:
+        return self.snapshot["jobs"]
+
+    @property
+    def commands(self) -> List[str]:
+        return self.snapshot["commands"]
+
+    def job_snapshots(self) -> List[firestore.DocumentSnapshot]:
+        status_collection = get_collection("dbt-status")
+        with backend_call("firestore", "get_all"):
+            snapshots = {snapshot.id: snapshot for snapshot in get_client().get_all([status_collection.document(uuid) for uuid in self.jobs])}
+        return [snapshots[uuid] for uuid in self.jobs]
+
+    def advance_pipeline(self, start_job: Callable[[State], None]) -> None:
+        """
+            Starts the first blocked job if the previous one succeeded, or skips the remaining jobs if it failed.
+        """
+        if self.mode != "pipeline":
+            return
+        previous_run_status = "success"
+        for snapshot in self.job_snapshots():
+            run_status = snapshot.get("run_status")
+            if run_status == "blocked":
+                if previous_run_status == "success":
+                    if claim_blocked_job(snapshot, "pending"):
+                        start_pipeline_job(State.from_uuid(snapshot.id), start_job)
+                    return
+                if previous_run_status in FAILED_RUN_STATUSES:
+                    claim_blocked_job(snapshot, "skipped")
+                    run_status = "skipped"
+            previous_run_status = run_status
+
+
+def claim_blocked_job(snapshot: firestore.DocumentSnapshot, new_run_status: str) -> bool:
+    # Conditional on the job not having changed since it was read, so that only one server instance claims it
+    try:
+        with backend_call("firestore", "update"):
+            snapshot.reference.update(
+                {"run_status": new_run_status},
+                option=get_client().write_option(last_update_time=snapshot.update_time),
+            )
+    except (exceptions.FailedPrecondition, exceptions.NotFound):
+        return False
+    return True
+
+
+def start_pipeline_job(state: State, start_job: Callable[[State], None]) -> None:
+    try:
+        start_job(state)
+    except Exception:
+        logging.error(f"Could not start pipeline job {state.uuid}\n{traceback.format_exc()}")
+        state.run_status = "failed"
+
+
+def advance_pipelines(start_job: Callable[[State], None]) -> None:
+    with backend_call("firestore", "query"):
+        blocked_jobs = get_collection("dbt-status").where(filter=FieldFilter("run_status", "==", "blocked")).stream()
+        batch_ids = {snapshot.get("batch_id") for snapshot in blocked_jobs}
+    for batch_id in batch_ids:
+        Batch(batch_id).advance_pipeline(start_job)
+
+
+def aggregate_run_status(run_statuses: List[str]) -> str:
+    if any(run_status not in FINAL_RUN_STATUSES for run_status in run_statuses):
+        return "running"
+    if all(run_status == "success" for run_status in run_statuses):
+        return "success"
+    return "failed"
@@ -0,0 +1,75 @@
+import threading
+from typing import Any, Callable, Dict
+
+from google.cloud import firestore, run_v2, storage
+from google.cloud.logging import Client as LoggingClient
+from google.cloud.scheduler_v1 import CloudSchedulerClient
+
+
+class Clients:
+    """
+        Google Cloud clients shared by the whole process. Each client is created on first use, so that
+        credentials discovery and channel setup happen once instead of once per request.
+        Clients given to the constructor are used as is, which allows tests to swap in fakes.
+    """
+
+    def __init__(self, **clients: Any):
+        self._clients: Dict[str, Any] = dict(clients)
+        self._lock = threading.Lock()
+
+    @property
+    def firestore(self) -> firestore.Client:
+        return self.get("firestore", firestore.Client)
+
+    @property
+    def storage(self) -> storage.Client:
+        return self.get("storage", storage.Client)
+
+    @property
+    def jobs(self) -> run_v2.JobsClient:
+        return self.get("jobs", run_v2.JobsClient)
+
+    @property
+    def scheduler(self) -> CloudSchedulerClient:
+        return self.get("scheduler", CloudSchedulerClient)
+
+    @property
+    def logging(self) -> LoggingClient:
+        return self.get("logging", LoggingClient)
+
+    def get(self, name: str, create_client: Callable[[], Any]) -> Any:
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = create_client()
+                    self._clients[name] = client
+        return client
+
+    def close(self) -> None:
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            if hasattr(client, "close"):
+                client.close()
+            elif hasattr(client, "transport"):
+                client.transport.close()
+
+
+_clients: Clients = None
+_clients_lock = threading.Lock()
+
+
+def get_clients() -> Clients:
+    global _clients
+    if _clients is None:
+        with _clients_lock:
+            if _clients is None:
+                _clients = Clients()
+    return _clients
+
+
+def set_clients(clients: Clients) -> None:
+    global _clients
+    _clients = clients
@@ -1,8 +1,10 @@
 from dataclasses import dataclass
-from google.cloud.scheduler_v1 import HttpTarget, HttpMethod, CloudSchedulerClient
+from google.cloud.scheduler_v1 import HttpTarget, HttpMethod
 from google.api_core.exceptions import AlreadyExists, NotFound
 
+from dbt_server.lib.clients import get_clients
 from dbt_server.lib.logger import DbtLogger
+from dbt_server.lib.metrics import timed_backend_call
 
 
 @dataclass
@@ -20,8 +22,9 @@ class CloudScheduler:
         self.service_account_email = service_account_email
 
         self.parent = f"projects/{self.project_id}/locations/{self.location}"
-        self.client = CloudSchedulerClient()
+        self.client = get_clients().scheduler
 
+    @timed_backend_call("scheduler", "create_job")
     def create_http_scheduled_job(self, scheduler_job_spec: SchedulerHTTPJobSpec):
         job = {
             "name": f"{self.parent}/jobs/{scheduler_job_spec.job_name}",
@@ -47,10 +50,12 @@ class CloudScheduler:
             self.client.delete_job(name=job["name"])
             self.client.create_job(parent=self.parent, job=job)
 
+    @timed_backend_call("scheduler", "list_jobs")
     def list(self):
         jobs = self.client.list_jobs(parent=self.parent)
         return list(jobs)
 
+    @timed_backend_call("scheduler", "delete_job")
     def delete(self, name: str) -> bool:
         try:
             self.client.delete_job(name=f"{self.parent}/jobs/{name}")
@@ -1,8 +1,16 @@
 from dataclasses import dataclass
+import hashlib
+import threading
+from typing import Dict, List
+
+from google.api_core.exceptions import AlreadyExists
 from google.cloud import run_v2
 
+from dbt_server.lib.clients import get_clients
+from dbt_server.lib.metrics import backend_call
 from dbt_server.lib.state import State
 from dbt_server.lib.logger import DbtLogger
+from dbt_server.version import __version__
 
 
 @dataclass
@@ -14,63 +22,131 @@ class DbtCloudRunJobConfig:
     service_account: str
     job_docker_image: str
     artifacts_bucket_name: str
+    reuse_job: bool = False
+    task_count: int = 1  # Above 1, each task runs a shard of the command (see dbt_run_job.run_shard)
 
 
 class DbtCloudRunJobStarter:
+    """
+        Starts the Cloud Run job executing a dbt command. By default, a new job is created for each command.
+        With reuse_job, a single job definition per image and config is kept, and each command is started
+        as an execution of that job, with DBT_COMMAND and UUID given as container overrides.
+    """
+    template_jobs: Dict[str, run_v2.types.Job] = {}
+    template_jobs_lock = threading.Lock()
+
     def __init__(self, dbt_job_config: DbtCloudRunJobConfig, logger: DbtLogger):
         self.dbt_job_config = dbt_job_config
         self.state = State.from_uuid(dbt_job_config.uuid)
         self.logger = logger
 
     def start(self) -> None:
-        job = self.create_job()
+        with self.state.span("cloud_run_job_creation"):
+            job = self.get_template_job() if self.dbt_job_config.reuse_job else self.create_job()
         self.launch_job(job)
 
     def create_job(self) -> run_v2.types.Job:
         self.logger.log("INFO", f"Creating cloud run job {self.state.uuid} with command 'dbt {self.dbt_job_config.dbt_command}'")
 
-        job = run_v2.Job()
-        job.template.template.max_retries = 0
-        job.template.template.service_account = self.dbt_job_config.service_account
-        job.template.template.containers = [{
-            "image": self.dbt_job_config.job_docker_image,
-            "env": [
-                {"name": "DBT_COMMAND", "value": self.dbt_job_config.dbt_command},
-                {"name": "UUID", "value": self.state.uuid},
-                {"name": "SCRIPT", "value": "dbt_server/dbt_run_job.py"},
-                {"name": "BUCKET_NAME", "value": self.dbt_job_config.artifacts_bucket_name},
-            ]
-        }]
-
         request = run_v2.CreateJobRequest(
-            parent=f"projects/{self.dbt_job_config.project_id}/locations/{self.dbt_job_config.location}",
+            parent=self.parent,
             job_id=f"u{self.state.uuid.replace('-', '')}", # job_id must start with a letter and cannot contain '-'
-            job=job
+            job=self.build_job(self.command_env(), self.dbt_job_config.task_count)
         )
 
         try:
-            operation = run_v2.JobsClient().create_job(request=request)
+            with backend_call("cloud_run", "create_job"):
+                operation = get_clients().jobs.create_job(request=request)
         except Exception:
             raise DbtCloudRunJobCreationFailed(f"Cloud Run job creation failed")
 
-        response = operation.result()
+        with backend_call("cloud_run", "create_job_result"):
+            response = operation.result()
         self.logger.log("INFO", f"Job created: {response.name}")
 
         return response
 
+    def get_template_job(self) -> run_v2.types.Job:
+        """
+            The template job is created, or updated to the current image and config, once per server process.
+        """
+        job_id = self.template_job_id
+        with self.template_jobs_lock:
+            if job_id not in self.template_jobs:
+                self.logger.log("INFO", f"Creating or updating cloud run template job {job_id}")
+                job = self.build_job(self.command_env(dbt_command="", uuid=""))
+                try:
+                    try:
+                        with backend_call("cloud_run", "create_job"):
+                            operation = get_clients().jobs.create_job(request=run_v2.CreateJobRequest(parent=self.parent, job_id=job_id, job=job))
+                    except AlreadyExists:
+                        job.name = f"{self.parent}/jobs/{job_id}"
+                        with backend_call("cloud_run", "update_job"):
+                            operation = get_clients().jobs.update_job(request=run_v2.UpdateJobRequest(job=job))
+                    with backend_call("cloud_run", "create_job_result"):
+                        self.template_jobs[job_id] = operation.result()
+                except Exception:
+                    raise DbtCloudRunJobCreationFailed(f"Cloud Run template job creation failed")
+            return self.template_jobs[job_id]
+
+    def build_job(self, env: List[Dict[str, str]], task_count: int = 1) -> run_v2.types.Job:
+        job = run_v2.Job()
+        job.template.task_count = task_count
+        job.template.template.max_retries = 0
+        job.template.template.service_account = self.dbt_job_config.service_account
+        job.template.template.containers = [{
+            "image": self.dbt_job_config.job_docker_image,
+            "env": env,
+        }]
+        return job
+
+    def command_env(self, dbt_command: str = None, uuid: str = None) -> List[Dict[str, str]]:
+        return [
+            {"name": "DBT_COMMAND", "value": self.dbt_job_config.dbt_command if dbt_command is None else dbt_command},
+            {"name": "UUID", "value": self.state.uuid if uuid is None else uuid},
+            {"name": "SCRIPT", "value": "dbt_server/dbt_run_job.py"},
+            {"name": "BUCKET_NAME", "value": self.dbt_job_config.artifacts_bucket_name},
+        ]
+
+    @property
+    def parent(self) -> str:
+        return f"projects/{self.dbt_job_config.project_id}/locations/{self.dbt_job_config.location}"
+
+    @property
+    def template_job_id(self) -> str:
+        job_definition = "|".join([
+            __version__,
+            self.dbt_job_config.job_docker_image,
+            self.dbt_job_config.service_account,
+            self.dbt_job_config.artifacts_bucket_name,
+        ])
+        return f"dbt-server-job-{hashlib.sha256(job_definition.encode()).hexdigest()[:12]}"
 
     def launch_job(self, job: run_v2.types.Job):
         self.logger.log("INFO", f"Starting job: {job.name}'")
 
-        client = run_v2.JobsClient()
+        client = get_clients().jobs
         request = run_v2.RunJobRequest(name=job.name)
+        if self.dbt_job_config.reuse_job:
+            request.overrides = run_v2.RunJobRequest.Overrides(
+                container_overrides=[
+                    run_v2.RunJobRequest.Overrides.ContainerOverride(env=[
+                        run_v2.EnvVar(name="DBT_COMMAND", value=self.dbt_job_config.dbt_command),
+                        run_v2.EnvVar(name="UUID", value=self.state.uuid),
+                    ])
+                ],
+                task_count=self.dbt_job_config.task_count,
+            )
 
         try:
-            client.run_job(request=request)
+            with self.state.span("cloud_run_job_start"), backend_call("cloud_run", "run_job"):
+                client.run_job(request=request)
         except Exception:
             raise DbtCloudRunJobStartFailed(f"Cloud Run job start failed")
 
-        self.state.run_status = "running"
+        with self.state.batch():
+            self.state.run_status = "running"
+            self.state.update({"cloud_run_job": job.name})
 
 
 class DbtCloudRunJobCreationFailed(Exception):
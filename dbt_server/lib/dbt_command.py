@@ -1,8 +1,12 @@
 from dataclasses import dataclass
-from typing import Dict
+import hashlib
+import json
+from typing import Dict, List
 from fastapi import File, Form, UploadFile
 import yaml
 
+BATCH_MODES = ["parallel", "pipeline"]
+
 
 @dataclass
 class DbtCommand:
@@ -12,15 +16,69 @@ class DbtCommand:
     dbt_project: str | Dict = Form(...)
     profiles: str | Dict = Form(...)
     packages: str | Dict = Form("{}")
-    zipped_artifacts: UploadFile = File(...)  # Manifest and seeds
+    artifacts: str | Dict = Form("{}")  # Manifest and seeds, as {relative path: sha256} of files in the artifact store
+    zipped_artifacts: UploadFile = File(None)  # Manifest and seeds, when they are not in the artifact store
+    coalesce: bool = Form(False)  # Attach to a running job with the same fingerprint instead of starting a new one
+    shards: int = Form(1)  # Number of Cloud Run tasks the selection is split across
 
     def __post_init__(self):
         self.dbt_native_params_overrides = yaml.safe_load(self.dbt_native_params_overrides)
         self.dbt_project = yaml.safe_load(self.dbt_project)
         self.profiles = yaml.safe_load(self.profiles)
         self.packages = yaml.safe_load(self.packages)
+        self.artifacts = yaml.safe_load(self.artifacts)
+
+    def fingerprint(self) -> str:
+        """
+            Identifies what the command runs: two commands with the same fingerprint produce the same job.
+        """
+        return hashlib.sha256(json.dumps({
+            "user_command": self.user_command,
+            "dbt_native_params_overrides": self.dbt_native_params_overrides,
+            "dbt_project": self.dbt_project,
+            "profiles": self.profiles,
+            "packages": self.packages,
+            "artifacts": self.artifacts,
+            "shards": self.shards,
+        }, sort_keys=True, default=str).encode()).hexdigest()
 
 @dataclass
 class ScheduledDbtCommand(DbtCommand):
     schedule: str = Form(...)
     schedule_name: str = Form(None)
+
+
+@dataclass
+class DbtBatchCommand:
+    """
+        Several dbt commands sharing the same project files and artifacts, run in parallel or as a pipeline,
+        where each command starts once the previous one succeeded.
+    """
+    server_url: str = Form(...)
+    commands: str = Form(...)  # json list of dbt commands, ex: ["seed", "run --select my_model+"]
+    mode: str = Form("parallel")
+    dbt_native_params_overrides: str = Form("{}")
+    dbt_project: str = Form(...)
+    profiles: str = Form(...)
+    packages: str = Form("{}")
+    artifacts: str = Form("{}")
+
+    def __post_init__(self):
+        self.commands = json.loads(self.commands)
+
+    def dbt_commands(self) -> List[DbtCommand]:
+        return [
+            DbtCommand(
+                server_url=self.server_url,
+                user_command=user_command,
+                dbt_native_params_overrides=self.dbt_native_params_overrides,
+                dbt_project=self.dbt_project,
+                profiles=self.profiles,
+                packages=self.packages,
+                artifacts=self.artifacts,
+                zipped_artifacts=None,
+                coalesce=False,
+                shards=1,
+            )
+            for user_command in self.commands
+        ]
@@ -1,7 +1,10 @@
 from google.cloud import firestore
 
+from dbt_server.lib.clients import get_clients
+
+
 def get_collection(collection_name: str) -> firestore.CollectionReference:
     return get_client().collection(collection_name)
 
 def get_client() -> firestore.Client:
-    return firestore.Client()
+    return get_clients().firestore
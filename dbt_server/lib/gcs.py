@@ -1,10 +1,27 @@
-from functools import cache
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import time
+from typing import IO, Any, Callable, Dict, List, Union
 
 from google.cloud import storage
 from google.api_core import exceptions
 from google.api_core.retry import Retry
 
+from dbt_server.lib.clients import get_clients
+from dbt_server.lib.metrics import timed_backend_call
+
+MAX_COMPOSE_SOURCES = 32
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Must be a multiple of 256 KiB
+MAX_TRANSFER_WORKERS = int(os.getenv("GCS_MAX_TRANSFER_WORKERS", "8"))
+
+
+@dataclass
+class StreamSource:
+    open: Callable[[], IO[bytes]]
+    size: int = None
+
 
 class CloudStorage:
 
@@ -12,13 +29,27 @@ class CloudStorage:
         self.client = client if client is not None else connect_client()
         self.bucket_name = bucket_name
 
-    def save(self, file_name: str, data: str) -> None:
+    @timed_backend_call("gcs", "save")
+    def save(self, file_name: str, data: str, if_generation_match: int = None) -> None:
         storage_client = self.client
         bucket = storage_client.bucket(self.bucket_name)
         blob = bucket.blob(file_name)
         retry_policy = define_retry_policy()  # handle 429 error with exponential backoff
-        blob.upload_from_string(data, num_retries=5, retry=retry_policy)
+        blob.upload_from_string(data, num_retries=5, retry=retry_policy, if_generation_match=if_generation_match)
+
+    @timed_backend_call("gcs", "save_stream")
+    def save_stream(self, file_name: str, file_obj: IO[bytes], size: int = None) -> None:
+        """
+            Files up to 8 MiB are sent in a single request, larger ones through a resumable upload in 8 MiB chunks,
+            so that memory use is bounded whatever the file size.
+        """
+        storage_client = self.client
+        bucket = storage_client.bucket(self.bucket_name)
+        blob = bucket.blob(file_name, chunk_size=UPLOAD_CHUNK_SIZE)
+        retry_policy = define_retry_policy()  # handle 429 error with exponential backoff
+        blob.upload_from_file(file_obj, size=size, num_retries=5, retry=retry_policy)
 
+    @timed_backend_call("gcs", "load")
     def load(self, file_name: str, start_byte: int = 0) -> bytes:
         storage_client = self.client
         bucket = storage_client.get_bucket(self.bucket_name)
@@ -31,18 +62,111 @@ class CloudStorage:
         else:
             return b''
 
-    def get_files_from_folder(self, folder_name: str) -> Dict[str, bytes]:
+    @timed_backend_call("gcs", "exists")
+    def exists(self, file_name: str) -> bool:
         storage_client = self.client
-        blobs = {}
-        for blob in storage_client.list_blobs(self.bucket_name, prefix=folder_name):
-            file_name = blob.name.split('/')[-1]
-            blobs[file_name] = blob.download_as_bytes(client=None)
-        return blobs
+        bucket = storage_client.bucket(self.bucket_name)
+        return bucket.blob(file_name).exists()
+
+    @timed_backend_call("gcs", "download")
+    def download_to_file(self, file_name: str, local_path: str) -> None:
+        storage_client = self.client
+        bucket = storage_client.bucket(self.bucket_name)
+        bucket.blob(file_name).download_to_filename(local_path)
+
+    def upload_many(self, files: Dict[str, Union[str, bytes, StreamSource]]) -> Dict[str, float]:
+        """
+            Uploads {blob name: content or stream} concurrently and returns the upload time of each blob, in seconds.
+        """
+        def upload(file_name: str) -> None:
+            source = files[file_name]
+            if isinstance(source, StreamSource):
+                with source.open() as file_obj:
+                    self.save_stream(file_name, file_obj, size=source.size)
+            else:
+                self.save(file_name, source)
+
+        return timed_concurrently(upload, list(files.keys()))
+
+    def download_many(self, files: Dict[str, str]) -> Dict[str, float]:
+        """
+            Downloads {blob name: local path} concurrently and returns the download time of each blob, in seconds.
+        """
+        def download(file_name: str) -> None:
+            local_path = Path(files[file_name])
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+            self.download_to_file(file_name, str(local_path))
+
+        return timed_concurrently(download, list(files.keys()))
+
+    def download_folder(self, folder_name: str, local_dir: str = ".") -> Dict[str, float]:
+        """
+            Downloads every blob under folder_name, keeping their path relative to the folder.
+        """
+        folder_name = folder_name.rstrip("/") + "/"
+        return self.download_many({
+            file_name: str(Path(local_dir) / file_name[len(folder_name):])
+            for file_name in self.list_files(folder_name)
+        })
+
+    @timed_backend_call("gcs", "get_files_from_folder")
+    def get_files_from_folder(self, folder_name: str, start_offset: str = None) -> Dict[str, bytes]:
+        """
+            Downloads the blobs concurrently, returned in listing order.
+        """
+        storage_client = self.client
+        blobs = list(storage_client.list_blobs(self.bucket_name, prefix=folder_name, start_offset=start_offset))
+        contents = map_concurrently(lambda blob: blob.download_as_bytes(client=None), blobs)
+        return {blob.name.split('/')[-1]: content for blob, content in zip(blobs, contents)}
+
+    @timed_backend_call("gcs", "list")
+    def list_files(self, folder_name: str) -> List[str]:
+        storage_client = self.client
+        return [blob.name for blob in storage_client.list_blobs(self.bucket_name, prefix=folder_name)]
+
+    @timed_backend_call("gcs", "compose")
+    def compose(self, file_names: List[str], destination: str) -> None:
+        """
+            GCS composes at most 32 objects per request, longer lists are folded into the destination.
+        """
+        storage_client = self.client
+        bucket = storage_client.bucket(self.bucket_name)
+        destination_blob = bucket.blob(destination)
+        sources = [bucket.blob(file_name) for file_name in file_names]
+
+        destination_blob.compose(sources[:MAX_COMPOSE_SOURCES])
+        for i in range(MAX_COMPOSE_SOURCES, len(sources), MAX_COMPOSE_SOURCES - 1):
+            destination_blob.compose([destination_blob] + sources[i:i + MAX_COMPOSE_SOURCES - 1])
+
+
+def map_concurrently(function: Callable[[Any], Any], items: List[Any]) -> List[Any]:
+    """
+        Applies function to items on a bounded thread pool. The first exception raised is propagated.
+    """
+    if len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(MAX_TRANSFER_WORKERS, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+def timed_concurrently(transfer: Callable[[str], None], file_names: List[str]) -> Dict[str, float]:
+    def timed_transfer(file_name: str) -> float:
+        start = time.perf_counter()
+        transfer(file_name)
+        return time.perf_counter() - start
+
+    return dict(zip(file_names, map_concurrently(timed_transfer, file_names)))
+
+
+def describe_transfers(timings: Dict[str, float]) -> str:
+    if not timings:
+        return "0 files"
+    slowest = max(timings, key=timings.get)
+    return f"{len(timings)} files, slowest {slowest} in {timings[slowest]:.2f}s"
 
 
-@cache
 def connect_client() -> storage.Client:
-    return storage.Client()
+    return get_clients().storage
 
 
 def get_blob_size(bucket: storage.Bucket, blob_name: str) -> int:
@@ -0,0 +1,98 @@
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+import os
+import queue
+import time
+from typing import Optional
+
+from google.cloud import firestore
+
+from dbt_server.lib.firestore import get_client, get_collection
+from dbt_server.lib.metrics import backend_call
+
+JOB_QUEUE = os.getenv("JOB_QUEUE", "firestore")
+QUEUE_COLLECTION = "dbt-queue"
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "0.5"))
+CLAIM_CANDIDATES = 10
+
+
+@dataclass
+class QueuedJob:
+    uuid: str
+    dbt_command: str
+    enqueued_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @classmethod
+    def from_dict(cls, job: dict):
+        return cls(**{key: job[key] for key in cls.__dataclass_fields__.keys() if key in job})
+
+
+class FirestoreJobQueue:
+    """
+        Queued jobs are documents of the dbt-queue collection, ordered by enqueue time.
+        A worker claims a job by deleting its document in a transaction, so each job is taken by exactly one worker.
+    """
+
+    def __init__(self):
+        self.collection = get_collection(QUEUE_COLLECTION)
+
+    def put(self, job: QueuedJob) -> None:
+        with backend_call("firestore", "set"):
+            self.collection.document(job.uuid).set(asdict(job))
+
+    def claim(self, timeout: float) -> Optional[QueuedJob]:
+        deadline = time.monotonic() + timeout
+        while True:
+            query = self.collection.order_by("enqueued_at").limit(CLAIM_CANDIDATES)
+            with backend_call("firestore", "query"):
+                snapshots = list(query.stream())
+            for snapshot in snapshots:
+                with backend_call("firestore", "transaction"):
+                    job = claim_document(get_client().transaction(), snapshot.reference)
+                if job is not None:
+                    return job
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(QUEUE_POLL_INTERVAL)
+
+
+@firestore.transactional
+def claim_document(transaction: firestore.Transaction, reference: firestore.DocumentReference) -> Optional[QueuedJob]:
+    snapshot = reference.get(transaction=transaction)
+    if not snapshot.exists:  # Claimed by another worker
+        return None
+    transaction.delete(reference)
+    return QueuedJob.from_dict(snapshot.to_dict())
+
+
+class LocalJobQueue:
+    """
+        In-process stand-in for the Firestore queue, for tests and for running the server and a worker in one process.
+    """
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+
+    def put(self, job: QueuedJob) -> None:
+        self.jobs.put(job)
+
+    def claim(self, timeout: float) -> Optional[QueuedJob]:
+        try:
+            return self.jobs.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+_job_queue = None
+
+
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = LocalJobQueue() if JOB_QUEUE == "local" else FirestoreJobQueue()
+    return _job_queue
+
+
+def set_job_queue(job_queue) -> None:
+    global _job_queue
+    _job_queue = job_queue
@@ -7,9 +7,23 @@ from google.cloud.logging.handlers import CloudLoggingHandler
 from google.cloud.logging_v2.resource import Resource
 from google.cloud.logging_v2.handlers._monitored_resources import retrieve_metadata_server, _REGION_ID, _PROJECT_NAME
 
+from dbt_server.lib.clients import get_clients
 from dbt_server.lib.state import State
 
 
+LOG_LEVELS = {
+    "DEFAULT": 0,
+    "DEBUG": 10,
+    "INFO": 20,
+    "NOTICE": 20,
+    "WARN": 30,
+    "ERROR": 40,
+    "CRITICAL": 50,
+    "ALERT": 50,
+    "EMERGENCY": 50,
+}
+
+
 class DbtLogger:
 
     def __init__(self, server: bool = False):
@@ -18,7 +32,7 @@ class DbtLogger:
 
         self._state: State = None
 
-        self.logging_client = Client()
+        self.logging_client = get_clients().logging
         self.logger = self.init_logger()
         self.logger.info(f"Initialized logger")
 
@@ -42,7 +56,8 @@ class DbtLogger:
         _addGcloudLoggingLevel()
         logger = logging.getLogger(__name__)
 
-        if not self.local:
+        # The logger is shared by the whole process, its Cloud Logging handler only needs to be added once
+        if not self.local and not any(isinstance(handler, CloudLoggingHandler) for handler in logger.handlers):
             if self.logging_client is None:
                 raise Exception("No Cloud Logging client given and not running locally")
             if self.server:
@@ -94,21 +109,10 @@ def job_cloud_handler(logging_client: Client):
 
 
 def get_log_level(severity: str):
-    level_dict = {
-        "DEFAULT": 0,
-        "DEBUG": 10,
-        "INFO": 20,
-        "NOTICE": 20,
-        "WARN": 30,
-        "ERROR": 40,
-        "CRITICAL": 50,
-        "ALERT": 50,
-        "EMERGENCY": 50,
-    }
-    if severity.upper() in level_dict.keys():
-        return level_dict[severity.upper()]
-    else:
+    log_level = LOG_LEVELS.get(severity.upper())
+    if log_level is None:
         raise Exception(f"Unknown severity: {severity}")
+    return log_level
 
 
 def _addGcloudLoggingLevel():
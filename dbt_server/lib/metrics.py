@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+from functools import wraps
+import logging
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Iterator, List
+
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+JOB_STATUS_METRICS_INTERVAL = float(os.getenv("JOB_STATUS_METRICS_INTERVAL", "15"))
+
+REQUEST_LATENCY = Histogram(
+    "dbt_server_request_duration_seconds",
+    "Time until the response starts, by route. Streaming responses are measured until their first bytes.",
+    ["method", "route", "status"],
+)
+BACKEND_CALL_LATENCY = Histogram(
+    "dbt_server_backend_call_duration_seconds",
+    "Calls to Firestore, Cloud Storage, Cloud Run and Cloud Scheduler.",
+    ["backend", "operation"],
+)
+BACKEND_CALL_ERRORS = Counter(
+    "dbt_server_backend_call_errors_total",
+    "Calls to Firestore, Cloud Storage, Cloud Run and Cloud Scheduler that raised an exception.",
+    ["backend", "operation"],
+)
+SUBMISSION_BYTES = Histogram(
+    "dbt_server_submission_bytes",
+    "Artifact bytes per submission: received in the request body, and extracted from zips and archives.",
+    ["stage"],
+    buckets=[2 ** exponent for exponent in range(10, 32, 2)],  # 1 KiB to 1 GiB
+)
+QUEUE_WAIT = Histogram(
+    "dbt_server_queue_wait_seconds",
+    "Time jobs spent queued by the admission controller before being started.",
+    buckets=[0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600],
+)
+JOBS_SUBMITTED = Counter("dbt_server_jobs_submitted_total", "Jobs created, by submission endpoint.", ["endpoint"])
+LOG_BYTES_WRITTEN = Counter("dbt_server_log_bytes_written_total", "Bytes of run logs written to Cloud Storage.")
+
+
+@contextmanager
+def backend_call(backend: str, operation: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        BACKEND_CALL_ERRORS.labels(backend, operation).inc()
+        raise
+    finally:
+        BACKEND_CALL_LATENCY.labels(backend, operation).observe(time.perf_counter() - start)
+
+
+def timed_backend_call(backend: str, operation: str) -> Callable:
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with backend_call(backend, operation):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RequestLatencyMiddleware:
+    """
+        ASGI middleware observing the latency of each request, labelled with its route template
+        (e.g. /job/{uuid}) rather than its path, to keep the number of series bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        async def send_and_observe(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                REQUEST_LATENCY.labels(
+                    scope["method"], route.path if route is not None else "unmatched", str(message["status"])
+                ).observe(time.perf_counter() - start)
+            await send(message)
+
+        await self.app(scope, receive, send_and_observe)
+
+
+class JobStatusCollector(Collector):
+    """
+        Number of active jobs by status, and the admission queue depth, read from Firestore when scraped.
+        The counts are cached for JOB_STATUS_METRICS_INTERVAL seconds, so that frequent scrapes do not add reads.
+    """
+
+    def __init__(self, count_jobs_by_status: Callable[[], dict], statuses: List[str]):
+        self.count_jobs_by_status = count_jobs_by_status
+        self.statuses = statuses
+        self.counts: dict = None
+        self.counted_at = 0.0
+        self.lock = threading.Lock()
+
+    def describe(self):
+        # Lets the registry check the metric names without counting jobs when the collector is registered
+        return [
+            GaugeMetricFamily("dbt_server_jobs", "Active jobs by status.", labels=["status"]),
+            GaugeMetricFamily("dbt_server_queue_depth", "Jobs waiting for an admission slot."),
+        ]
+
+    def collect(self):
+        with self.lock:
+            if self.counts is None or time.monotonic() - self.counted_at >= JOB_STATUS_METRICS_INTERVAL:
+                try:
+                    self.counts = self.count_jobs_by_status()
+                    self.counted_at = time.monotonic()
+                except Exception:
+                    logging.warning(f"Could not count jobs by status\n{traceback.format_exc()}")
+            counts = self.counts
+        if counts is None:
+            return
+
+        jobs = GaugeMetricFamily("dbt_server_jobs", "Active jobs by status.", labels=["status"])
+        for status in self.statuses:
+            jobs.add_metric([status], counts.get(status, 0))
+        yield jobs
+        yield GaugeMetricFamily("dbt_server_queue_depth", "Jobs waiting for an admission slot.", value=counts.get("queued", 0))
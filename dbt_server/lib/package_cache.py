@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tarfile
+import tempfile
+from typing import List, Optional
+
+from google.api_core import exceptions
+import yaml
+
+from dbt_server.lib.gcs import CloudStorage
+
+PACKAGES_CACHE_PREFIX = "packages-cache/"
+# Archives baked in the image (see __main__ below), checked before the bucket
+PREBAKED_PACKAGES_DIR = os.getenv("PREBAKED_PACKAGES_DIR", str(Path.home() / "packages-cache"))
+DEFAULT_PACKAGES_INSTALL_PATH = "dbt_packages"
+
+
+class PackageCache:
+    """
+        Archives of installed dbt packages (the dbt_packages folder), keyed by the hash of packages.yml
+        and the dbt version, so that dbt deps only runs once for a given set of packages.
+    """
+
+    def __init__(self, gcs: Optional[CloudStorage], packages: str, dbt_version: str, prebaked_dir: str = PREBAKED_PACKAGES_DIR):
+        self.gcs = gcs
+        # Parsed, so that the key does not depend on formatting: jobs get packages.yml re-dumped by the server
+        packages_json = json.dumps(yaml.safe_load(packages), sort_keys=True)
+        self.key = hashlib.sha256(f"{dbt_version}\n{packages_json}".encode()).hexdigest()
+        self.prebaked_archive = Path(prebaked_dir) / f"{self.key}.tar.gz"
+
+    @property
+    def blob_name(self) -> str:
+        return f"{PACKAGES_CACHE_PREFIX}{self.key}.tar.gz"
+
+    def restore(self, install_path: str) -> Optional[str]:
+        """
+            Extracts the cached packages into install_path. Returns where they came from, or None on a cache miss.
+        """
+        if self.prebaked_archive.is_file():
+            extract_archive(self.prebaked_archive, install_path)
+            return "image"
+
+        if self.gcs is None:
+            return None
+        with tempfile.TemporaryDirectory() as download_dir:
+            archive = Path(download_dir) / "packages.tar.gz"
+            try:
+                self.gcs.download_to_file(self.blob_name, str(archive))
+            except exceptions.NotFound:
+                return None
+            extract_archive(archive, install_path)
+        return f"gs://{self.gcs.bucket_name}/{self.blob_name}"
+
+    def save(self, install_path: str) -> None:
+        with tempfile.TemporaryDirectory() as archive_dir:
+            archive = Path(archive_dir) / "packages.tar.gz"
+            create_archive(install_path, archive)
+            with open(archive, 'rb') as f:
+                self.gcs.save_stream(self.blob_name, f, size=archive.stat().st_size)
+
+    def prebake(self, install_path: str) -> None:
+        self.prebaked_archive.parent.mkdir(parents=True, exist_ok=True)
+        create_archive(install_path, self.prebaked_archive)
+
+
+def has_packages(packages: str) -> bool:
+    """
+        Whether a packages.yml lists packages. The server writes one for every job, "{}" when there are none.
+    """
+    try:
+        packages_yml = yaml.safe_load(packages)
+    except yaml.YAMLError:
+        return True  # Reported by dbt deps
+    return isinstance(packages_yml, dict) and len(packages_yml.get("packages") or []) > 0
+
+
+def create_archive(install_path: str, archive: Path) -> None:
+    with tarfile.open(archive, "w:gz") as tar:
+        tar.add(install_path, arcname=".")
+
+
+def extract_archive(archive: Path, install_path: str) -> None:
+    Path(install_path).mkdir(parents=True, exist_ok=True)
+    with tarfile.open(archive, "r:gz") as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(install_path, filter="data")
+        else:  # Extraction filters were added in Python 3.10.12
+            tar.extractall(install_path, members=checked_members(tar, install_path))
+
+
+def checked_members(tar: tarfile.TarFile, install_path: str) -> List[tarfile.TarInfo]:
+    """
+        The checks of the "data" extraction filter that matter for package archives: regular files, folders
+        and links, all inside install_path.
+    """
+    root = Path(install_path).resolve()
+
+    def is_inside(path: Path) -> bool:
+        return path == root or root in path.parents
+
+    for member in tar.getmembers():
+        member.name = member.name.lstrip("/")  # As the filter does, absolute paths are extracted in install_path
+        path = (root / member.name).resolve()
+        if not is_inside(path):
+            raise tarfile.TarError(f"Archive member {member.name} is outside of {install_path}")
+        if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+            raise tarfile.TarError(f"Archive member {member.name} is not a file, a folder or a link")
+        if member.issym() and not is_inside((path.parent / member.linkname).resolve()):
+            raise tarfile.TarError(f"Archive member {member.name} links outside of {install_path}")
+        if member.islnk() and not is_inside((root / member.linkname).resolve()):
+            raise tarfile.TarError(f"Archive member {member.name} links outside of {install_path}")
+    return tar.getmembers()
+
+
+if __name__ == "__main__":
+    # Bakes the packages of a packages.yml in the image, see the Dockerfile: python3 dbt_server/lib/package_cache.py packages.yml
+    from dbt.version import __version__ as dbt_version
+
+    with open(sys.argv[1], 'r') as f:
+        packages = f.read()
+    with tempfile.TemporaryDirectory() as project_dir:
+        Path(project_dir, "packages.yml").write_text(packages)
+        Path(project_dir, "dbt_project.yml").write_text("name: package_cache\nversion: '1.0'\nconfig-version: 2\n")
+        subprocess.run(["dbt", "deps", "--project-dir", project_dir], check=True)
+        PackageCache(None, packages, dbt_version).prebake(str(Path(project_dir) / DEFAULT_PACKAGES_INSTALL_PATH))
@@ -0,0 +1,151 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+from dbt_server.lib.firestore import get_collection
+
+SHARD_COLLECTION = "dbt-shards"
+SHARD_POLL_INTERVAL = float(os.getenv("SHARD_POLL_INTERVAL", "1"))
+SHARD_BARRIER_TIMEOUT = float(os.getenv("SHARD_BARRIER_TIMEOUT", str(6 * 3600)))
+# Documents of jobs whose shards did not all finish are removed by a Firestore TTL policy on expires_at
+SHARD_DOCUMENT_TTL = timedelta(seconds=SHARD_BARRIER_TIMEOUT) + timedelta(days=1)
+# Resource types each shardable command runs
+SHARDABLE_COMMANDS = {
+    "build": ["model", "seed", "snapshot", "test"],
+    "run": ["model"],
+    "seed": ["seed"],
+    "snapshot": ["snapshot"],
+    "test": ["test"],
+}
+SELECTION_ARGS = ["--select", "-s", "--models", "-m", "--exclude", "--selector"]
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+        Cloud Run task of a job started with several tasks. Cloud Run sets CLOUD_RUN_TASK_INDEX and CLOUD_RUN_TASK_COUNT.
+    """
+    index: int
+    count: int
+
+    @classmethod
+    def from_env(cls) -> Optional["Shard"]:
+        count = int(os.getenv("CLOUD_RUN_TASK_COUNT", "1"))
+        if count <= 1:
+            return None
+        return cls(index=int(os.getenv("CLOUD_RUN_TASK_INDEX", "0")), count=count)
+
+    def __str__(self) -> str:
+        return f"{self.index + 1}/{self.count}"
+
+
+def is_shardable(user_command: str) -> bool:
+    args = user_command.split()
+    return len(args) > 0 and args[0] in SHARDABLE_COMMANDS
+
+
+def plan_waves(parent_map: Dict[str, List[str]], unique_ids: Iterable[str]) -> List[List[str]]:
+    """
+        Groups the selected nodes in waves: a node is in the wave after the last wave of its selected parents.
+        Nodes of a wave do not depend on each other and can run on different shards; unselected parents are
+        considered already built, as dbt does.
+    """
+    selected = set(unique_ids)
+    wave_numbers: Dict[str, int] = {}
+
+    def assign_wave_number(unique_id: str) -> None:
+        # Iterative depth-first search, the DAG can be deeper than Python's recursion limit
+        stack = [unique_id]
+        while stack:
+            current = stack[-1]
+            pending_parents = [parent for parent in parent_map.get(current, []) if parent in selected and parent not in wave_numbers]
+            if pending_parents:
+                stack += pending_parents
+                continue
+            stack.pop()
+            selected_parents = [parent for parent in parent_map.get(current, []) if parent in selected]
+            wave_numbers[current] = max((wave_numbers[parent] + 1 for parent in selected_parents), default=0)
+
+    for unique_id in selected:
+        assign_wave_number(unique_id)
+    waves: List[List[str]] = [[] for _ in range(max(wave_numbers.values(), default=-1) + 1)]
+    for unique_id in sorted(selected):
+        waves[wave_numbers[unique_id]].append(unique_id)
+    return waves
+
+
+def assign_to_shards(wave: List[str], shard_count: int) -> List[List[str]]:
+    """
+        Spreads the nodes of a wave evenly, the same way on every shard since all of them compute the plan.
+    """
+    return [wave[index::shard_count] for index in range(shard_count)]
+
+
+def node_selector(fqn: List[str], resource_type: str) -> str:
+    # Intersected with the resource type, so that a test or model fqn does not also select same-named siblings
+    return f"fqn:{'.'.join(fqn)},resource_type:{resource_type}"
+
+
+def get_selection_args(args: List[str]) -> List[str]:
+    return [arg for arg, is_selection in tag_selection_args(args) if is_selection]
+
+
+def remove_selection_args(args: List[str]) -> List[str]:
+    return [arg for arg, is_selection in tag_selection_args(args) if not is_selection]
+
+
+def tag_selection_args(args: List[str]) -> List[tuple]:
+    tagged = []
+    in_selection = False
+    for arg in args:
+        if arg.startswith("-"):
+            in_selection = arg in SELECTION_ARGS
+            tagged.append((arg, in_selection or arg.split("=")[0] in SELECTION_ARGS))
+            if "=" in arg:
+                in_selection = False
+        else:
+            tagged.append((arg, in_selection))  # Selection options take several values: --select a b --exclude c
+    return tagged
+
+
+class ShardBarrier:
+    """
+        Synchronizes the shards of a job between waves through the dbt-shards/{uuid} document, where each shard
+        reports its status for every wave, then "done" once its logs are flushed.
+        A shard that fails before reaching a wave reports "done" as failed, which releases the others.
+        Once every shard is done, the first one deletes the document.
+    """
+
+    def __init__(self, uuid: str, shard: Shard):
+        self.shard = shard
+        self.document = get_collection(SHARD_COLLECTION).document(uuid)
+
+    def report(self, step: str, status: str) -> None:
+        self.document.set({
+            "steps": {step: {str(self.shard.index): status}},
+            "expires_at": datetime.now(timezone.utc) + SHARD_DOCUMENT_TTL,
+        }, merge=True)
+
+    def delete(self) -> None:
+        self.document.delete()
+
+    def wait(self, step: str) -> Dict[str, str]:
+        """
+            Waits until every shard reported the step. Returns their statuses.
+        """
+        deadline = time.monotonic() + SHARD_BARRIER_TIMEOUT
+        while True:
+            snapshot = self.document.get().to_dict() or {}
+            steps = snapshot.get("steps", {})
+            statuses = {**steps.get("done", {}), **steps.get(step, {})}
+            if len(statuses) >= self.shard.count:
+                return statuses
+            if time.monotonic() >= deadline:
+                raise ShardBarrierTimeout(f"Shards {sorted(set(map(str, range(self.shard.count))) - set(statuses))} did not reach step {step}")
+            time.sleep(SHARD_POLL_INTERVAL)
+
+
+class ShardBarrierTimeout(Exception):
+    pass
@@ -1,7 +1,12 @@
+import atexit
+from contextlib import contextmanager
+from functools import partial
 import os
+import queue
+import threading
+import time
 from tempfile import SpooledTemporaryFile
-import tempfile
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from datetime import date, datetime, timezone
 import logging
 import traceback
@@ -10,15 +15,32 @@ import zipfile
 from pathlib import Path
 
 import yaml
+from google.api_core import exceptions
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
 
+from dbt_server.lib.artifact_store import ArtifactStore, InvalidArtifact, validate_artifacts
 from dbt_server.lib.firestore import get_collection
 from dbt_server.lib.dbt_command import DbtCommand
-from dbt_server.lib.gcs import CloudStorage
+from dbt_server.lib.gcs import CloudStorage, StreamSource, describe_transfers
+from dbt_server.lib.metrics import LOG_BYTES_WRITTEN, SUBMISSION_BYTES, backend_call, timed_backend_call
 
 BUCKET_NAME = os.getenv('BUCKET_NAME')
+COALESCABLE_RUN_STATUSES = ["queued", "pending", "running"]
+STATUS_TIMESTAMP_FIELDS = {
+    "running": "started_at",
+    "success": "finished_at",
+    "failed": "finished_at",
+}
 
 
 class State:
+    """
+        Job state stored in the Firestore document of the job. The document is read once into a
+        local snapshot that serves all the properties; writes go to Firestore and update the
+        snapshot. Call refresh() when fresh data is needed, e.g. when polling a running job.
+        Writes made inside a `with state.batch():` block are committed in a single update.
+    """
 
     def __init__(self, dbt_command: DbtCommand = None, uuid: str = None):
         new_state = True if uuid is None else False
@@ -32,7 +54,9 @@ class State:
         self.gcs = CloudStorage(bucket_name=BUCKET_NAME)
         self.dbt_collection = get_collection("dbt-status")
 
-        self.run_logs_buffer = []
+        self.log_flusher: LogFlusher = None
+        self._snapshot: dict = None
+        self._pending_fields: dict = None
 
         if new_state:
             self.init_state()
@@ -42,188 +66,438 @@ class State:
         state = cls(uuid=uuid)
         return state
 
+    @classmethod
+    @timed_backend_call("firestore", "query")
+    def find_active_job(cls, fingerprint: str) -> Optional[str]:
+        """
+            Returns the uuid of the oldest queued or running job with the given command fingerprint, if any.
+        """
+        query = get_collection("dbt-status").where(filter=FieldFilter("fingerprint", "==", fingerprint))
+        snapshots = query.where(filter=FieldFilter("run_status", "in", COALESCABLE_RUN_STATUSES)).stream()
+        active_jobs = [snapshot.to_dict() for snapshot in snapshots]
+        if len(active_jobs) == 0:
+            return None
+        return min(active_jobs, key=lambda job: job["created_at"])["uuid"]
+
     @classmethod
     def from_schedule_uuid(cls, uuid: str):
         base_state = cls(uuid=uuid)
-        original_state_document_contents = base_state.dbt_collection.document(uuid).get().to_dict()
+        original_state_document_contents = base_state.snapshot
 
         new_uuid = str(uuid4())
-        new_state_document_contents = original_state_document_contents
+        new_state_document_contents = dict(original_state_document_contents)
         new_state_document_contents["uuid"] = new_uuid
+        new_state_document_contents["log_next_chunk"] = 0
+        new_state_document_contents["created_at"] = datetime.now(timezone.utc)
 
         new_state_document = base_state.dbt_collection.document(new_uuid)
-        new_state_document.set(new_state_document_contents)
+        with backend_call("firestore", "set"):
+            new_state_document.set(new_state_document_contents)
         state = cls(uuid=new_uuid)
+        state._snapshot = new_state_document_contents
         return state
 
     def init_state(self):
-        document = self.dbt_collection.document(self.uuid)
+        if self.dbt_command.artifacts:
+            self.check_artifacts(self.dbt_command.artifacts)
+
         initial_state = {
             "uuid": self.uuid,
             "run_status": "scheduled",
             "user_command": self.dbt_command.user_command,
             "dbt_native_params_overrides": self.dbt_command.dbt_native_params_overrides,
-            "cloud_storage_folder": "",
-            "log_starting_byte": 0
+            "cloud_storage_folder": generate_folder_name(self.uuid),
+            "log_next_chunk": 0,
+            "created_at": datetime.now(timezone.utc),
+            "artifacts": self.dbt_command.artifacts,
+            "fingerprint": self.dbt_command.fingerprint(),
+            "shards": self.dbt_command.shards,
         }
-        document.set(initial_state)
-        self.cloud_storage_folder = generate_folder_name(self.uuid)
+        with backend_call("firestore", "set"):
+            self.document.set(initial_state)
+        self._snapshot = initial_state
         self.run_logs.init_log_file()
         self.save_context_to_gcs()
 
+    @property
+    def document(self) -> firestore.DocumentReference:
+        return self.dbt_collection.document(self.uuid)
+
+    @property
+    def snapshot(self) -> dict:
+        if self._snapshot is None:
+            self.refresh()
+        return self._snapshot
+
+    @timed_backend_call("firestore", "get")
+    def refresh(self) -> None:
+        self._snapshot = self.document.get().to_dict()
+
+    def update(self, fields: dict) -> None:
+        if self._pending_fields is not None:
+            self._pending_fields.update(fields)
+        else:
+            with backend_call("firestore", "update"):
+                self.document.update(fields)
+        if self._snapshot is not None:
+            self._snapshot.update(fields)
+
+    @contextmanager
+    def batch(self):
+        if self._pending_fields is not None:  # Nested batches are committed by the outermost one
+            yield self
+            return
+
+        self._pending_fields = {}
+        try:
+            yield self
+            pending_fields = self._pending_fields
+            self._pending_fields = None
+            if len(pending_fields) > 0:
+                with backend_call("firestore", "update"):
+                    self.document.update(pending_fields)
+        except Exception:
+            self._snapshot = None  # The snapshot holds uncommitted fields, reload it on next access
+            raise
+        finally:
+            self._pending_fields = None
+
+    @contextmanager
+    def span(self, name: str):
+        """
+            Records the start, end and duration of a phase of the job, failed or not, see record_span.
+        """
+        start = datetime.now(timezone.utc)
+        try:
+            yield
+        finally:
+            self.record_span(name, start, datetime.now(timezone.utc))
+
+    def record_span(self, name: str, start: datetime, end: datetime, **details) -> None:
+        """
+            Spans are kept in the spans map of the document, written field by field since the server and the job
+            both add theirs. Timing is best effort: a failed write is logged, it does not fail the job.
+        """
+        span = {"start": start, "end": end, "duration_seconds": (end - start).total_seconds(), **details}
+        try:
+            with backend_call("firestore", "update"):
+                self.document.update({f"spans.{name}": span})
+        except Exception:
+            logging.warning(f"Could not record span {name} of job {self.uuid}\n{traceback.format_exc()}")
+            return
+        if self._snapshot is not None:
+            self._snapshot.setdefault("spans", {})[name] = span
+
+    @property
+    def spans(self) -> Dict[str, dict]:
+        return self.snapshot.get("spans", {})
+
     @property
     def run_status(self) -> str:
-        document = self.dbt_collection.document(self.uuid)
-        run_status = document.get().to_dict()["run_status"]
-        return run_status
+        return self.snapshot["run_status"]
 
     @run_status.setter
     def run_status(self, new_status: str):
-        status_ref = self.dbt_collection.document(self.uuid)
-        status_ref.update({"run_status": new_status})
+        fields = {"run_status": new_status}
+        if new_status in STATUS_TIMESTAMP_FIELDS:
+            fields[STATUS_TIMESTAMP_FIELDS[new_status]] = datetime.now(timezone.utc)
+        self.update(fields)
 
     @property
     def user_command(self) -> str:
-        document = self.dbt_collection.document(self.uuid)
-        user_command = document.get().to_dict()["user_command"]
-        self._user_command = user_command
-        return user_command
+        return self.snapshot["user_command"]
 
     @user_command.setter
     def user_command(self, user_command: str):
-        document = self.dbt_collection.document(self.uuid)
-        document.update({"user_command": user_command})
+        self.update({"user_command": user_command})
+
+    @property
+    def shards(self) -> int:
+        return self.snapshot.get("shards", 1)
 
     @property
     def dbt_native_params_overrides(self) -> dict:
-        document = self.dbt_collection.document(self.uuid)
-        dbt_native_params_overrides = document.get().to_dict()["dbt_native_params_overrides"]
-        return dbt_native_params_overrides
+        return self.snapshot["dbt_native_params_overrides"]
 
     @dbt_native_params_overrides.setter
     def dbt_native_params_overrides(self, dbt_native_params_overrides: dict):
-        document = self.dbt_collection.document(self.uuid)
-        document.update({"dbt_native_params_overrides": dbt_native_params_overrides})
+        self.update({"dbt_native_params_overrides": dbt_native_params_overrides})
 
     @property
-    def log_starting_byte(self) -> int:
-        document = self.dbt_collection.document(self.uuid)
-        log_starting_byte = document.get().to_dict()["log_starting_byte"]
-        return log_starting_byte
+    def log_next_chunk(self) -> int:
+        return self.snapshot.get("log_next_chunk", 0)
 
-    @log_starting_byte.setter
-    def log_starting_byte(self, new_log_starting_byte: int):
-        document = self.dbt_collection.document(self.uuid)
-        document.update({"log_starting_byte": new_log_starting_byte})
+    @log_next_chunk.setter
+    def log_next_chunk(self, new_log_next_chunk: int):
+        self.update({"log_next_chunk": new_log_next_chunk})
 
     @property
     def cloud_storage_folder(self) -> str:
-        document = self.dbt_collection.document(self.uuid)
-        cloud_storage_folder = document.get().to_dict()["cloud_storage_folder"]
-        return cloud_storage_folder
+        return self.snapshot["cloud_storage_folder"]
 
     @cloud_storage_folder.setter
     def cloud_storage_folder(self, cloud_storage_folder: str):
-        document = self.dbt_collection.document(self.uuid)
-        document.update({"cloud_storage_folder": cloud_storage_folder})
+        self.update({"cloud_storage_folder": cloud_storage_folder})
 
-    def extract_artifacts(self, zipped_artifacts: SpooledTemporaryFile) -> None:
-        logging.info("cloud_storage_folder :" + self.cloud_storage_folder)
-        with tempfile.TemporaryDirectory() as temp_dir:
-
-            temp_dir_path = Path(temp_dir)
-            artifacts_zip_path = temp_dir_path / 'artifacts.zip'
-            with artifacts_zip_path.open('wb') as f:
-                f.write(zipped_artifacts.file._file.getvalue())
+    @property
+    def artifacts(self) -> Dict[str, str]:
+        return self.snapshot.get("artifacts", {})
 
-            with zipfile.ZipFile(artifacts_zip_path, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-            artifacts_zip_path.unlink()
+    def check_artifacts(self, artifacts: Dict[str, str]) -> None:
+        validate_artifacts(artifacts)
+        missing_artifacts = ArtifactStore(self.gcs).missing(sorted(set(artifacts.values())))
+        if len(missing_artifacts) > 0:
+            raise InvalidArtifact(f"Artifacts not found in the artifact store: {', '.join(missing_artifacts)}")
 
-            for file_path in temp_dir_path.rglob('*'):
-                if file_path.is_file():
-                    relative_path = file_path.relative_to(temp_dir_path)
-                    with open(file_path, 'r') as file:
-                        data = file.read()
-                    self.gcs.save(str(Path(self.cloud_storage_folder) / relative_path), data)
+    def extract_artifacts(self, zipped_artifacts: SpooledTemporaryFile) -> None:
+        """
+            Zip members are streamed from the spooled upload to GCS, without extracting the archive in memory or on disk.
+        """
+        logging.info("cloud_storage_folder :" + self.cloud_storage_folder)
+        with zipfile.ZipFile(zipped_artifacts, 'r') as zip_ref:
+            members = [member for member in zip_ref.infolist() if not member.is_dir()]
+            validate_artifacts({member.filename: "" for member in members}, check_hashes=False)
+            start = time.perf_counter()
+            timings = self.gcs.upload_many({
+                f"{self.cloud_storage_folder}/{member.filename}": StreamSource(partial(zip_ref.open, member), member.file_size)
+                for member in members
+            })
+        SUBMISSION_BYTES.labels("extracted").observe(sum(member.file_size for member in members))
+        logging.info(f"Uploaded artifacts in {time.perf_counter() - start:.2f}s ({describe_transfers(timings)})")
 
     def save_context_to_gcs(self) -> None:
         logging.info("cloud_storage_folder :" + self.cloud_storage_folder)
-        self.gcs.save(self.cloud_storage_folder + "/dbt_project.yml", str(yaml.dump(self.dbt_command.dbt_project)))
-        self.gcs.save(self.cloud_storage_folder + "/profiles.yml", str(yaml.dump(self.dbt_command.profiles)))
-        self.gcs.save(self.cloud_storage_folder + "/packages.yml", str(yaml.dump(self.dbt_command.packages)))
-
+        self.gcs.upload_many({
+            self.cloud_storage_folder + "/dbt_project.yml": str(yaml.dump(self.dbt_command.dbt_project)),
+            self.cloud_storage_folder + "/profiles.yml": str(yaml.dump(self.dbt_command.profiles)),
+            self.cloud_storage_folder + "/packages.yml": str(yaml.dump(self.dbt_command.packages)),
+        })
 
     def save_context_to_local(self) -> None:
         logging.info(f"load data from folder {self.cloud_storage_folder}")
-
-        blob_context_files = self.gcs.get_files_from_folder(self.cloud_storage_folder)
-        write_files(blob_context_files)
-
-        blob_seed_files = self.gcs.get_files_from_folder(self.cloud_storage_folder + '/seeds')
-        write_files(blob_seed_files, 'seeds/')
+        start = time.perf_counter()
+        timings = self.gcs.download_folder(self.cloud_storage_folder)
+        timings.update(ArtifactStore(self.gcs).restore(self.artifacts))
+        logging.info(f"Downloaded job context in {time.perf_counter() - start:.2f}s ({describe_transfers(timings)})")
 
     def get_last_logs(self) -> List[str]:
-        logs, byte_length = self.run_logs.get(self.log_starting_byte)
-        if byte_length != 0:
-            self.log_starting_byte += byte_length + 1
+        if "log_next_chunk" not in self.snapshot and "log_starting_byte" in self.snapshot:
+            # Jobs started before run logs were chunked have a single log file, read from a byte cursor
+            log_starting_byte = self.snapshot["log_starting_byte"]
+            logs, byte_length = self.run_logs.get_from_log_file(log_starting_byte)
+            if byte_length != 0:
+                self.update({"log_starting_byte": log_starting_byte + byte_length + 1})
+            return logs
+
+        log_next_chunk = self.log_next_chunk
+        logs, next_chunk = self.run_logs.get(log_next_chunk)
+        if next_chunk != log_next_chunk:
+            self.log_next_chunk = next_chunk
         return logs
 
     def log(self, severity: str, new_log: str) -> None:
-        if self.run_logs_buffer == []:
-            all_previous_logs = self.get_all_logs()
-            self.run_logs_buffer = all_previous_logs
+        new_log = format_log(severity, new_log)
+        if self.log_flusher is not None:
+            self.log_flusher.put(new_log)
+        else:
+            self.run_logs.append([new_log])
 
-        dt_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-        new_log = (f"{dt_time}\t{severity}\t{new_log}")
+    def start_log_flusher(self) -> None:
+        self.log_flusher = LogFlusher(self.run_logs)
+        self.log_flusher.start()
 
-        self.run_logs_buffer.append(new_log)
-        self.run_logs.log(self.run_logs_buffer)
+    def stop_log_flusher(self) -> None:
+        if self.log_flusher is not None:
+            self.log_flusher.stop()
+            self.log_flusher = None
 
     def get_all_logs(self) -> List[str]:
-        logs, _ = self.run_logs.get(0)
-        return logs
+        return self.run_logs.get_all(self.snapshot.get("log_compacted_chunks", 0))
+
+    def compact_logs(self) -> None:
+        compacted_chunks = self.run_logs.compact()
+        if compacted_chunks > 0:
+            self.update({"log_compacted_chunks": compacted_chunks})
 
 
 class DbtRunLogs:
+    """
+        Run logs are append-only: every write uploads the new lines as the next numbered chunk
+        under logs/{uuid}/. The ordered listing of that folder is the index, so readers only
+        download the chunks after their cursor. Once the job is done, chunks are composed into
+        logs/{uuid}.txt, which is then used to serve the full logs, followed by any chunk written
+        after the compaction. Jobs started before chunking only have logs/{uuid}.txt.
+    """
 
     def __init__(self, uuid: str):
         self.uuid = uuid
 
         self.log_file = f'logs/{uuid}.txt'
+        self.log_folder = f'logs/{uuid}/'
         self.gcs = CloudStorage(bucket_name=BUCKET_NAME)
 
+        self.next_chunk: int = None
+
+    def chunk_name(self, chunk_number: int) -> str:
+        return f"{self.log_folder}{chunk_number:08d}.txt"
+
     def init_log_file(self) -> None:
-        dt_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-        self.gcs.save(self.log_file, dt_time+"\tINFO\tInit")
-
-    def get(self, starting_byte: int = 0) -> Tuple[List[str], int]:
-        current_log_file = self.gcs.load(self.log_file, starting_byte)
-        byte_length = len(current_log_file)
-        if byte_length == 0:
-            return [], byte_length
-        run_logs = current_log_file.decode('utf-8').split('\n')
-        return run_logs, byte_length
-
-    def log(self, logs: List[str]) -> None:
-        new_log_file = '\n'.join(logs)
+        self.append([format_log("INFO", "Init")])
+
+    def get(self, starting_chunk: int = 0) -> Tuple[List[str], int]:
+        chunks = self.gcs.get_files_from_folder(self.log_folder, start_offset=self.chunk_name(starting_chunk))
+        run_logs = []
+        next_chunk = starting_chunk
+        for chunk_file_name, chunk in chunks.items():
+            run_logs += split_log_lines(chunk)
+            next_chunk = chunk_number(chunk_file_name) + 1
+        return run_logs, next_chunk
+
+    def get_all(self, compacted_chunks: int = 0) -> List[str]:
+        """
+            compacted_chunks: number of chunks composed into the log file by compact(), the next ones are read as chunks.
+        """
+        if compacted_chunks == 0:
+            run_logs, next_chunk = self.get(0)
+            if next_chunk > 0:
+                return run_logs
+            # No chunks, the job was started before chunking: all its logs are in the log file
+        compacted_logs = split_log_lines(self.gcs.load(self.log_file))
+        if compacted_chunks == 0:
+            return compacted_logs
+        new_logs, _ = self.get(compacted_chunks)
+        return compacted_logs + new_logs
+
+    def get_from_log_file(self, starting_byte: int) -> Tuple[List[str], int]:
+        log_file = self.gcs.load(self.log_file, starting_byte)
+        return split_log_lines(log_file), len(log_file)
+
+    def append(self, logs: List[str]) -> None:
+        new_chunk = ''.join(f"{log}\n" for log in logs)
         try:
-            self.gcs.save(self.log_file, new_log_file)
+            if self.next_chunk is None:
+                self.next_chunk = self.find_next_chunk()
+            while True:
+                try:
+                    # Chunks are create-only: another writer already took this number if the precondition fails
+                    self.gcs.save(self.chunk_name(self.next_chunk), new_chunk, if_generation_match=0)
+                    LOG_BYTES_WRITTEN.inc(len(new_chunk.encode()))
+                    break
+                except exceptions.PreconditionFailed:
+                    self.next_chunk = self.find_next_chunk()
+            self.next_chunk += 1
         except Exception:
             traceback_str = traceback.format_exc()
             print("Error", "Error uploading log to bucket")
             print(traceback_str)
 
+    def find_next_chunk(self) -> int:
+        chunk_names = self.gcs.list_files(self.log_folder)
+        if len(chunk_names) == 0:
+            return 0
+        return chunk_number(chunk_names[-1]) + 1
 
-def write_files(files: Dict[str, bytes], prefix: str = ""):
-    for filename in files.keys():
+    def compact(self) -> int:
+        """
+            Composes the chunks written so far into the log file. Returns the number of chunks composed, 0 if none were.
+        """
         try:
-            with open(prefix + filename, 'wb') as f:
-                f.write(files[filename])
+            chunk_names = self.gcs.list_files(self.log_folder)
+            if len(chunk_names) == 0:
+                return 0
+            self.gcs.compose(chunk_names, self.log_file)
+            return chunk_number(chunk_names[-1]) + 1
         except Exception:
             traceback_str = traceback.format_exc()
-            print("ERROR", f"Couldn't write file {filename}")
+            print("Error", "Error composing log chunks")
             print(traceback_str)
+            return 0
+
+
+class LogFlusher:
+    """
+        Queues run logs in memory and uploads them in batches from a background thread, so that
+        logging never waits on Cloud Storage. A batch is written when it reaches max_batch_size
+        lines, flush_interval seconds after its first line, and when the flusher is stopped.
+        The queue is bounded: when it is full, new lines are dropped and the number of dropped
+        lines is reported in the next batch.
+    """
+
+    def __init__(self, run_logs: DbtRunLogs, flush_interval: float = 0.5, max_batch_size: int = 1000, max_queue_size: int = 50000):
+        self.run_logs = run_logs
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped_logs = 0
+        self.dropped_logs_lock = threading.Lock()
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="log-flusher", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        if self.thread.is_alive():
+            self.stop_event.set()
+            self.thread.join()
+        atexit.unregister(self.stop)
+
+    def put(self, log: str) -> None:
+        try:
+            self.queue.put_nowait(log)
+        except queue.Full:
+            with self.dropped_logs_lock:
+                self.dropped_logs += 1
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            self.flush(self.next_batch())
+
+        batch = self.next_batch(wait=False)
+        while len(batch) > 0:
+            self.flush(batch)
+            batch = self.next_batch(wait=False)
+
+    def next_batch(self, wait: bool = True) -> List[str]:
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=self.flush_interval) if wait else self.queue.get_nowait())
+        except queue.Empty:
+            return batch
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=timeout) if wait and timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self, batch: List[str]) -> None:
+        with self.dropped_logs_lock:
+            dropped_logs, self.dropped_logs = self.dropped_logs, 0
+        if dropped_logs > 0:
+            batch.append(format_log("WARN", f"[job] {dropped_logs} log lines dropped, the log queue was full"))
+        if len(batch) > 0:
+            self.run_logs.append(batch)
+
+
+def format_log(severity: str, log: str) -> str:
+    dt_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return f"{dt_time}\t{severity}\t{log}"
+
+def chunk_number(chunk_name: str) -> int:
+    return int(chunk_name.split('/')[-1].split('.')[0])
+
+def split_log_lines(log_file: bytes) -> List[str]:
+    log_file_str = log_file.decode('utf-8')
+    if log_file_str == '':
+        return []
+    return log_file_str.removesuffix('\n').split('\n')
 
 def generate_folder_name(uuid: str) -> str:
     today = date.today()
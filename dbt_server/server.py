@@ -1,13 +1,41 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+import io
+import logging
 import os
+import tarfile
+import threading
 import traceback
+import zlib
+from typing import AsyncIterator, Callable
 
+import anyio
 import uvicorn
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, status
+from fastapi.responses import Response, StreamingResponse
+from google.cloud.firestore_v1.base_query import FieldFilter
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from starlette.concurrency import run_in_threadpool
 from cron_descriptor import get_description
+import yaml
 
+from dbt_server.lib.admission import (
+    ADMISSION_INTERVAL, MAX_CONCURRENT_JOBS, MAX_CONCURRENT_JOBS_PER_TARGET, AdmissionController, admission_enabled
+)
+from dbt_server.lib.batch import Batch, advance_pipelines, aggregate_run_status
+from dbt_server.lib.artifact_store import ArtifactHashes, ArtifactStore, InvalidArtifact
+from dbt_server.lib.clients import get_clients
 from dbt_server.lib.dbt_cloud_run_job import DbtCloudRunJobStarter, DbtCloudRunJobConfig, DbtCloudRunJobCreationFailed, DbtCloudRunJobStartFailed
-from dbt_server.lib.dbt_command import DbtCommand, ScheduledDbtCommand
+from dbt_server.lib.dbt_command import BATCH_MODES, DbtBatchCommand, DbtCommand, ScheduledDbtCommand
 from dbt_server.lib.cloud_scheduler import CloudScheduler, SchedulerHTTPJobSpec
+from dbt_server.lib.gcs import CloudStorage
+from dbt_server.lib.firestore import get_collection
+from dbt_server.lib.job_queue import JOB_QUEUE, QueuedJob, get_job_queue
+from dbt_server.lib.metrics import (
+    JOBS_SUBMITTED, SUBMISSION_BYTES, JobStatusCollector, RequestLatencyMiddleware, backend_call
+)
+from dbt_server.lib.sharding import SHARDABLE_COMMANDS, is_shardable
 from dbt_server.lib.state import State
 from dbt_server.lib.logger import DbtLogger
 from dbt_server.version import __version__
@@ -19,38 +47,158 @@ PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 PORT = os.environ.get("PORT", "8001")
+REUSE_CLOUD_RUN_JOB = os.getenv("REUSE_CLOUD_RUN_JOB", "false").lower() == "true"
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "cloud_run_job")  # or "worker"
 SCHEDULED_JOB_DESC_PREFIX = "[dbt-server job] "
+LOG_STREAM_INTERVAL = float(os.environ.get("LOG_STREAM_INTERVAL", "0.5"))
+# Polling slows down up to this interval while the job writes no logs and keeps its status
+LOG_STREAM_MAX_INTERVAL = float(os.environ.get("LOG_STREAM_MAX_INTERVAL", "5"))
+LOG_STREAM_KEEPALIVE = 15
+ACTIVE_RUN_STATUSES = ["scheduled", "blocked", "queued", "pending", "running"]
+THREADPOOL_SIZE = int(os.environ.get("THREADPOOL_SIZE", "40"))
+MAX_CONCURRENT_SUBMISSIONS = int(os.environ.get("MAX_CONCURRENT_SUBMISSIONS", "10"))
+PIPELINE_INTERVAL = float(os.environ.get("PIPELINE_INTERVAL", "2"))
+MANIFEST_ARTIFACTS = ["manifest.msgpack", "manifest.json"]
+SERVER_FEATURES = ["manifest_msgpack"]  # Sent with the version, so that the cli only uses what the server supports
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Backend clients are blocking: sync handlers run in the default threadpool, while job submissions,
+    # which wait on Cloud Run job creation, get their own limiter so they cannot starve status and log requests
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    app.state.submission_limiter = anyio.CapacityLimiter(MAX_CONCURRENT_SUBMISSIONS)
+    # Google Cloud clients are created once and shared by all requests, use set_clients() before startup to swap them
+    app.state.clients = get_clients()
+    # With the local queue, jobs are run by a worker thread of the server, each in a child process (for tests and local development)
+    local_worker = None
+    if EXECUTION_MODE == "worker" and JOB_QUEUE == "local":
+        from dbt_server.worker import Worker  # Imports dbt, which the server does not need otherwise
+        local_worker = Worker(subprocess_jobs=True)
+        threading.Thread(target=local_worker.run, daemon=True).start()
+    # With MAX_CONCURRENT_JOBS(_PER_TARGET), jobs are queued and started by the admission controller as slots free up
+    app.state.admission = AdmissionController(start_queued_job) if admission_enabled() else None
+    dispatcher = asyncio.create_task(dispatch_queued_jobs(app.state.admission)) if app.state.admission is not None else None
+    # Jobs of a pipeline batch are started by the server once the previous job of the batch succeeded
+    pipelines = asyncio.create_task(advance_blocked_jobs())
+    # Registered by the served app rather than on import: uvicorn's reloader executes this module twice
+    job_status_collector = JobStatusCollector(count_jobs_by_status, ACTIVE_RUN_STATUSES)
+    REGISTRY.register(job_status_collector)
+    yield
+    REGISTRY.unregister(job_status_collector)
+    pipelines.cancel()
+    if dispatcher is not None:
+        dispatcher.cancel()
+    if local_worker is not None:
+        local_worker.stop()
+    app.state.clients.close()
+
+
+async def dispatch_queued_jobs(admission: AdmissionController) -> None:
+    while True:
+        try:
+            await run_in_threadpool(admission.dispatch)
+        except Exception:
+            logging.error(f"Queued jobs dispatch failed\n{traceback.format_exc()}")
+        await asyncio.sleep(ADMISSION_INTERVAL)
+
+
+async def advance_blocked_jobs() -> None:
+    while True:
+        try:
+            await run_in_threadpool(advance_pipelines, start_blocked_job)
+        except Exception:
+            logging.error(f"Pipelines advance failed\n{traceback.format_exc()}")
+        await asyncio.sleep(PIPELINE_INTERVAL)
+
 
 app = FastAPI(
     title="dbt-server",
     description="A server to run dbt commands in the cloud",
     version="0.0.1",
-    docs_url="/docs"
+    docs_url="/docs",
+    lifespan=lifespan,
 )
+app.add_middleware(RequestLatencyMiddleware)
+
+
+def count_jobs_by_status() -> dict:
+    counts = {}
+    with backend_call("firestore", "query"):
+        snapshots = get_collection("dbt-status").where(filter=FieldFilter("run_status", "in", ACTIVE_RUN_STATUSES)).select(["run_status"]).stream()
+        for snapshot in snapshots:
+            counts[snapshot.get("run_status")] = counts.get(snapshot.get("run_status"), 0) + 1
+    return counts
+
+
+async def run_submission(submit: Callable, *args):
+    return await anyio.to_thread.run_sync(submit, *args, limiter=app.state.submission_limiter)
+
+
+class RequestBodyReader(io.RawIOBase):
+    """
+        Blocking file interface over a request body stream, for code running in a worker thread
+        (see run_submission): each read waits on the event loop for the next chunk of the body.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self.chunks = chunks
+        self.buffer = b""
+        self.end_of_body = False
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.buffer and not self.end_of_body:
+            self.buffer = anyio.from_thread.run(self.next_chunk)
+        size = min(len(buffer), len(self.buffer))
+        buffer[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+    async def next_chunk(self) -> bytes:
+        try:
+            chunk = await self.chunks.__anext__()
+        except StopAsyncIteration:
+            self.end_of_body = True
+            return b""
+        self.bytes_read += len(chunk)
+        return chunk
+
 
 @app.post("/dbt", status_code=status.HTTP_202_ACCEPTED)
 async def run_command(dbt_command: DbtCommand = Depends()):
+    return await run_submission(submit_command, dbt_command)
+
+
+def submit_command(dbt_command: DbtCommand) -> dict:
+    check_shards(dbt_command)
     try:
         logger = DbtLogger(server=True)
         logger.log("INFO", f"Received command: {dbt_command.user_command}")
 
+        # Uploaded zips are not part of the fingerprint, only commands referencing their artifacts by hash coalesce
+        if dbt_command.coalesce and dbt_command.zipped_artifacts is None:
+            active_job_uuid = State.find_active_job(dbt_command.fingerprint())
+            if active_job_uuid is not None:
+                logger.log("INFO", f"Attaching command to running job '{active_job_uuid}'")
+                return job_response(active_job_uuid, dbt_command.server_url, f"Attached to running job with uuid: {active_job_uuid}")
+
+        received_at = datetime.now(timezone.utc)
         state = State(dbt_command)
         logger.log("INFO", f"Assigned job id: '{state.uuid}'")
         logger.state = state
-        state.extract_artifacts(dbt_command.zipped_artifacts)
-
-        job_conf = DbtCloudRunJobConfig(
-            uuid=state.uuid,
-            dbt_command=dbt_command.user_command,
-            project_id=PROJECT_ID,
-            location=LOCATION,
-            service_account=SERVICE_ACCOUNT,
-            job_docker_image=DOCKER_IMAGE,
-            artifacts_bucket_name=BUCKET_NAME
-        )
-        DbtCloudRunJobStarter(job_conf, logger).start()
+        if dbt_command.zipped_artifacts is not None:
+            SUBMISSION_BYTES.labels("received").observe(dbt_command.zipped_artifacts.size or 0)
+            state.extract_artifacts(dbt_command.zipped_artifacts.file)
+        state.record_span("context_upload", received_at, datetime.now(timezone.utc))
+        JOBS_SUBMITTED.labels("dbt").inc()
 
-    except (DbtCloudRunJobCreationFailed, DbtCloudRunJobStartFailed) as e:
+        admit_job(state, dbt_command.user_command, logger, priority="interactive")
+
+    except (DbtCloudRunJobCreationFailed, DbtCloudRunJobStartFailed, InvalidArtifact) as e:
         traceback_str = traceback.format_exc()
         raise HTTPException(status_code=400, detail=f"{e.args[0]}\n{traceback_str}")
 
@@ -58,25 +206,256 @@ async def run_command(dbt_command: DbtCommand = Depends()):
         traceback_str = traceback.format_exc()
         raise HTTPException(status_code=500, detail=f"{e.args[0]}\n{traceback_str}")
 
+    return job_response(state.uuid, dbt_command.server_url, f"Job created with uuid: {state.uuid}")
+
+
+def check_shards(dbt_command: DbtCommand) -> None:
+    if dbt_command.shards < 1:
+        raise HTTPException(status_code=400, detail="shards must be at least 1")
+    if dbt_command.shards > 1 and not is_shardable(dbt_command.user_command):
+        raise HTTPException(status_code=400, detail=f"Only {', '.join(SHARDABLE_COMMANDS)} commands can be sharded")
+    if dbt_command.shards > 1 and EXECUTION_MODE == "worker":
+        raise HTTPException(status_code=400, detail="Sharded commands need Cloud Run jobs, they cannot run on workers")
+
+
+def job_response(uuid: str, server_url: str, message: str) -> dict:
     return {
-        "uuid": state.uuid,
-        "message": f"Job created with uuid: {state.uuid}",
+        "uuid": uuid,
+        "message": message,
         "links": {
-            "run_status": f"{dbt_command.server_url}job/{state.uuid}",
-            "last_logs": f"{dbt_command.server_url}job/{state.uuid}/last_logs",
+            "run_status": f"{server_url}job/{uuid}",
+            "last_logs": f"{server_url}job/{uuid}/last_logs",
+            "stream": f"{server_url}job/{uuid}/stream",
+            "metrics": f"{server_url}job/{uuid}/metrics",
         }
     }
 
 
+def admit_job(state: State, dbt_command: str, logger: DbtLogger, priority: str) -> None:
+    admission: AdmissionController = app.state.admission
+    if admission is None:
+        start_job(state, dbt_command, logger)
+        return
+
+    admission.enqueue(state, priority)
+    logger.log("INFO", f"Job {state.uuid} queued with {priority} priority")
+    admission.dispatch()
+
+
+def start_queued_job(state: State) -> None:
+    logger = DbtLogger(server=True)
+    logger.state = state
+    logger.log("INFO", f"Starting job {state.uuid} after {state.snapshot.get('queue_wait_seconds', 0):.1f}s in queue")
+    start_job(state, state.user_command, logger)
+
+
+def start_blocked_job(state: State) -> None:
+    logger = DbtLogger(server=True)
+    logger.state = state
+    logger.log("INFO", f"Previous job of batch {state.snapshot.get('batch_id')} succeeded, starting job {state.uuid}")
+    admit_job(state, state.user_command, logger, priority="interactive")
+
+
+def start_job(state: State, dbt_command: str, logger: DbtLogger) -> None:
+    """
+        Runs the command on a Cloud Run job, or, with EXECUTION_MODE=worker, queues it for the workers.
+    """
+    if EXECUTION_MODE == "worker":
+        # Pending before it is queued, a worker may claim the job and set it running right away
+        state.run_status = "pending"
+        get_job_queue().put(QueuedJob(uuid=state.uuid, dbt_command=dbt_command))
+        logger.log("INFO", f"Job {state.uuid} queued for the workers")
+        return
+
+    job_conf = DbtCloudRunJobConfig(
+        uuid=state.uuid,
+        dbt_command=dbt_command,
+        project_id=PROJECT_ID,
+        location=LOCATION,
+        service_account=SERVICE_ACCOUNT,
+        job_docker_image=DOCKER_IMAGE,
+        artifacts_bucket_name=BUCKET_NAME,
+        reuse_job=REUSE_CLOUD_RUN_JOB,
+        task_count=state.shards,
+    )
+    DbtCloudRunJobStarter(job_conf, logger).start()
+
+
+@app.post("/dbt/batch", status_code=status.HTTP_202_ACCEPTED)
+async def run_batch(dbt_batch_command: DbtBatchCommand = Depends()):
+    return await run_submission(submit_batch, dbt_batch_command)
+
+
+def submit_batch(dbt_batch_command: DbtBatchCommand) -> dict:
+    """
+        Creates one job per command, all using the artifacts uploaded once beforehand (see /artifacts).
+    """
+    if dbt_batch_command.mode not in BATCH_MODES:
+        raise HTTPException(status_code=400, detail=f"Batch mode must be one of {BATCH_MODES}, got '{dbt_batch_command.mode}'")
+    if len(dbt_batch_command.commands) == 0:
+        raise HTTPException(status_code=400, detail="A batch needs at least one command")
+    artifacts = yaml.safe_load(dbt_batch_command.artifacts)
+    if not isinstance(artifacts, dict) or not any(manifest in artifacts for manifest in MANIFEST_ARTIFACTS):
+        raise HTTPException(status_code=400, detail=f"A batch needs a manifest in its artifacts ({' or '.join(MANIFEST_ARTIFACTS)}), upload it to /artifacts first")
+
+    try:
+        logger = DbtLogger(server=True)
+        logger.log("INFO", f"Received {dbt_batch_command.mode} batch of {len(dbt_batch_command.commands)} commands")
+
+        states = [State(dbt_command) for dbt_command in dbt_batch_command.dbt_commands()]
+        batch = Batch.create(dbt_batch_command.mode, states)
+        JOBS_SUBMITTED.labels("batch").inc(len(states))
+        logger.log("INFO", f"Assigned batch id: '{batch.batch_id}'")
+
+        # In a pipeline, the other jobs are blocked until their previous job succeeded
+        states_to_start = states if dbt_batch_command.mode == "parallel" else states[:1]
+        for state in states_to_start:
+            logger.state = state
+            admit_job(state, state.user_command, logger, priority="interactive")
+
+    except (DbtCloudRunJobCreationFailed, DbtCloudRunJobStartFailed, InvalidArtifact) as e:
+        traceback_str = traceback.format_exc()
+        raise HTTPException(status_code=400, detail=f"{e.args[0]}\n{traceback_str}")
+
+    except Exception as e:
+        traceback_str = traceback.format_exc()
+        raise HTTPException(status_code=500, detail=f"{e.args[0]}\n{traceback_str}")
+
+    server_url = dbt_batch_command.server_url
+    return {
+        "batch_id": batch.batch_id,
+        "message": f"Batch created with id: {batch.batch_id}",
+        "jobs": [
+            job_response(state.uuid, server_url, f"Job created with uuid: {state.uuid}") | {"user_command": state.user_command}
+            for state in states
+        ],
+        "links": {
+            "run_status": f"{server_url}batch/{batch.batch_id}",
+            "logs": f"{server_url}batch/{batch.batch_id}/logs",
+        }
+    }
+
+
+@app.get("/batch/{batch_id}", status_code=status.HTTP_200_OK)
+def get_batch_status(batch_id: str):
+    # Read only: blocked jobs are started by the advance_blocked_jobs loop, not by polling clients
+    batch = get_batch(batch_id)
+    jobs = [
+        {"uuid": snapshot.id, "user_command": snapshot.get("user_command"), "run_status": snapshot.get("run_status")}
+        for snapshot in batch.job_snapshots()
+    ]
+    return {
+        "batch_id": batch_id,
+        "mode": batch.mode,
+        "run_status": aggregate_run_status([job["run_status"] for job in jobs]),
+        "jobs": jobs,
+    }
+
+
+@app.get("/batch/{batch_id}/logs", status_code=status.HTTP_200_OK)
+def get_batch_logs(batch_id: str):
+    batch = get_batch(batch_id)
+    logs, run_statuses = [], []
+    for uuid in batch.jobs:
+        job_state = State.from_uuid(uuid)
+        run_statuses.append(job_state.run_status)
+        logs.append(f"===== Job {uuid}: {job_state.user_command} ({job_state.run_status}) =====")
+        logs += job_state.get_all_logs()
+    return {"run_logs": logs, "run_status": aggregate_run_status(run_statuses), "batch_id": batch_id}
+
+
+def get_batch(batch_id: str) -> Batch:
+    batch = Batch(batch_id)
+    if not batch.exists:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    return batch
+
+
+@app.post("/artifacts/missing", status_code=status.HTTP_200_OK)
+def find_missing_artifacts(artifact_hashes: ArtifactHashes):
+    try:
+        missing_artifacts = ArtifactStore(CloudStorage(bucket_name=BUCKET_NAME)).missing(artifact_hashes.hashes)
+    except InvalidArtifact as e:
+        raise HTTPException(status_code=400, detail=e.args[0])
+    return {"missing": missing_artifacts}
+
+
+@app.post("/artifacts", status_code=status.HTTP_201_CREATED)
+async def upload_artifacts(request: Request):
+    """
+        The body is a compressed tar of artifacts named after their sha256, read while it is being received.
+    """
+    body = RequestBodyReader(request.stream())
+    response = await run_submission(store_artifacts, io.BufferedReader(body))
+    SUBMISSION_BYTES.labels("received").observe(body.bytes_read)
+    return response
+
+
+def store_artifacts(archive: io.BufferedReader) -> dict:
+    try:
+        saved_artifacts = ArtifactStore(CloudStorage(bucket_name=BUCKET_NAME)).save_archive(archive)
+    except (InvalidArtifact, tarfile.TarError, EOFError, zlib.error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid artifact archive: {e}")
+    return {"saved": saved_artifacts}
+
+
 @app.get("/job/{uuid}", status_code=status.HTTP_200_OK)
-async def get_job_status(uuid: str):
+def get_job_status(uuid: str):
     job_state = State.from_uuid(uuid)
     run_status = job_state.run_status
+    if run_status == "queued" and app.state.admission is not None:
+        return {"run_status": run_status, "queue_position": app.state.admission.queue_position(uuid)}
     return {"run_status": run_status}
 
 
+@app.get("/job/{uuid}/metrics", status_code=status.HTTP_200_OK)
+def get_job_metrics(uuid: str):
+    """
+        Phases of the job recorded by the server and the job, in chronological order.
+    """
+    job_state = get_job_state(uuid)
+    spans = sorted(
+        ({"name": name, **span} for name, span in job_state.spans.items()),
+        key=lambda span: span["start"],
+    )
+    created_at = job_state.snapshot.get("created_at")  # Missing on jobs created before it was recorded
+    finished_at = job_state.snapshot.get("finished_at")
+    return {
+        "uuid": uuid,
+        "run_status": job_state.run_status,
+        "created_at": created_at,
+        "finished_at": finished_at,
+        "total_seconds": ((finished_at or datetime.now(timezone.utc)) - created_at).total_seconds() if created_at is not None else None,
+        "queue_wait_seconds": job_state.snapshot.get("queue_wait_seconds"),
+        "spans": spans,
+    }
+
+
+def get_job_state(uuid: str) -> State:
+    job_state = State.from_uuid(uuid)
+    if job_state.snapshot is None:
+        raise HTTPException(status_code=404, detail=f"Job {uuid} not found")
+    return job_state
+
+
+@app.get("/queue", status_code=status.HTTP_200_OK)
+def get_queue():
+    admission: AdmissionController = app.state.admission
+    if admission is None:
+        return {"queued": [], "limits": None}
+
+    return {
+        "queued": [
+            {"uuid": snapshot.id, "position": position, "priority": snapshot.get("priority"), "target": snapshot.get("target")}
+            for position, snapshot in enumerate(admission.queued_jobs(), start=1)
+        ],
+        "limits": {"max_concurrent_jobs": MAX_CONCURRENT_JOBS, "max_concurrent_jobs_per_target": MAX_CONCURRENT_JOBS_PER_TARGET},
+        "wait_time_seconds": admission.wait_time_stats(),
+    }
+
+
 @app.get("/job/{uuid}/last_logs", status_code=status.HTTP_200_OK)
-async def get_last_logs(uuid: str):
+def get_last_logs(uuid: str):
     job_state = State.from_uuid(uuid)
     logs = job_state.get_last_logs()
     run_status = job_state.run_status
@@ -84,22 +463,79 @@ async def get_last_logs(uuid: str):
 
 
 @app.get("/job/{uuid}/logs", status_code=status.HTTP_200_OK)
-async def get_all_logs(uuid: str):
+def get_all_logs(uuid: str):
     job_state = State.from_uuid(uuid)
     logs = job_state.get_all_logs()
     run_status = job_state.run_status
     return {"run_logs": logs, "run_status": run_status, "uuid": uuid}
 
 
+@app.get("/job/{uuid}/stream", status_code=status.HTTP_200_OK)
+async def stream_job_events(uuid: str, last_event_id: int = Header(0)):
+    # Checked before the response starts, an unknown job could not get its 404 once the headers are sent
+    job_state = await run_in_threadpool(get_job_state, uuid)
+    return StreamingResponse(
+        job_events(job_state, next_chunk=last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def job_events(job_state: State, next_chunk: int = 0) -> AsyncIterator[str]:
+    """
+        Server-Sent Events: new log lines as `log` events, and a `status` event on each run status
+        change. Event ids are the next log chunk to read, so that a client can resume with
+        the Last-Event-ID header. The stream ends once the job is finished and its logs are sent.
+    """
+    run_status = None
+    idle_time = 0
+    interval = LOG_STREAM_INTERVAL
+    while True:
+        # Status is read before the logs, the last logs of a finished job are always sent before the stream ends
+        await run_in_threadpool(job_state.refresh)
+        new_run_status = job_state.run_status
+        logs, next_chunk = await run_in_threadpool(job_state.run_logs.get, next_chunk)
+
+        if len(logs) > 0:
+            yield "".join(f"event: log\ndata: {log}\n\n" for log in logs[:-1]) + f"event: log\nid: {next_chunk}\ndata: {logs[-1]}\n\n"
+            idle_time = 0
+            interval = LOG_STREAM_INTERVAL
+        if new_run_status != run_status:
+            run_status = new_run_status
+            yield f"event: status\ndata: {run_status}\n\n"
+            idle_time = 0
+            interval = LOG_STREAM_INTERVAL
+        if run_status not in ACTIVE_RUN_STATUSES:
+            return
+
+        if idle_time >= LOG_STREAM_KEEPALIVE:
+            yield ": keepalive\n\n"
+            idle_time = 0
+        await asyncio.sleep(interval)
+        idle_time += interval
+        # Each poll reads the state document and lists the log chunks, idle jobs are polled less often
+        interval = min(interval * 2, LOG_STREAM_MAX_INTERVAL)
+
+
 @app.post("/schedule", status_code=status.HTTP_201_CREATED)
 async def schedule_run(scheduled_dbt_command: ScheduledDbtCommand = Depends()):
+    return await run_submission(submit_schedule, scheduled_dbt_command)
+
+
+def submit_schedule(scheduled_dbt_command: ScheduledDbtCommand) -> dict:
+    check_shards(scheduled_dbt_command)
     logger = DbtLogger(server=True)
     logger.log("INFO", f"Received scheduled command: {scheduled_dbt_command.user_command}")
 
-    state = State(scheduled_dbt_command)
+    try:
+        state = State(scheduled_dbt_command)
+    except InvalidArtifact as e:
+        raise HTTPException(status_code=400, detail=e.args[0])
     logger.log("INFO", f"Assigned job id: '{state.uuid}'")
     logger.state = state
-    state.extract_artifacts(scheduled_dbt_command.zipped_artifacts)
+    if scheduled_dbt_command.zipped_artifacts is not None:
+        SUBMISSION_BYTES.labels("received").observe(scheduled_dbt_command.zipped_artifacts.size or 0)
+        state.extract_artifacts(scheduled_dbt_command.zipped_artifacts.file)
 
     scheduler = CloudScheduler(project_id=PROJECT_ID, location=LOCATION, service_account_email=SERVICE_ACCOUNT)
     job_to_schedule = SchedulerHTTPJobSpec(
@@ -120,7 +556,7 @@ async def schedule_run(scheduled_dbt_command: ScheduledDbtCommand = Depends()):
     }
 
 @app.get("/schedule", status_code=status.HTTP_200_OK)
-async def list_schedules():
+def list_schedules():
     scheduler = CloudScheduler(project_id=PROJECT_ID, location=LOCATION, service_account_email=SERVICE_ACCOUNT)
     schedules = scheduler.list()
 
@@ -138,7 +574,7 @@ async def list_schedules():
     }
 
 @app.delete("/schedule/{name}", status_code=status.HTTP_200_OK)
-async def list_schedules(name):
+def delete_schedule(name):
     scheduler = CloudScheduler(project_id=PROJECT_ID, location=LOCATION, service_account_email=SERVICE_ACCOUNT)
     deleted = scheduler.delete(name)
 
@@ -148,6 +584,10 @@ async def list_schedules(name):
 
 @app.post("/schedule/{uuid}/start", status_code=status.HTTP_200_OK)
 async def start_scheduled_run(uuid: str):
+    return await run_submission(start_scheduled_job, uuid)
+
+
+def start_scheduled_job(uuid: str) -> dict:
     state = State.from_schedule_uuid(uuid)
     logger = DbtLogger(server=True)
     logger.state = state
@@ -155,16 +595,8 @@ async def start_scheduled_run(uuid: str):
     logger.log("INFO", f"Starting scheduled job with command: {state.user_command}")
 
     try:
-        job_conf = DbtCloudRunJobConfig(
-            uuid=state.uuid,
-            dbt_command=state.user_command,
-            project_id=PROJECT_ID,
-            location=LOCATION,
-            service_account=SERVICE_ACCOUNT,
-            job_docker_image=DOCKER_IMAGE,
-            artifacts_bucket_name=BUCKET_NAME
-        )
-        DbtCloudRunJobStarter(job_conf, logger).start()
+        admit_job(state, state.user_command, logger, priority="scheduled")
+        JOBS_SUBMITTED.labels("schedule").inc()
     except (DbtCloudRunJobCreationFailed, DbtCloudRunJobStartFailed) as e:
         traceback_str = traceback.format_exc()
         raise HTTPException(status_code=400, detail=f"{e.args[0]}\n{traceback_str}")
@@ -182,7 +614,15 @@ async def check():
 
 @app.get("/version", status_code=status.HTTP_200_OK)
 async def version():
-    return { "version": __version__}
+    return { "version": __version__, "features": SERVER_FEATURES}
+
+
+@app.get("/metrics", status_code=status.HTTP_200_OK)
+def metrics():
+    """
+        Prometheus metrics of this server instance. Job counts are read from Firestore, at most every JOB_STATUS_METRICS_INTERVAL.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 if __name__ == "__main__":
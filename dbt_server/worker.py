@@ -0,0 +1,89 @@
+import logging
+import os
+from pathlib import Path
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from dbt_server import dbt_run_job
+from dbt_server.lib.job_queue import QueuedJob, get_job_queue
+from dbt_server.lib.state import State
+
+WORKER_CLAIM_TIMEOUT = 10
+ACTIVE_RUN_STATUSES = ["pending", "running"]
+
+
+class Worker:
+    """
+        Long-lived process running queued jobs one at a time, with dbt already imported and Google Cloud clients
+        already connected. Each job runs in its own temporary directory, like in a fresh Cloud Run job.
+        With subprocess_jobs, used by the server with the local queue, each job runs in a child process
+        started in that directory instead, so that the server's working directory never changes.
+    """
+
+    def __init__(self, job_queue=None, worker_id: str = None, subprocess_jobs: bool = False):
+        self.job_queue = job_queue if job_queue is not None else get_job_queue()
+        self.worker_id = worker_id if worker_id is not None else f"{socket.gethostname()}-{uuid4().hex[:8]}"
+        self.subprocess_jobs = subprocess_jobs
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        logging.info(f"Worker {self.worker_id} waiting for jobs")
+        while not self.stopped.is_set():
+            job = self.job_queue.claim(timeout=WORKER_CLAIM_TIMEOUT)
+            if job is not None:
+                self.run_job(job)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def run_job(self, job: QueuedJob) -> None:
+        state = State.from_uuid(job.uuid)
+        state.record_span("worker_queue_wait", job.enqueued_at, datetime.now(timezone.utc))
+        with state.batch():
+            state.run_status = "running"
+            state.update({"worker": self.worker_id})
+
+        with tempfile.TemporaryDirectory() as job_dir:
+            try:
+                if self.subprocess_jobs:
+                    run_job_in_subprocess(job, job_dir)
+                else:
+                    run_job_in_directory(job, job_dir)
+            except Exception:
+                logging.error(f"Job {job.uuid} failed on worker {self.worker_id}\n{traceback.format_exc()}")
+            finally:
+                state.refresh()
+                if state.run_status in ACTIVE_RUN_STATUSES:
+                    state.run_status = "failed"
+
+
+def run_job_in_directory(job: QueuedJob, job_dir: str) -> None:
+    previous_dir = os.getcwd()
+    os.chdir(job_dir)
+    try:
+        dbt_run_job.run_job(job.uuid, job.dbt_command)
+    finally:
+        os.chdir(previous_dir)
+
+
+def run_job_in_subprocess(job: QueuedJob, job_dir: str) -> None:
+    # Started like the Cloud Run job, see DbtCloudRunJobConfig
+    package_root = str(Path(dbt_run_job.__file__).parent.parent)
+    python_path = os.pathsep.join(path for path in [package_root, os.environ.get("PYTHONPATH")] if path)
+    env = dict(os.environ, UUID=job.uuid, DBT_COMMAND=job.dbt_command, PYTHONPATH=python_path)
+    subprocess.run([sys.executable, dbt_run_job.__file__], cwd=job_dir, env=env, check=True)
+
+
+if __name__ == "__main__":
+    # Like the Cloud Run job, exit through SystemExit on SIGTERM so that the logs of the current job are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    logging.basicConfig(level=logging.INFO)
+    Worker().run()
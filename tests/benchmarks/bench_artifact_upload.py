@@ -0,0 +1,117 @@
+"""
+Benchmark of the artifact upload from the cli to the server, against manifest size.
+
+Compares the previous upload, an uncompressed zip built in memory, with the current one, a gzipped tar
+streamed as the request body. Each synthetic manifest is uploaded to the server app in-process, with
+artifacts stored in memory; the transfer time over a slow link is estimated from the body size.
+
+    python tests/benchmarks/bench_artifact_upload.py --sizes-mb 1 10 50 --link-mbps 10
+"""
+import argparse
+import io
+import json
+from pathlib import Path
+import random
+import tempfile
+import time
+import zipfile
+
+from fastapi.testclient import TestClient
+
+from dbt_remote.src.dbt_server import DbtServerCommand, hash_file
+from dbt_server import server
+
+
+class InMemoryCloudStorage:
+    blobs = {}
+
+    def __init__(self, bucket_name: str = None):
+        pass
+
+    def save_stream(self, file_name: str, file_obj, size: int = None) -> None:
+        self.blobs[file_name] = file_obj.read()
+
+
+def write_manifest(file_path: Path, size: int) -> None:
+    """Writes a manifest-like json of about size bytes: many nodes with repetitive keys and sql."""
+    nodes = {}
+    i = 0
+    while len(nodes) * 400 < size:
+        nodes[f"model.project.model_{i}"] = {
+            "unique_id": f"model.project.model_{i}",
+            "raw_code": f"select id, value_{random.randint(0, 100)} from {{{{ ref('model_{random.randint(0, i)}') }}}}",
+            "depends_on": {"nodes": [f"model.project.model_{random.randint(0, i)}"], "macros": []},
+            "config": {"materialized": "view", "tags": [], "enabled": True},
+            "checksum": {"name": "sha256", "checksum": f"{random.getrandbits(256):064x}"},
+        }
+        i += 1
+    file_path.write_text(json.dumps({"nodes": nodes}))
+
+
+def build_command(manifest_path: Path) -> DbtServerCommand:
+    command = DbtServerCommand.__new__(DbtServerCommand)
+    command.artifact_files = {"manifest.json": manifest_path}
+    command.artifacts = {"manifest.json": hash_file(manifest_path)}
+    return command
+
+
+def legacy_zip_artifacts(command: DbtServerCommand, artifact_hashes) -> io.BytesIO:
+    files_by_hash = {artifact_hash: command.artifact_files[relative_path] for relative_path, artifact_hash in command.artifacts.items()}
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w') as zipf:
+        for artifact_hash in artifact_hashes:
+            zipf.write(files_by_hash[artifact_hash], arcname=artifact_hash)
+    zip_buffer.seek(0)
+    return zip_buffer
+
+
+def run(client: TestClient, command: DbtServerCommand, link_mbps: float) -> dict:
+    artifact_hashes = list(command.artifacts.values())
+    body_size = 0
+
+    def body():
+        nonlocal body_size
+        for chunk in command.stream_artifacts(artifact_hashes):
+            if chunk:
+                body_size += len(chunk)
+                yield chunk
+
+    InMemoryCloudStorage.blobs.clear()
+    start = time.perf_counter()
+    response = client.post("/artifacts", content=body(), headers={"Content-Type": "application/gzip"})
+    duration = time.perf_counter() - start
+    assert response.status_code == 201, response.text
+
+    return {"body_size": body_size, "duration": duration, "transfer": body_size * 8 / (link_mbps * 1e6)}
+
+
+def run_legacy(command: DbtServerCommand, link_mbps: float) -> dict:
+    start = time.perf_counter()
+    zip_buffer = legacy_zip_artifacts(command, list(command.artifacts.values()))
+    duration = time.perf_counter() - start
+    body_size = len(zip_buffer.getvalue())
+    return {"body_size": body_size, "duration": duration, "transfer": body_size * 8 / (link_mbps * 1e6)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--link-mbps", type=float, default=10)
+    args = parser.parse_args()
+
+    server.CloudStorage = InMemoryCloudStorage
+    with tempfile.TemporaryDirectory() as temp_dir, TestClient(server.app) as client:
+        for size_mb in args.sizes_mb:
+            manifest_path = Path(temp_dir) / "manifest.json"
+            write_manifest(manifest_path, int(size_mb * 1024 * 1024))
+            command = build_command(manifest_path)
+
+            before = run_legacy(command, args.link_mbps)
+            after = run(client, command, args.link_mbps)
+            print(f"manifest={manifest_path.stat().st_size / 1e6:.1f}MB link={args.link_mbps:g}Mbit/s")
+            print(f"   before: {before['body_size'] / 1e6:>7.2f}MB body, {before['duration']:.2f}s to build the zip + {before['transfer']:.2f}s transfer")
+            print(f"   after:  {after['body_size'] / 1e6:>7.2f}MB body, {after['duration']:.2f}s to stream and store + {after['transfer']:.2f}s transfer")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Micro-benchmark of the dbt event callback of the Cloud Run job.
+
+Compares the previous callback, which read the job's log options from the State on every event,
+with the current one, which filters events against a JobLogConfig resolved once at job start.
+Storage is left out: run logs go to a LogFlusher whose batches are discarded.
+
+    python tests/benchmarks/bench_logger_callback.py --events 200000
+"""
+import argparse
+import logging
+import time
+
+from dbt.events.base_types import EventLevel, msg_from_base_event
+from dbt.events.types import Note
+
+from dbt_server import dbt_run_job
+from dbt_server.lib.logger import get_log_level
+from dbt_server.lib.state import LogFlusher
+
+
+class DiscardedRunLogs:
+    def append(self, logs):
+        pass
+
+
+class BenchState:
+    def __init__(self, dbt_native_params_overrides: dict):
+        self._dbt_native_params_overrides = dbt_native_params_overrides
+        self.document_reads = 0
+        self.log_flusher = LogFlusher(DiscardedRunLogs())
+
+    @property
+    def dbt_native_params_overrides(self) -> dict:
+        self.document_reads += 1  # Each access used to be a Firestore document.get()
+        return self._dbt_native_params_overrides
+
+    def log(self, severity: str, new_log: str) -> None:
+        self.log_flusher.put(f"{severity}\t{new_log}")
+
+
+class BenchLogger:
+    def __init__(self, state: BenchState):
+        self.state = state
+        self.logger = logging.getLogger("bench_logger_callback")
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+
+    def log(self, severity: str, new_log: str):
+        self.logger.log(level=get_log_level(severity), msg=new_log)
+        self.state.log(severity.upper(), new_log)
+
+
+def legacy_logger_callback(event):
+    state = dbt_run_job.state
+    logger = dbt_run_job.logger
+    user_log_format = state.dbt_native_params_overrides['log_format'] if 'log_format' in state.dbt_native_params_overrides else "default"
+    user_log_level_str = state.dbt_native_params_overrides['log_level'] if 'log_level' in state.dbt_native_params_overrides else "info"
+
+    if user_log_format == "json":
+        msg = dbt_run_job.msg_to_json(event).replace('\n', '  ')
+    else:
+        msg = "[dbt] " + event.info.msg.replace('\n', '  ')
+
+    user_log_level = logging.getLevelName(user_log_level_str.upper())
+    event_log_level = logging.getLevelName(event.info.level.upper())
+
+    if event_log_level >= user_log_level:
+        with dbt_run_job.callback_lock:
+            logger.log(event.info.level.upper(), msg)
+    else:
+        logger.logger.log(event_log_level, msg)
+
+
+def run(callback, events, dbt_native_params_overrides: dict) -> dict:
+    state = BenchState(dbt_native_params_overrides)
+    dbt_run_job.state = state
+    dbt_run_job.logger = BenchLogger(state)
+    dbt_run_job.log_config = dbt_run_job.JobLogConfig.from_dbt_native_params_overrides(dbt_native_params_overrides)
+    state.log_flusher.start()
+
+    start = time.perf_counter()
+    for event in events:
+        callback(event)
+    duration = time.perf_counter() - start
+    state.log_flusher.stop()
+
+    return {
+        "events_per_sec": len(events) / duration,
+        "document_reads_per_event": state.document_reads / len(events),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100000)
+    args = parser.parse_args()
+
+    levels = [EventLevel.DEBUG, EventLevel.DEBUG, EventLevel.DEBUG, EventLevel.INFO, EventLevel.WARN]
+    events = [
+        msg_from_base_event(Note(msg=f"Event {i}\nwith a second line"), level=levels[i % len(levels)])
+        for i in range(args.events)
+    ]
+
+    for dbt_native_params_overrides in [{}, {"log_level": "debug"}]:
+        before = run(legacy_logger_callback, events, dbt_native_params_overrides)
+        after = run(dbt_run_job.logger_callback, events, dbt_native_params_overrides)
+        print(f"overrides={dbt_native_params_overrides}")
+        print(f"   before: {before['events_per_sec']:>10.0f} events/s, {before['document_reads_per_event']:.0f} State document reads/event")
+        print(f"   after:  {after['events_per_sec']:>10.0f} events/s, {after['document_reads_per_event']:.0f} State document reads/event")
+
+
+if __name__ == "__main__":
+    main()
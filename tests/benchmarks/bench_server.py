@@ -0,0 +1,246 @@
+"""
+Offline benchmark of the server and the Cloud Run job, against in-memory fakes of Cloud Storage, Firestore,
+Cloud Run and Cloud Scheduler (see fake_backends.py), to track performance without a GCP project.
+
+For each manifest size, measures:
+  - submission latency of POST /dbt, with the artifacts uploaded as a zip or referenced by hash
+    (after POST /artifacts), and of POST /schedule
+  - artifact extraction throughput: zip members streamed to storage by State.extract_artifacts,
+    and the gzipped tar of the artifact store read by ArtifactStore.save_archive
+For each log volume, measures:
+  - log write throughput of the job: dbt events sent through dbt_run_job.logger_callback to the log flusher
+  - log polling cost: latency and backend calls of GET /job/{uuid}/last_logs when catching up and when idle,
+    and of GET /job/{uuid}/logs once the logs are compacted
+
+Backend calls are counted from the server's Prometheus metrics. --backend-latency-ms adds a fixed delay
+to every fake call, to see how the server behaves with round trips closer to the real services.
+Results are written as JSON to --output, to compare runs.
+
+    python tests/benchmarks/bench_server.py --sizes-mb 1 10 50 --log-lines 1000 100000 --output bench_server.json
+"""
+import argparse
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, List
+import zipfile
+
+# Read by dbt_server modules at import time
+os.environ.setdefault("LOCAL", "true")
+os.environ.setdefault("BUCKET_NAME", "bench-bucket")
+os.environ.setdefault("PROJECT_ID", "bench-project")
+os.environ.setdefault("LOCATION", "europe-west1")
+os.environ.setdefault("SERVICE_ACCOUNT", "bench@bench-project.iam.gserviceaccount.com")
+os.environ.setdefault("DOCKER_IMAGE", "europe-west1-docker.pkg.dev/bench-project/dbt-server/server")
+os.environ.setdefault("PIPELINE_INTERVAL", "3600")  # Keeps the background pipeline queries out of the call counts
+
+from dbt.events.base_types import EventLevel, msg_from_base_event
+from dbt.events.types import Note
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from bench_artifact_upload import build_command, write_manifest
+from fake_backends import install_fake_backends
+from dbt_server import dbt_run_job, server
+from dbt_server.lib.artifact_store import ArtifactStore
+from dbt_server.lib.dbt_command import DbtCommand
+from dbt_server.lib.gcs import CloudStorage
+from dbt_server.lib.metrics import BACKEND_CALL_LATENCY
+from dbt_server.lib.state import State
+
+SERVER_URL = "http://testserver/"
+COMMAND_FORM = {
+    "server_url": SERVER_URL,
+    "user_command": "run",
+    "dbt_project": "name: bench\nprofile: bench",
+    "profiles": "bench: {target: dev, outputs: {dev: {type: bigquery, method: oauth, project: bench, dataset: bench}}}",
+}
+
+
+def summarize(durations: List[float]) -> dict:
+    durations = sorted(durations)
+    return {
+        "mean_seconds": statistics.mean(durations),
+        "p50_seconds": durations[len(durations) // 2],
+        "p95_seconds": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+        "max_seconds": durations[-1],
+    }
+
+
+def backend_calls() -> Dict[str, float]:
+    return {
+        f"{sample.labels['backend']}.{sample.labels['operation']}": sample.value
+        for metric in BACKEND_CALL_LATENCY.collect() for sample in metric.samples if sample.name.endswith("_count")
+    }
+
+
+def measure(function: Callable[[], None], repeat: int) -> dict:
+    """
+        Runs function repeat times. Returns its latency and the average number of backend calls per run.
+    """
+    calls_before = backend_calls()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    calls_after = backend_calls()
+    calls = {name: (count - calls_before.get(name, 0)) / repeat for name, count in sorted(calls_after.items())}
+    return summarize(durations) | {"backend_calls": {name: count for name, count in calls.items() if count > 0}}
+
+
+def zip_manifest(manifest_path: Path) -> bytes:
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w') as zipf:
+        zipf.write(manifest_path, arcname="manifest.json")
+    return zip_buffer.getvalue()
+
+
+def post(client: TestClient, path: str, expected_status: int, **kwargs) -> dict:
+    response = client.post(path, **kwargs)
+    assert response.status_code == expected_status, response.text
+    return response.json()
+
+
+def bench_submissions(client: TestClient, manifest_path: Path, repeat: int) -> dict:
+    zipped_manifest = zip_manifest(manifest_path)
+    command = build_command(manifest_path)
+    tar_body = b"".join(command.stream_artifacts(list(command.artifacts.values())))
+    artifacts_form = COMMAND_FORM | {"artifacts": json.dumps(command.artifacts)}
+
+    return {
+        "zip_body_bytes": len(zipped_manifest),
+        "tar_body_bytes": len(tar_body),
+        "dbt_with_zip": measure(lambda: post(
+            client, "/dbt", 202, data=COMMAND_FORM, files={"zipped_artifacts": ("artifacts.zip", zipped_manifest, "application/zip")}
+        ), repeat),
+        "artifacts_upload": measure(lambda: post(
+            client, "/artifacts", 201, content=tar_body, headers={"Content-Type": "application/gzip"}
+        ), repeat),
+        "dbt_with_artifacts": measure(lambda: post(client, "/dbt", 202, data=artifacts_form), repeat),
+        "schedule_with_artifacts": measure(lambda: post(
+            client, "/schedule", 201, data=artifacts_form | {"schedule": "0 6 * * *"}
+        ), repeat),
+    }
+
+
+def bench_extraction(manifest_path: Path, repeat: int) -> dict:
+    manifest_bytes = manifest_path.stat().st_size
+    zipped_manifest = zip_manifest(manifest_path)
+    command = build_command(manifest_path)
+    tar_body = b"".join(command.stream_artifacts(list(command.artifacts.values())))
+    state = State(DbtCommand(
+        server_url=SERVER_URL, user_command="run", dbt_native_params_overrides="{}", dbt_project=COMMAND_FORM["dbt_project"],
+        profiles=COMMAND_FORM["profiles"], packages="{}", artifacts="{}", zipped_artifacts=None, coalesce=False, shards=1,
+    ))
+    artifact_store = ArtifactStore(CloudStorage(bucket_name=os.environ["BUCKET_NAME"]))
+
+    zip_extraction = measure(lambda: state.extract_artifacts(io.BytesIO(zipped_manifest)), repeat)
+    tar_extraction = measure(lambda: artifact_store.save_archive(io.BytesIO(tar_body)), repeat)
+    return {
+        "zip": zip_extraction | {"mb_per_second": manifest_bytes / 1e6 / zip_extraction["p50_seconds"]},
+        "tar": tar_extraction | {"mb_per_second": manifest_bytes / 1e6 / tar_extraction["p50_seconds"]},
+    }
+
+
+def bench_logs(client: TestClient, log_lines: int, repeat: int) -> dict:
+    uuid = post(client, "/dbt", 202, data=COMMAND_FORM)["uuid"]
+    events = [msg_from_base_event(Note(msg=f"{i} of {log_lines} OK created sql view model bench.model_{i}"), level=EventLevel.INFO) for i in range(log_lines)]
+
+    # As in a Cloud Run job: the State and log flusher of dbt_run_job.init_job, written to by the dbt callback
+    dbt_run_job.init_job(uuid)
+    bytes_before = REGISTRY.get_sample_value("dbt_server_log_bytes_written_total")
+    start = time.perf_counter()
+    for event in events:
+        dbt_run_job.logger_callback(event)
+    dbt_run_job.state.stop_log_flusher()
+    write_seconds = time.perf_counter() - start
+    log_bytes = REGISTRY.get_sample_value("dbt_server_log_bytes_written_total") - bytes_before
+    chunks = len(dbt_run_job.state.gcs.list_files(dbt_run_job.state.run_logs.log_folder))
+
+    catch_up = measure(lambda: client.get(f"/job/{uuid}/last_logs").raise_for_status(), 1)
+    idle_poll = measure(lambda: client.get(f"/job/{uuid}/last_logs").raise_for_status(), repeat)
+    dbt_run_job.state.compact_logs()
+    all_logs = measure(lambda: client.get(f"/job/{uuid}/logs").raise_for_status(), repeat)
+
+    return {
+        "write": {
+            "seconds": write_seconds,
+            "lines_per_second": log_lines / write_seconds,
+            "mb_per_second": log_bytes / 1e6 / write_seconds,
+            "bytes": log_bytes,
+            "chunks": chunks,
+        },
+        "poll_catch_up": catch_up,
+        "poll_idle": idle_poll,
+        "all_logs": all_logs,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--log-lines", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--backend-latency-ms", type=float, default=0)
+    parser.add_argument("--output", default="bench_server.json")
+    args = parser.parse_args()
+
+    results = {
+        "benchmark": "bench_server",
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "parameters": vars(args),
+        "manifests": [],
+        "logs": [],
+    }
+
+    # Only run logs are measured, console logs of the server, the job and the test client are left out.
+    # Configured before DbtLogger's own basicConfig, which then does nothing
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("dbt_server.lib.logger").propagate = False
+    install_fake_backends(latency=args.backend_latency_ms / 1000)
+    with tempfile.TemporaryDirectory() as temp_dir, TestClient(server.app) as client:
+        for size_mb in args.sizes_mb:
+            manifest_path = Path(temp_dir) / "manifest.json"
+            write_manifest(manifest_path, int(size_mb * 1024 * 1024))
+            submissions = bench_submissions(client, manifest_path, args.repeat)
+            extraction = bench_extraction(manifest_path, args.repeat)
+            results["manifests"].append({"manifest_bytes": manifest_path.stat().st_size, "submissions": submissions, "extraction": extraction})
+
+            print(f"manifest={manifest_path.stat().st_size / 1e6:.1f}MB")
+            for name in ["dbt_with_zip", "artifacts_upload", "dbt_with_artifacts", "schedule_with_artifacts"]:
+                print(f"   {name + ':':<25} p50 {submissions[name]['p50_seconds'] * 1000:>8.1f}ms, {sum(submissions[name]['backend_calls'].values()):.0f} backend calls")
+            for name, extracted in extraction.items():
+                print(f"   {name + ' extraction:':<25} {extracted['mb_per_second']:>8.1f}MB/s")
+
+        for log_lines in args.log_lines:
+            logs = bench_logs(client, log_lines, args.repeat)
+            results["logs"].append({"log_lines": log_lines} | logs)
+
+            print(f"log_lines={log_lines}")
+            print(f"   write: {logs['write']['lines_per_second']:>10.0f} lines/s, {logs['write']['mb_per_second']:.1f}MB/s in {logs['write']['chunks']} chunks")
+            for name in ["poll_catch_up", "poll_idle", "all_logs"]:
+                print(f"   {name + ':':<14} p50 {logs[name]['p50_seconds'] * 1000:>8.1f}ms, {sum(logs[name]['backend_calls'].values()):.0f} backend calls")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""
+In-memory stand-ins for the Google Cloud clients used by the server and the jobs, to run them without a GCP project.
+
+They replace the clients, not the dbt-server classes built on them, so that CloudStorage, State and the Cloud Run
+and Cloud Scheduler wrappers run their own code. Only the calls made by dbt-server are implemented; Firestore
+transactions (used by the admission controller and the Firestore job queue) are not.
+
+    from fake_backends import install_fake_backends
+    install_fake_backends(latency=0.01)  # before the server starts, see Clients
+"""
+import copy
+from datetime import datetime, timezone
+import threading
+import time
+from typing import Dict, List, Optional
+
+from google.api_core import exceptions
+from google.cloud import run_v2, scheduler_v1
+
+from dbt_server.lib.clients import Clients, set_clients
+
+
+class FakeBackend:
+    """
+        Optional fixed latency added to every call, to model the round trip to the real service.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+
+    def round_trip(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+
+# Cloud Storage
+
+class FakeStorageClient(FakeBackend):
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.buckets: Dict[str, Dict[str, bytes]] = {}
+
+    def bucket(self, bucket_name: str) -> "FakeBucket":
+        with self.lock:
+            return FakeBucket(self, bucket_name, self.buckets.setdefault(bucket_name, {}))
+
+    def get_bucket(self, bucket_name: str) -> "FakeBucket":
+        self.round_trip()
+        return self.bucket(bucket_name)
+
+    def list_blobs(self, bucket_name: str, prefix: str = "", start_offset: str = None) -> List["FakeBlob"]:
+        self.round_trip()
+        bucket = self.bucket(bucket_name)
+        with self.lock:
+            names = sorted(name for name in bucket.blobs if name.startswith(prefix) and (start_offset is None or name >= start_offset))
+        return [bucket.blob(name) for name in names]
+
+    def close(self) -> None:
+        pass
+
+
+class FakeBucket:
+
+    def __init__(self, client: FakeStorageClient, name: str, blobs: Dict[str, bytes]):
+        self.client = client
+        self.name = name
+        self.blobs = blobs
+
+    def blob(self, blob_name: str, chunk_size: int = None) -> "FakeBlob":
+        return FakeBlob(self, blob_name)
+
+    def get_blob(self, blob_name: str) -> Optional["FakeBlob"]:
+        self.client.round_trip()
+        with self.client.lock:
+            return FakeBlob(self, blob_name) if blob_name in self.blobs else None
+
+
+class FakeBlob:
+
+    def __init__(self, bucket: FakeBucket, name: str):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def size(self) -> Optional[int]:
+        data = self.bucket.blobs.get(self.name)
+        return len(data) if data is not None else None
+
+    def upload_from_string(self, data, if_generation_match: int = None, **kwargs) -> None:
+        self.bucket.client.round_trip()
+        with self.bucket.client.lock:
+            if if_generation_match == 0 and self.name in self.bucket.blobs:
+                raise exceptions.PreconditionFailed(f"{self.name} already exists")
+            self.bucket.blobs[self.name] = data.encode() if isinstance(data, str) else bytes(data)
+
+    def upload_from_file(self, file_obj, size: int = None, **kwargs) -> None:
+        self.bucket.client.round_trip()
+        data = file_obj.read() if size is None else file_obj.read(size)
+        with self.bucket.client.lock:
+            self.bucket.blobs[self.name] = data
+
+    def download_as_bytes(self, client=None, start: int = 0) -> bytes:
+        self.bucket.client.round_trip()
+        with self.bucket.client.lock:
+            if self.name not in self.bucket.blobs:
+                raise exceptions.NotFound(f"{self.name} not found")
+            return self.bucket.blobs[self.name][start:]
+
+    def download_to_filename(self, filename: str) -> None:
+        data = self.download_as_bytes()
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    def exists(self) -> bool:
+        self.bucket.client.round_trip()
+        return self.name in self.bucket.blobs
+
+    def compose(self, sources: List["FakeBlob"]) -> None:
+        self.bucket.client.round_trip()
+        with self.bucket.client.lock:
+            self.bucket.blobs[self.name] = b"".join(self.bucket.blobs[source.name] for source in sources)
+
+
+# Firestore
+
+class FakeFirestoreClient(FakeBackend):
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.collections: Dict[str, Dict[str, dict]] = {}
+        self.update_times: Dict[tuple, datetime] = {}
+
+    def collection(self, collection_name: str) -> "FakeCollection":
+        with self.lock:
+            return FakeCollection(self, collection_name, self.collections.setdefault(collection_name, {}))
+
+    def get_all(self, references: List["FakeDocument"]) -> List["FakeSnapshot"]:
+        self.round_trip()
+        return [reference.snapshot() for reference in references]
+
+    def write_option(self, last_update_time: datetime) -> "FakeWriteOption":
+        return FakeWriteOption(last_update_time)
+
+    def close(self) -> None:
+        pass
+
+
+class FakeWriteOption:
+
+    def __init__(self, last_update_time: datetime):
+        self.last_update_time = last_update_time
+
+
+class FakeCollection:
+
+    def __init__(self, client: FakeFirestoreClient, name: str, documents: Dict[str, dict]):
+        self.client = client
+        self.name = name
+        self.documents = documents
+
+    def document(self, document_id: str) -> "FakeDocument":
+        return FakeDocument(self, document_id)
+
+    def where(self, filter) -> "FakeQuery":
+        return FakeQuery(self).where(filter=filter)
+
+    def order_by(self, field_path: str) -> "FakeQuery":
+        return FakeQuery(self).order_by(field_path)
+
+
+class FakeQuery:
+    OPERATORS = {
+        "==": lambda value, expected: value == expected,
+        "in": lambda value, expected: value in expected,
+    }
+
+    def __init__(self, collection: FakeCollection):
+        self.collection = collection
+        self.filters = []
+        self.ordering: str = None
+        self.max_results: int = None
+
+    def where(self, filter) -> "FakeQuery":
+        self.filters.append(filter)
+        return self
+
+    def order_by(self, field_path: str) -> "FakeQuery":
+        self.ordering = field_path
+        return self
+
+    def limit(self, count: int) -> "FakeQuery":
+        self.max_results = count
+        return self
+
+    def select(self, field_paths: List[str]) -> "FakeQuery":
+        return self  # Returning whole documents is enough for reads through DocumentSnapshot.get
+
+    def stream(self) -> List["FakeSnapshot"]:
+        self.collection.client.round_trip()
+        with self.collection.client.lock:
+            document_ids = [
+                document_id for document_id, document in self.collection.documents.items()
+                if all(self.OPERATORS[f.op_string](document.get(f.field_path), f.value) for f in self.filters)
+            ]
+        snapshots = [self.collection.document(document_id).snapshot() for document_id in document_ids]
+        if self.ordering is not None:
+            snapshots.sort(key=lambda snapshot: snapshot.get(self.ordering))
+        return snapshots[:self.max_results]
+
+
+class FakeDocument:
+
+    def __init__(self, collection: FakeCollection, document_id: str):
+        self.collection = collection
+        self.id = document_id
+
+    @property
+    def client(self) -> FakeFirestoreClient:
+        return self.collection.client
+
+    @property
+    def key(self) -> tuple:
+        return self.collection.name, self.id
+
+    def snapshot(self) -> "FakeSnapshot":
+        with self.client.lock:
+            return FakeSnapshot(self, copy.deepcopy(self.collection.documents.get(self.id)), self.client.update_times.get(self.key))
+
+    def get(self, transaction=None) -> "FakeSnapshot":
+        self.client.round_trip()
+        return self.snapshot()
+
+    def set(self, document_data: dict, merge: bool = False) -> None:
+        self.client.round_trip()
+        with self.client.lock:
+            if merge and self.id in self.collection.documents:
+                merge_fields(self.collection.documents[self.id], copy.deepcopy(document_data))
+            else:
+                self.collection.documents[self.id] = copy.deepcopy(document_data)
+            self.client.update_times[self.key] = datetime.now(timezone.utc)
+
+    def update(self, field_updates: dict, option: FakeWriteOption = None) -> None:
+        self.client.round_trip()
+        with self.client.lock:
+            if self.id not in self.collection.documents:
+                raise exceptions.NotFound(f"{self.collection.name}/{self.id} not found")
+            if option is not None and self.client.update_times.get(self.key) != option.last_update_time:
+                raise exceptions.FailedPrecondition(f"{self.collection.name}/{self.id} changed since it was read")
+            for field_path, value in copy.deepcopy(field_updates).items():
+                fields = self.collection.documents[self.id]
+                *parents, leaf = field_path.split(".")
+                for parent in parents:
+                    fields = fields.setdefault(parent, {})
+                fields[leaf] = value
+            self.client.update_times[self.key] = datetime.now(timezone.utc)
+
+    def delete(self) -> None:
+        self.client.round_trip()
+        with self.client.lock:
+            self.collection.documents.pop(self.id, None)
+            self.client.update_times.pop(self.key, None)
+
+
+class FakeSnapshot:
+
+    def __init__(self, reference: FakeDocument, document: Optional[dict], update_time: Optional[datetime]):
+        self.reference = reference
+        self.id = reference.id
+        self.update_time = update_time
+        self._document = document
+
+    @property
+    def exists(self) -> bool:
+        return self._document is not None
+
+    def to_dict(self) -> Optional[dict]:
+        return copy.deepcopy(self._document)
+
+    def get(self, field_path: str):
+        value = self._document
+        for field in field_path.split("."):
+            value = value[field]
+        return value
+
+
+def merge_fields(document: dict, fields: dict) -> None:
+    for key, value in fields.items():
+        if isinstance(value, dict) and isinstance(document.get(key), dict):
+            merge_fields(document[key], value)
+        else:
+            document[key] = value
+
+
+# Cloud Run and Cloud Scheduler
+
+class FakeOperation:
+
+    def __init__(self, response):
+        self.response = response
+
+    def result(self):
+        return self.response
+
+
+class FakeJobsClient(FakeBackend):
+    """
+        Records the jobs created and the executions requested; nothing is run.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.jobs: Dict[str, run_v2.Job] = {}
+        self.executions: List[run_v2.RunJobRequest] = []
+
+    def create_job(self, request: run_v2.CreateJobRequest) -> FakeOperation:
+        self.round_trip()
+        name = f"{request.parent}/jobs/{request.job_id}"
+        with self.lock:
+            if name in self.jobs:
+                raise exceptions.AlreadyExists(f"{name} already exists")
+            job = run_v2.Job(request.job)
+            job.name = name
+            self.jobs[name] = job
+        return FakeOperation(job)
+
+    def update_job(self, request: run_v2.UpdateJobRequest) -> FakeOperation:
+        self.round_trip()
+        with self.lock:
+            self.jobs[request.job.name] = request.job
+        return FakeOperation(request.job)
+
+    def run_job(self, request: run_v2.RunJobRequest) -> FakeOperation:
+        self.round_trip()
+        with self.lock:
+            if request.name not in self.jobs:
+                raise exceptions.NotFound(f"{request.name} not found")
+            self.executions.append(request)
+        return FakeOperation(run_v2.Execution(job=request.name))
+
+
+class FakeSchedulerClient(FakeBackend):
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.jobs: Dict[str, scheduler_v1.Job] = {}
+
+    def create_job(self, parent: str, job: dict) -> scheduler_v1.Job:
+        self.round_trip()
+        job = scheduler_v1.Job(job, state=scheduler_v1.Job.State.ENABLED)
+        with self.lock:
+            if job.name in self.jobs:
+                raise exceptions.AlreadyExists(f"{job.name} already exists")
+            self.jobs[job.name] = job
+        return job
+
+    def list_jobs(self, parent: str) -> List[scheduler_v1.Job]:
+        self.round_trip()
+        with self.lock:
+            return [job for name, job in self.jobs.items() if name.startswith(f"{parent}/jobs/")]
+
+    def delete_job(self, name: str) -> None:
+        self.round_trip()
+        with self.lock:
+            if self.jobs.pop(name, None) is None:
+                raise exceptions.NotFound(f"{name} not found")
+
+
+class FakeLoggingClient:
+    """
+        Never called when the LOCAL environment variable is set, DbtLogger then only logs to the console.
+    """
+
+    def close(self) -> None:
+        pass
+
+
+def install_fake_backends(latency: float = 0.0) -> Clients:
+    clients = Clients(
+        storage=FakeStorageClient(latency),
+        firestore=FakeFirestoreClient(latency),
+        jobs=FakeJobsClient(latency),
+        scheduler=FakeSchedulerClient(latency),
+        logging=FakeLoggingClient(),
+    )
+    set_clients(clients)
+    return clients
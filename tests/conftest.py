@@ -0,0 +1,12 @@
+import pytest
+
+from dbt_server.lib.clients import set_clients
+from tests.benchmarks.fake_backends import install_fake_backends
+
+
+@pytest.fixture
+def fake_backends():
+    """In-memory Cloud Storage, Firestore, Cloud Run and Cloud Scheduler clients, see tests/benchmarks/fake_backends.py."""
+    clients = install_fake_backends()
+    yield clients
+    set_clients(None)
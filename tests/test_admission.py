@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from dbt_server.lib import admission
+from dbt_server.lib.admission import AdmissionController
+from dbt_server.lib.firestore import get_collection
+
+
+def add_job(uuid: str, run_status: str, **fields) -> None:
+    get_collection("dbt-status").document(uuid).set({"uuid": uuid, "run_status": run_status, **fields})
+
+
+def run_status(uuid: str) -> str:
+    return get_collection("dbt-status").document(uuid).get().get("run_status")
+
+
+@pytest.fixture
+def controller(fake_backends, monkeypatch):
+    # Firestore transactions are not faked, the lease is always held
+    monkeypatch.setattr(AdmissionController, "acquire_lease", lambda self: True)
+    started = []
+    controller = AdmissionController(lambda state: started.append(state.uuid))
+    controller.started = started
+    return controller
+
+
+def test_started_jobs_skips_stale_and_legacy_documents(controller):
+    now = datetime.now(timezone.utc)
+    add_job("dispatched", "running", created_at=now - timedelta(days=2), dispatched_at=now)
+    add_job("created", "pending", created_at=now)
+    add_job("stale", "running", created_at=now - admission.ACTIVE_JOB_TIMEOUT - timedelta(minutes=1))
+    add_job("legacy", "running")
+    add_job("done", "success", created_at=now)
+
+    assert sorted(job["uuid"] for job in controller.started_jobs()) == ["created", "dispatched"]
+
+
+def test_dispatch_starts_queued_jobs_within_the_limits(controller, monkeypatch):
+    monkeypatch.setattr(admission, "MAX_CONCURRENT_JOBS", 3)
+    monkeypatch.setattr(admission, "MAX_CONCURRENT_JOBS_PER_TARGET", 1)
+    now = datetime.now(timezone.utc)
+    add_job("running-prod", "running", target="prod", created_at=now)
+    add_job("legacy", "running")  # Not counted, and does not fail the dispatch
+    add_job("prod", "queued", target="prod", priority="interactive", queued_at=now - timedelta(seconds=30))
+    add_job("dev-scheduled", "queued", target="dev", priority="scheduled", queued_at=now - timedelta(seconds=20))
+    add_job("dev-interactive", "queued", target="dev", priority="interactive", queued_at=now - timedelta(seconds=10))
+    add_job("ci", "queued", target="ci", priority="scheduled", queued_at=now)
+
+    assert controller.dispatch() == ["dev-interactive", "ci"]
+    assert controller.started == ["dev-interactive", "ci"]
+    assert [run_status(uuid) for uuid in ["prod", "dev-scheduled", "dev-interactive", "ci"]] == ["queued", "queued", "pending", "pending"]
+    assert controller.wait_time_stats()["count"] == 2
+
+
+def test_dispatch_fails_jobs_that_cannot_start(controller):
+    add_job("queued", "queued", target="dev", queued_at=datetime.now(timezone.utc))
+
+    def start_job(state):
+        raise Exception("Cloud Run unavailable")
+    controller.start_job = start_job
+
+    assert controller.dispatch() == ["queued"]
+    assert run_status("queued") == "failed"
+
+
+def test_dispatch_without_the_lease_starts_nothing(controller, monkeypatch):
+    monkeypatch.setattr(AdmissionController, "acquire_lease", lambda self: False)
+    add_job("queued", "queued", target="dev", queued_at=datetime.now(timezone.utc))
+
+    assert controller.dispatch() == []
+    assert run_status("queued") == "queued"
@@ -0,0 +1,116 @@
+import hashlib
+import io
+import tarfile
+
+import pytest
+
+from dbt_remote.src.dbt_server import DbtServerCommand, hash_file
+from dbt_server.lib.artifact_store import ArtifactStore, InvalidArtifact, validate_artifacts
+from dbt_server.lib.gcs import CloudStorage
+
+MANIFEST = b'{"nodes": {}}'
+SEED = b"code\nFR\n"
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def artifact_store(fake_backends) -> ArtifactStore:
+    return ArtifactStore(CloudStorage(bucket_name="bucket"))
+
+
+def store(artifact_store: ArtifactStore, data: bytes) -> str:
+    artifact_hash = sha256(data)
+    artifact_store.gcs.save(artifact_store.path(artifact_hash), data)
+    return artifact_hash
+
+
+def test_missing_lists_the_artifacts_not_stored(artifact_store):
+    manifest_hash = store(artifact_store, MANIFEST)
+
+    assert artifact_store.missing([manifest_hash, sha256(SEED)]) == [sha256(SEED)]
+
+
+def test_missing_rejects_invalid_hashes(artifact_store):
+    with pytest.raises(InvalidArtifact):
+        artifact_store.missing(["../../profiles.yml"])
+
+
+def test_restore_writes_artifacts_at_their_project_path(artifact_store, tmp_path):
+    manifest_hash, seed_hash = store(artifact_store, MANIFEST), store(artifact_store, SEED)
+
+    timings = artifact_store.restore({
+        "manifest.json": manifest_hash,
+        "seeds/countries.csv": seed_hash,
+        "seeds/countries_copy.csv": seed_hash,  # Same content, downloaded once
+    }, local_dir=str(tmp_path))
+
+    assert (tmp_path / "manifest.json").read_bytes() == MANIFEST
+    assert (tmp_path / "seeds" / "countries.csv").read_bytes() == SEED
+    assert (tmp_path / "seeds" / "countries_copy.csv").read_bytes() == SEED
+    assert len(timings) == 2
+
+
+@pytest.mark.parametrize("relative_path", ["/etc/passwd", "../profiles.yml", "seeds/../../profiles.yml"])
+def test_artifact_paths_must_stay_in_the_project(relative_path):
+    with pytest.raises(InvalidArtifact):
+        validate_artifacts({relative_path: sha256(SEED)})
+
+
+def test_artifact_hashes_are_validated():
+    validate_artifacts({"seeds/countries.csv": sha256(SEED)})
+    with pytest.raises(InvalidArtifact):
+        validate_artifacts({"seeds/countries.csv": "not-a-hash"})
+
+
+def archive(members: dict) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, data in members.items():
+            tar_info = tarfile.TarInfo(name)
+            tar_info.size = len(data)
+            tar.addfile(tar_info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+def test_save_archive_stores_members_by_hash(artifact_store):
+    saved = artifact_store.save_archive(archive({sha256(MANIFEST): MANIFEST, sha256(SEED): SEED}))
+
+    assert saved == [sha256(MANIFEST), sha256(SEED)]
+    assert artifact_store.gcs.load(artifact_store.path(sha256(SEED))) == SEED
+    assert artifact_store.missing(saved) == []
+
+
+def test_save_archive_rejects_members_not_matching_their_hash(artifact_store):
+    with pytest.raises(InvalidArtifact):
+        artifact_store.save_archive(archive({sha256(MANIFEST): SEED}))
+
+    assert artifact_store.missing([sha256(MANIFEST)]) == [sha256(MANIFEST)]
+
+
+def test_save_archive_rejects_directories(artifact_store):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        tar_info = tarfile.TarInfo(sha256(SEED))
+        tar_info.type = tarfile.DIRTYPE
+        tar.addfile(tar_info)
+    buffer.seek(0)
+
+    with pytest.raises(InvalidArtifact):
+        artifact_store.save_archive(buffer)
+
+
+def test_cli_archive_is_read_by_the_store(artifact_store, tmp_path):
+    (tmp_path / "manifest.json").write_bytes(MANIFEST)
+    (tmp_path / "countries.csv").write_bytes(SEED * 200_000)  # Spread over several read blocks
+    command = DbtServerCommand.__new__(DbtServerCommand)
+    command.artifact_files = {"manifest.json": tmp_path / "manifest.json", "seeds/countries.csv": tmp_path / "countries.csv"}
+    command.artifacts = {relative_path: hash_file(file_path) for relative_path, file_path in command.artifact_files.items()}
+
+    body = io.BytesIO(b"".join(command.stream_artifacts(sorted(command.artifacts.values()))))
+
+    assert artifact_store.save_archive(body) == sorted(command.artifacts.values())
+    assert artifact_store.gcs.load(artifact_store.path(command.artifacts["seeds/countries.csv"])) == SEED * 200_000
@@ -0,0 +1,122 @@
+from fastapi import HTTPException
+import pytest
+
+from dbt_server import server
+from dbt_server.lib.batch import BATCH_COLLECTION, Batch, advance_pipelines
+from dbt_server.lib.dbt_command import DbtBatchCommand
+from dbt_server.lib.firestore import get_collection
+
+
+def create_pipeline(run_statuses: list) -> Batch:
+    jobs = [f"job-{i}" for i in range(len(run_statuses))]
+    get_collection(BATCH_COLLECTION).document("batch").set({
+        "batch_id": "batch", "mode": "pipeline", "jobs": jobs, "commands": ["run"] * len(jobs),
+    })
+    for uuid, run_status in zip(jobs, run_statuses):
+        get_collection("dbt-status").document(uuid).set({"uuid": uuid, "batch_id": "batch", "user_command": "run", "run_status": run_status})
+    return Batch("batch")
+
+
+def run_statuses() -> list:
+    return [get_collection("dbt-status").document(f"job-{i}").get().get("run_status") for i in range(3)]
+
+
+class JobStarter:
+    def __init__(self, error: Exception = None):
+        self.started = []
+        self.error = error
+
+    def __call__(self, state):
+        self.started.append((state.uuid, state.run_status))
+        if self.error is not None:
+            raise self.error
+
+
+def test_pipeline_starts_the_next_job_as_pending(fake_backends):
+    batch = create_pipeline(["success", "blocked", "blocked"])
+    start_job = JobStarter()
+
+    batch.advance_pipeline(start_job)
+
+    assert start_job.started == [("job-1", "pending")]
+    assert run_statuses() == ["success", "pending", "blocked"]
+
+    # The started job is active, the next one waits for it
+    Batch("batch").advance_pipeline(start_job)
+    assert start_job.started == [("job-1", "pending")]
+
+
+def test_pipeline_skips_the_jobs_after_a_failed_job(fake_backends):
+    batch = create_pipeline(["success", "failed", "blocked"])
+    start_job = JobStarter()
+
+    batch.advance_pipeline(start_job)
+
+    assert start_job.started == []
+    assert run_statuses() == ["success", "failed", "skipped"]
+
+
+def test_pipeline_job_that_cannot_start_fails(fake_backends):
+    batch = create_pipeline(["success", "blocked", "blocked"])
+
+    batch.advance_pipeline(JobStarter(error=Exception("Cloud Run unavailable")))
+
+    assert run_statuses() == ["success", "failed", "blocked"]
+
+
+@pytest.mark.parametrize("run_status", ["queued", "pending", "running"])
+def test_pipeline_waits_for_the_previous_job(fake_backends, run_status):
+    batch = create_pipeline(["success", run_status, "blocked"])
+    start_job = JobStarter()
+
+    batch.advance_pipeline(start_job)
+
+    assert start_job.started == []
+    assert run_statuses() == ["success", run_status, "blocked"]
+
+
+def test_blocked_job_is_claimed_once(fake_backends):
+    create_pipeline(["success", "blocked", "blocked"])
+    first_batch, second_batch = Batch("batch"), Batch("batch")
+    snapshots = second_batch.job_snapshots()  # Read by another server instance before the first one claims the job
+    start_job = JobStarter()
+
+    first_batch.advance_pipeline(start_job)
+    second_batch.job_snapshots = lambda: snapshots
+    second_batch.advance_pipeline(start_job)
+
+    assert start_job.started == [("job-1", "pending")]
+
+
+def test_advance_pipelines_advances_batches_with_blocked_jobs(fake_backends):
+    create_pipeline(["success", "success", "blocked"])
+    start_job = JobStarter()
+
+    advance_pipelines(start_job)
+
+    assert start_job.started == [("job-2", "pending")]
+
+
+def batch_command(artifacts: str) -> DbtBatchCommand:
+    return DbtBatchCommand(
+        server_url="http://server/", commands='["seed", "run"]', mode="pipeline", dbt_native_params_overrides="{}",
+        dbt_project="name: project", profiles="project: {}", packages="{}", artifacts=artifacts,
+    )
+
+
+@pytest.mark.parametrize("artifacts", ["{}", '{"seeds/countries.csv": "' + "0" * 64 + '"}'])
+def test_batches_without_a_manifest_are_rejected(fake_backends, artifacts):
+    with pytest.raises(HTTPException) as error:
+        server.submit_batch(batch_command(artifacts))
+
+    assert error.value.status_code == 400
+    assert get_collection("dbt-status").documents == {}  # No job was created
+
+
+def test_batch_status_does_not_start_blocked_jobs(fake_backends):
+    create_pipeline(["success", "blocked", "blocked"])
+
+    batch_status = server.get_batch_status("batch")
+
+    assert batch_status["run_status"] == "running"
+    assert run_statuses() == ["success", "blocked", "blocked"]
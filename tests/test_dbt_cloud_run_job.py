@@ -0,0 +1,85 @@
+from google.cloud import run_v2
+import pytest
+
+from dbt_server.lib.dbt_cloud_run_job import DbtCloudRunJobConfig, DbtCloudRunJobStarter
+from dbt_server.lib.firestore import get_collection
+from dbt_server.lib.state import State
+
+PARENT = "projects/project/locations/europe-west1"
+
+
+class FakeLogger:
+    def log(self, severity: str, new_log: str):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def no_cached_template_jobs(monkeypatch):
+    monkeypatch.setattr(DbtCloudRunJobStarter, "template_jobs", {})
+
+
+def start_job(uuid: str, dbt_command: str = "run", reuse_job: bool = True, task_count: int = 1) -> DbtCloudRunJobStarter:
+    get_collection("dbt-status").document(uuid).set({"uuid": uuid, "run_status": "pending"})
+    starter = DbtCloudRunJobStarter(DbtCloudRunJobConfig(
+        uuid=uuid, dbt_command=dbt_command, project_id="project", location="europe-west1", service_account="job@project",
+        job_docker_image="image:1", artifacts_bucket_name="bucket", reuse_job=reuse_job, task_count=task_count,
+    ), FakeLogger())
+    starter.start()
+    return starter
+
+
+def env(env_vars) -> dict:
+    return {env_var.name: env_var.value for env_var in env_vars}
+
+
+def test_each_command_gets_its_own_job_by_default(fake_backends):
+    start_job("job-1", reuse_job=False, task_count=2)
+
+    job = fake_backends.jobs.jobs[f"{PARENT}/jobs/ujob1"]
+    assert env(job.template.template.containers[0].env)["DBT_COMMAND"] == "run"
+    assert job.template.task_count == 2
+    assert [execution.name for execution in fake_backends.jobs.executions] == [job.name]
+    assert State.from_uuid("job-1").run_status == "running"
+
+
+def test_template_job_is_created_once_and_commands_are_given_as_overrides(fake_backends):
+    first = start_job("job-1", dbt_command="run --select orders")
+    start_job("job-2", dbt_command="build", task_count=3)
+
+    template_name = f"{PARENT}/jobs/{first.template_job_id}"
+    assert list(fake_backends.jobs.jobs) == [template_name]
+    template_env = env(fake_backends.jobs.jobs[template_name].template.template.containers[0].env)
+    assert (template_env["DBT_COMMAND"], template_env["UUID"], template_env["BUCKET_NAME"]) == ("", "", "bucket")
+
+    executions = fake_backends.jobs.executions
+    assert [execution.name for execution in executions] == [template_name, template_name]
+    assert [env(execution.overrides.container_overrides[0].env) for execution in executions] == [
+        {"DBT_COMMAND": "run --select orders", "UUID": "job-1"},
+        {"DBT_COMMAND": "build", "UUID": "job-2"},
+    ]
+    assert [execution.overrides.task_count for execution in executions] == [1, 3]
+    assert State.from_uuid("job-2").snapshot["cloud_run_job"] == template_name
+
+
+def test_existing_template_job_is_updated_and_reused(fake_backends):
+    # Left by a previous server process, possibly with an outdated config
+    starter = start_job("job-1")
+    template_name = f"{PARENT}/jobs/{starter.template_job_id}"
+    fake_backends.jobs.jobs[template_name].template.template.max_retries = 3
+    DbtCloudRunJobStarter.template_jobs.clear()
+
+    start_job("job-2")
+
+    assert list(fake_backends.jobs.jobs) == [template_name]
+    assert fake_backends.jobs.jobs[template_name].template.template.max_retries == 0
+    assert [execution.name for execution in fake_backends.jobs.executions] == [template_name, template_name]
+
+
+def test_template_job_depends_on_the_image(fake_backends):
+    first = start_job("job-1")
+    second = DbtCloudRunJobStarter(DbtCloudRunJobConfig(
+        uuid="job-2", dbt_command="run", project_id="project", location="europe-west1", service_account="job@project",
+        job_docker_image="image:2", artifacts_bucket_name="bucket", reuse_job=True,
+    ), FakeLogger())
+
+    assert second.template_job_id != first.template_job_id
@@ -0,0 +1,78 @@
+import json
+from types import SimpleNamespace
+
+from dbt.contracts.graph.manifest import Manifest
+import pytest
+
+from dbt_remote.src.manifest_cache import get_manifest_msgpack
+from dbt_server import dbt_run_job
+from dbt_server.lib.firestore import get_collection
+from dbt_server.lib.state import State
+
+
+@pytest.fixture
+def job(fake_backends, monkeypatch):
+    monkeypatch.setenv("LOCAL", "true")
+    get_collection("dbt-status").document("job").set({"uuid": "job", "run_status": "running", "dbt_native_params_overrides": {}})
+
+    # Logs written when the final run status is set, which ends the log streams
+    logs_at_final_status = []
+    update = State.update
+
+    def record_logs_at_final_status(self, fields: dict):
+        if fields.get("run_status") in ["success", "failed"]:
+            logs, _ = self.run_logs.get(0)
+            logs_at_final_status.extend(log.split("\t")[-1] for log in logs)
+        update(self, fields)
+    monkeypatch.setattr(State, "update", record_logs_at_final_status)
+    return logs_at_final_status
+
+
+@pytest.mark.parametrize("error", [None, Exception("dbt command failed")])
+def test_last_logs_are_written_before_the_final_run_status(job, monkeypatch, error):
+    def prepare_and_execute_job(dbt_command: str):
+        dbt_run_job.logger.log("INFO", "[job] last line")
+        if error is not None:
+            raise error
+    monkeypatch.setattr(dbt_run_job, "prepare_and_execute_job", prepare_and_execute_job)
+
+    if error is None:
+        dbt_run_job.run_job("job", "run")
+    else:
+        with pytest.raises(Exception):
+            dbt_run_job.run_job("job", "run")
+
+    assert job[-1] == "[job] last line"
+    assert State.from_uuid("job").run_status == ("success" if error is None else "failed")
+
+
+def test_dependencies_are_not_installed_without_packages(job, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "packages.yml").write_text("{}\n")  # Written by the server when the command has no packages
+    dbt_run_job.init_job("job")
+    monkeypatch.setattr(dbt_run_job, "PackageCache", lambda *args: pytest.fail("The package cache should not be used"))
+    monkeypatch.setattr(dbt_run_job, "invoke_dbt", lambda manifest, args_list: pytest.fail("dbt deps should not run"))
+
+    dbt_run_job.install_dependencies(manifest=None)
+    dbt_run_job.state.stop_log_flusher()
+
+
+def test_msgpack_and_json_manifests_load_the_same_manifest(monkeypatch, tmp_path):
+    monkeypatch.setattr(dbt_run_job, "logger", SimpleNamespace(log=lambda severity, message: None))
+    manifest_dict = json.loads(json.dumps(Manifest().writable_manifest().to_dict()))
+    (tmp_path / "json").mkdir()
+    (tmp_path / "json" / "manifest.json").write_text(json.dumps(manifest_dict))
+    (tmp_path / "msgpack").mkdir()
+    get_manifest_msgpack(tmp_path / "json" / "manifest.json", tmp_path / "cache").rename(tmp_path / "msgpack" / "manifest.msgpack")
+
+    # Both go through Manifest.from_msgpack with the same bytes, as sent by older and newer clis
+    loaded = []
+    from_msgpack = Manifest.from_msgpack
+    monkeypatch.setattr(Manifest, "from_msgpack", lambda data: loaded.append(bytes(data)) or from_msgpack(bytes(data)))
+    monkeypatch.chdir(tmp_path / "json")
+    json_manifest = dbt_run_job.get_manifest()
+    monkeypatch.chdir(tmp_path / "msgpack")
+    msgpack_manifest = dbt_run_job.get_manifest()
+
+    assert loaded[0] == loaded[1]
+    assert json_manifest.writable_manifest().to_dict() == msgpack_manifest.writable_manifest().to_dict()
@@ -0,0 +1,57 @@
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from dbt_remote.src.dbt_server import DbtServer, DbtServerCommand
+
+
+@pytest.fixture
+def cli_config(tmp_path: Path) -> SimpleNamespace:
+    (tmp_path / "dbt_project.yml").write_text("name: project\nprofile: project\n")
+    (tmp_path / "profiles.yml").write_text("project: {target: dev, outputs: {dev: {type: bigquery}}}\n")
+    (tmp_path / "target").mkdir()
+    (tmp_path / "target" / "manifest.json").write_text("{}")
+    (tmp_path / "manifest.msgpack").write_bytes(b"\x80")
+    (tmp_path / "seeds").mkdir()
+    (tmp_path / "seeds" / "countries.csv").write_text("code\nFR\n")
+    (tmp_path / "seeds" / "README.md").write_text("")
+    return SimpleNamespace(
+        command="run", dbt_native_params_overrides={}, project_dir=tmp_path, profiles_dir=tmp_path,
+        manifest=tmp_path / "target", manifest_msgpack=str(tmp_path / "manifest.msgpack"), selected_seeds=None,
+        coalesce=None, shards=None, extra_packages=None, seeds_path=tmp_path / "seeds", schedule=None, schedule_name=None,
+    )
+
+
+def test_only_the_msgpack_manifest_is_sent_to_servers_supporting_it(cli_config):
+    command = DbtServerCommand.from_cli_config(cli_config, ["manifest_msgpack"])
+
+    assert sorted(command.artifacts) == ["manifest.msgpack", "seeds/countries.csv"]
+
+
+def test_json_manifest_is_sent_to_older_servers(cli_config):
+    command = DbtServerCommand.from_cli_config(cli_config, [])
+
+    assert sorted(command.artifacts) == ["manifest.json", "seeds/countries.csv"]
+    assert command.manifest_msgpack is None
+
+
+def test_local_paths_are_not_posted_as_form_fields(cli_config):
+    cli_config.selected_seeds = {"countries.csv"}
+    command = DbtServerCommand.from_cli_config(cli_config, ["manifest_msgpack"])
+    posted = []
+
+    class Session:
+        def post(self, url, data):
+            posted.append(data)
+            return SimpleNamespace(status_code=202, text='{"uuid": "job"}')
+
+    server = DbtServer.__new__(DbtServer)  # Skips authentication and the version check
+    server.server_url = "http://server/"
+    server.auth_session = Session()
+    server.send_command(command)
+
+    [data] = posted
+    assert not set(data) & {"manifest", "manifest_msgpack", "seeds", "selected_seeds", "artifact_files"}
+    assert json.loads(data["artifacts"]) == command.artifacts
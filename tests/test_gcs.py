@@ -0,0 +1,87 @@
+import io
+from pathlib import Path
+import threading
+
+from google.api_core import exceptions
+import pytest
+
+from dbt_server.lib import gcs
+from dbt_server.lib.gcs import CloudStorage, StreamSource, map_concurrently
+
+BUCKET = "bucket"
+
+
+@pytest.fixture
+def storage(fake_backends) -> CloudStorage:
+    return CloudStorage(BUCKET)
+
+
+def blobs(fake_backends) -> dict:
+    return fake_backends.storage.buckets[BUCKET]
+
+
+def test_upload_many_uploads_contents_and_streams(fake_backends, storage):
+    timings = storage.upload_many({
+        "folder/manifest.json": '{"nodes": {}}',
+        "folder/seeds/sub/countries.csv": b"code\nFR\n",
+        "folder/seeds/currencies.csv": StreamSource(lambda: io.BytesIO(b"code\nEUR\n"), size=9),
+    })
+
+    assert sorted(timings) == ["folder/manifest.json", "folder/seeds/currencies.csv", "folder/seeds/sub/countries.csv"]
+    assert blobs(fake_backends) == {
+        "folder/manifest.json": b'{"nodes": {}}',
+        "folder/seeds/sub/countries.csv": b"code\nFR\n",
+        "folder/seeds/currencies.csv": b"code\nEUR\n",
+    }
+
+
+def test_download_folder_keeps_paths_relative_to_the_folder(fake_backends, storage, tmp_path: Path, monkeypatch):
+    storage.upload_many({
+        "folder/manifest.json": "{}",
+        "folder/seeds/sub/x.csv": "x\n1\n",
+        "folder-2/manifest.json": "other job",  # Shares the prefix, not the folder
+    })
+    monkeypatch.chdir(tmp_path)
+
+    timings = storage.download_folder("folder")
+
+    assert sorted(timings) == ["folder/manifest.json", "folder/seeds/sub/x.csv"]
+    assert sorted(str(path.relative_to(tmp_path)) for path in tmp_path.rglob("*") if path.is_file()) == ["manifest.json", "seeds/sub/x.csv"]
+    assert (tmp_path / "seeds" / "sub" / "x.csv").read_text() == "x\n1\n"
+
+
+def test_download_many_creates_the_parent_folders(fake_backends, storage, tmp_path: Path):
+    storage.save("artifacts/abc", "content")
+
+    storage.download_many({"artifacts/abc": str(tmp_path / "seeds" / "sub" / "x.csv")})
+
+    assert (tmp_path / "seeds" / "sub" / "x.csv").read_text() == "content"
+
+
+def test_download_many_propagates_a_failed_download(fake_backends, storage, tmp_path: Path):
+    storage.save("folder/manifest.json", "{}")
+
+    with pytest.raises(exceptions.NotFound):
+        storage.download_many({"folder/manifest.json": str(tmp_path / "manifest.json"), "folder/missing.csv": str(tmp_path / "missing.csv")})
+
+
+def test_map_concurrently_keeps_the_order_of_the_items(monkeypatch):
+    monkeypatch.setattr(gcs, "MAX_TRANSFER_WORKERS", 4)
+    threads = set()
+
+    def square(item: int) -> int:
+        threads.add(threading.get_ident())
+        return item * item
+
+    assert map_concurrently(square, list(range(20))) == [item * item for item in range(20)]
+    assert len(threads) <= 4
+
+
+def test_map_concurrently_propagates_the_error_of_one_worker():
+    def transfer(item: int) -> int:
+        if item == 3:
+            raise exceptions.ServiceUnavailable("GCS unavailable")
+        return item
+
+    with pytest.raises(exceptions.ServiceUnavailable):
+        map_concurrently(transfer, list(range(8)))
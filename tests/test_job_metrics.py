@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+from dbt_remote.src.cli_utils import echo_timings
+from dbt_server import server
+from dbt_server.lib.firestore import get_collection
+
+CREATED_AT = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def span(start_seconds: float, duration_seconds: float) -> dict:
+    start = CREATED_AT + timedelta(seconds=start_seconds)
+    return {"start": start, "end": start + timedelta(seconds=duration_seconds), "duration_seconds": duration_seconds}
+
+
+def test_job_metrics_lists_spans_in_chronological_order(fake_backends):
+    get_collection("dbt-status").document("job").set({
+        "uuid": "job",
+        "run_status": "success",
+        "created_at": CREATED_AT,
+        "finished_at": CREATED_AT + timedelta(seconds=100),
+        "queue_wait_seconds": 5.0,
+        "spans": {"dbt_invoke": span(40, 60), "cloud_run_job_start": span(5, 10), "get_manifest": span(20, 15)},
+    })
+
+    with TestClient(server.app) as client:
+        response = client.get("/job/job/metrics")
+
+    assert response.status_code == 200
+    metrics = response.json()
+    assert [span["name"] for span in metrics["spans"]] == ["cloud_run_job_start", "get_manifest", "dbt_invoke"]
+    assert metrics["total_seconds"] == 100
+    assert metrics["queue_wait_seconds"] == 5
+
+
+def test_job_metrics_of_a_job_without_creation_time(fake_backends):
+    # Jobs created before created_at was recorded
+    get_collection("dbt-status").document("job").set({"uuid": "job", "run_status": "success", "spans": {"dbt_invoke": span(40, 60)}})
+
+    with TestClient(server.app) as client:
+        response = client.get("/job/job/metrics")
+
+    assert response.status_code == 200
+    metrics = response.json()
+    assert metrics["created_at"] is None
+    assert metrics["total_seconds"] is None
+    assert [span["name"] for span in metrics["spans"]] == ["dbt_invoke"]
+
+
+def test_job_metrics_of_an_unknown_job_is_not_found(fake_backends):
+    with TestClient(server.app) as client:
+        response = client.get("/job/unknown/metrics")
+
+    assert response.status_code == 404
+
+
+def test_cli_timings(capsys):
+    echo_timings({
+        "total_seconds": 100.0,
+        "queue_wait_seconds": 5.0,
+        "spans": [{"name": "get_manifest", "duration_seconds": 15.0}, {"name": "dbt_invoke", "duration_seconds": 60.0}],
+    })
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1] == "Job timings (total 100.0s):"
+    assert lines[2].split() == ["queue_wait", "5.0s"]
+    assert lines[3].split() == ["get_manifest", "15.0s", "15.0%"]
+    assert lines[4].split() == ["dbt_invoke", "60.0s", "60.0%"]
+
+
+def test_cli_timings_of_a_job_without_queue_wait(capsys):
+    echo_timings({"total_seconds": 0.0, "queue_wait_seconds": None, "spans": [{"name": "dbt_invoke", "duration_seconds": 0.0}]})
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[2].split() == ["dbt_invoke", "0.0s", "0.0%"]
+
+
+def test_cli_timings_of_a_job_without_total_duration(capsys):
+    echo_timings({"total_seconds": None, "queue_wait_seconds": None, "spans": [{"name": "dbt_invoke", "duration_seconds": 60.0}]})
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1] == "Job timings:"
+    assert lines[2].split() == ["dbt_invoke", "60.0s"]
@@ -0,0 +1,162 @@
+import asyncio
+import json
+from typing import List
+
+from fastapi.testclient import TestClient
+import pytest
+import requests
+
+from dbt_remote.src import dbt_server
+from dbt_remote.src.dbt_server import DbtServer, LogStreamUnavailable
+from dbt_server import server
+from dbt_server.lib.firestore import get_collection
+from dbt_server.lib.state import State
+
+STREAM_LINK = "http://server/job/1/stream"
+LOGS_LINK = "http://server/job/1/last_logs"
+
+
+def log_line(i: int) -> str:
+    return f"2024-01-01T00:00:00Z\tINFO\tline {i}"
+
+
+class FakeResponse:
+    def __init__(self, lines: List[str] = None, body: dict = None, drop: bool = False):
+        self.status_code = 200
+        self.headers = {"content-type": "text/event-stream" if lines is not None else "application/json"}
+        self.lines = lines
+        self.body = body
+        self.drop = drop
+        self.encoding = None
+
+    @property
+    def text(self) -> str:
+        return json.dumps(self.body)
+
+    def iter_lines(self, decode_unicode: bool = False):
+        yield from self.lines
+        if self.drop:
+            raise requests.ConnectionError("Connection dropped")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeSession:
+    def __init__(self, streams: List[FakeResponse], polls: List[FakeResponse] = ()):
+        self.streams = list(streams)
+        self.polls = list(polls)
+        self.last_event_ids = []
+
+    def get(self, url: str, headers: dict = None, **kwargs) -> FakeResponse:
+        if url == STREAM_LINK:
+            self.last_event_ids.append(headers["Last-Event-ID"])
+            if len(self.streams) == 0:
+                raise requests.ConnectionError("Server unreachable")
+            return self.streams.pop(0)
+        return self.polls.pop(0)
+
+
+def events(*log_numbers: int, next_chunk: int = None, run_status: str = None) -> List[str]:
+    lines = []
+    for i in log_numbers:
+        lines += ["event: log", f"data: {log_line(i)}"] + ([f"id: {next_chunk}"] if i == log_numbers[-1] and next_chunk is not None else []) + [""]
+    if run_status is not None:
+        lines += ["event: status", f"data: {run_status}", ""]
+    return lines
+
+
+@pytest.fixture(autouse=True)
+def no_poll_delay(monkeypatch):
+    monkeypatch.setattr(dbt_server, "sleep", lambda seconds: None)
+
+
+def make_server(session: FakeSession) -> DbtServer:
+    server = DbtServer.__new__(DbtServer)  # Skips authentication and the version check
+    server.server_url = "http://server/"
+    server.auth_session = session
+    return server
+
+
+def messages(logs) -> List[str]:
+    return [log.message for log in logs]
+
+
+def test_stream_resumes_from_the_last_event_after_a_drop():
+    session = FakeSession([
+        FakeResponse(events(0, 1, next_chunk=1, run_status="running"), drop=True),
+        FakeResponse(events(2, next_chunk=2, run_status="success")),
+    ])
+
+    logs = messages(make_server(session).stream_logs({"stream": STREAM_LINK, "last_logs": LOGS_LINK}))
+
+    assert logs == ["line 0", "line 1", "line 2"]
+    assert session.last_event_ids == ["0", "1"]
+
+
+def test_stream_reconnections_are_reset_when_logs_are_received():
+    # Every connection drops, but each one brings new logs: the stream is followed until the job ends
+    streams = [FakeResponse(events(i, next_chunk=i + 1, run_status="running"), drop=True) for i in range(5)]
+    session = FakeSession(streams + [FakeResponse(events(5, next_chunk=6, run_status="success"))])
+
+    logs = messages(make_server(session).stream_events(STREAM_LINK, max_reconnections=2))
+
+    assert logs == [f"line {i}" for i in range(6)]
+
+
+def test_stream_gives_up_after_reconnections_without_logs():
+    session = FakeSession([FakeResponse(events(run_status="running"), drop=True) for _ in range(3)])
+
+    with pytest.raises(LogStreamUnavailable):
+        list(make_server(session).stream_events(STREAM_LINK, max_reconnections=2))
+
+
+def test_polling_fallback_skips_the_streamed_logs():
+    session = FakeSession(
+        [FakeResponse(events(0, 1, next_chunk=1, run_status="running"), drop=True)],
+        polls=[
+            FakeResponse(body={"run_status": "running", "run_logs": [log_line(0), log_line(1), log_line(2)]}),
+            FakeResponse(body={"run_status": "success", "run_logs": [log_line(3)]}),
+        ],
+    )
+
+    logs = messages(make_server(session).stream_logs({"stream": STREAM_LINK, "last_logs": LOGS_LINK}))
+
+    assert logs == ["line 0", "line 1", "line 2", "line 3"]
+
+
+def collect(async_iterator) -> List[str]:
+    async def collect_all():
+        return [event async for event in async_iterator]
+    return asyncio.run(collect_all())
+
+
+def test_server_stream_of_an_unknown_job_is_not_found(fake_backends):
+    with TestClient(server.app) as client:
+        response = client.get("/job/unknown/stream")
+
+    assert response.status_code == 404
+
+
+def test_server_stream_follows_a_job_until_it_is_launched_and_backs_off_while_idle(fake_backends, monkeypatch):
+    get_collection("dbt-status").document("job").set({"uuid": "job", "run_status": "scheduled"})
+    State.from_uuid("job").run_logs.append([log_line(0)])
+    delays = []
+
+    async def sleep(seconds: float):
+        delays.append(seconds)
+        if len(delays) == 6:
+            get_collection("dbt-status").document("job").update({"run_status": "success"})
+
+    monkeypatch.setattr(server, "LOG_STREAM_INTERVAL", 0.5)
+    monkeypatch.setattr(server, "LOG_STREAM_MAX_INTERVAL", 5)
+    monkeypatch.setattr(server.asyncio, "sleep", sleep)
+
+    job_events = collect(server.job_events(State.from_uuid("job")))
+
+    assert job_events[0] == f"event: log\nid: 1\ndata: {log_line(0)}\n\n"
+    assert job_events[1:] == ["event: status\ndata: scheduled\n\n", "event: status\ndata: success\n\n"]
+    assert delays == [0.5, 1, 2, 4, 5, 5]
@@ -0,0 +1,149 @@
+import json
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import msgpack
+import pytest
+
+from dbt_remote.src import cli_input, manifest_cache
+from dbt_remote.src.cli_input import CliInput
+from dbt_remote.src.manifest_cache import ManifestCache, get_manifest_msgpack
+
+PROFILES = {
+    "project": {
+        "target": "dev",
+        "outputs": {"dev": {"type": "bigquery", "dataset": "dev"}, "prod": {"type": "bigquery", "dataset": "prod"}},
+    },
+}
+
+
+@pytest.fixture
+def project_dir(tmp_path: Path) -> Path:
+    (tmp_path / "dbt_project.yml").write_text("name: project\nprofile: project\n")
+    (tmp_path / "profiles.yml").write_text(json.dumps(PROFILES))
+    (tmp_path / "models").mkdir()
+    (tmp_path / "models" / "orders.sql").write_text("select 1 as id")
+    return tmp_path
+
+
+def fingerprint(project_dir: Path, target: str = None, project_vars: str = None) -> str:
+    return ManifestCache(str(project_dir), str(project_dir), target, project_vars).fingerprint()
+
+
+def test_fingerprint_covers_the_project_files_vars_and_target(project_dir):
+    unchanged = fingerprint(project_dir)
+
+    assert fingerprint(project_dir) == unchanged
+    assert fingerprint(project_dir, target="prod") != unchanged
+    assert fingerprint(project_dir, project_vars="{day: 1}") != unchanged
+    (project_dir / "models" / "orders.sql").write_text("select 2 as id")
+    assert fingerprint(project_dir) != unchanged
+
+
+def test_fingerprint_ignores_the_other_targets(project_dir):
+    unchanged = fingerprint(project_dir)
+    profiles = json.loads(json.dumps(PROFILES))
+    profiles["project"]["outputs"]["prod"]["dataset"] = "production"
+    (project_dir / "profiles.yml").write_text(json.dumps(profiles))
+
+    assert fingerprint(project_dir) == unchanged
+
+
+def test_cache_is_invalid_once_the_manifest_changes(project_dir):
+    cache = ManifestCache(str(project_dir), str(project_dir))
+    cache.target_dir.mkdir()
+    cache.manifest_path.write_text("{}")
+    cache.save(cache.fingerprint())
+
+    assert cache.is_valid(cache.fingerprint())
+    cache.manifest_path.write_text('{"nodes": {}}')  # e.g. by a local dbt run with other vars
+    assert not cache.is_valid(cache.fingerprint())
+
+
+class FakeDbtRunner:
+    invocations = []
+
+    def __init__(self, manifest=None):
+        pass
+
+    def invoke(self, args):
+        self.invocations.append(args)
+        return SimpleNamespace(success=True, result={"parsed": len(self.invocations)})
+
+
+@pytest.fixture
+def parses(monkeypatch) -> list:
+    monkeypatch.setattr(FakeDbtRunner, "invocations", [])
+    monkeypatch.setattr(cli_input, "dbtRunner", FakeDbtRunner)
+    monkeypatch.setattr(cli_input, "write_manifest", lambda manifest, target_dir: (Path(target_dir) / "manifest.json").write_text(json.dumps(manifest)))
+    return FakeDbtRunner.invocations
+
+
+def resolve_manifest(project_dir: Path) -> str:
+    cli = CliInput.__new__(CliInput)  # Skips the local config, server detection and msgpack conversion
+    cli.manifest, cli.args, cli.target = None, ["--select", "orders"], None
+    cli.project_dir, cli.profiles_dir = str(project_dir), str(project_dir)
+    return cli.resolve_manifest()
+
+
+def test_unchanged_project_reuses_the_manifest(project_dir, parses):
+    assert resolve_manifest(project_dir) == str(project_dir / "target")
+    assert resolve_manifest(project_dir) == str(project_dir / "target")
+
+    assert len(parses) == 1
+    assert parses[0][:2] == ["parse", "--partial-parse"]
+
+
+def test_edited_project_is_parsed_again(project_dir, parses):
+    resolve_manifest(project_dir)
+    (project_dir / "models" / "customers.sql").write_text("select 1 as id")
+
+    resolve_manifest(project_dir)
+
+    assert len(parses) == 2
+    assert json.loads((project_dir / "target" / "manifest.json").read_text()) == {"parsed": 2}
+
+
+def write_manifest(folder: Path, nodes: dict) -> Path:
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / "manifest.json").write_text(json.dumps({"nodes": nodes}))
+    return folder / "manifest.json"
+
+
+def age(cache_dir: Path) -> None:
+    # Conversions are ordered by modification time, some filesystems only record it to the second
+    for file_path in cache_dir.iterdir():
+        modified_at = file_path.stat().st_mtime - 60
+        os.utime(file_path, (modified_at, modified_at))
+
+
+def test_msgpack_conversion_is_cached_by_manifest_hash(tmp_path: Path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    manifest_path = write_manifest(tmp_path / "target", {"model.project.orders": {}})
+    conversions = []
+    packb = msgpack.packb
+    monkeypatch.setattr(msgpack, "packb", lambda manifest_dict: conversions.append(manifest_dict) or packb(manifest_dict))
+
+    msgpack_path = get_manifest_msgpack(manifest_path, cache_dir)
+
+    assert get_manifest_msgpack(manifest_path, cache_dir) == msgpack_path
+    assert len(conversions) == 1
+    assert msgpack.unpackb(msgpack_path.read_bytes()) == {"nodes": {"model.project.orders": {}}}
+
+
+def test_least_recently_used_conversions_are_evicted(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(manifest_cache, "MSGPACK_CACHE_SIZE", 2)
+    cache_dir = tmp_path / "cache"
+    manifests = [write_manifest(tmp_path / f"target-{i}", {f"model.project.m{i}": {}}) for i in range(3)]
+
+    first = get_manifest_msgpack(manifests[0], cache_dir)
+    age(cache_dir)
+    second = get_manifest_msgpack(manifests[1], cache_dir)
+    age(cache_dir)
+    get_manifest_msgpack(manifests[0], cache_dir)  # Used again, the second one is now the least recently used
+    age(cache_dir)
+    third = get_manifest_msgpack(manifests[2], cache_dir)
+
+    assert sorted(cache_dir.glob("*.msgpack")) == sorted([first, third])
+    assert not second.exists()
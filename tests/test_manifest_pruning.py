@@ -0,0 +1,105 @@
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from dbt_remote.src import manifest_pruning
+from dbt_remote.src.manifest_pruning import can_prune, get_selection_args, get_upstream_closure, prune_manifest, prune_manifest_dict
+
+
+def node(resource_type: str, original_file_path: str = "models/model.sql") -> dict:
+    return {"resource_type": resource_type, "original_file_path": original_file_path}
+
+
+MANIFEST = {
+    "metadata": {"dbt_version": "1.8.0"},
+    "nodes": {
+        "seed.project.countries": node("seed", "seeds/countries.csv"),
+        "seed.project.currencies": node("seed", "seeds/currencies.csv"),
+        "model.project.orders": node("model"),
+        "model.project.customers": node("model"),
+        "model.project.revenue": node("model"),
+        "test.project.not_null_revenue": node("test"),
+    },
+    "sources": {"source.project.shop.raw_orders": {}},
+    "macros": {"macro.project.cents_to_euros": {}},
+    "parent_map": {
+        "seed.project.countries": [],
+        "seed.project.currencies": [],
+        "source.project.shop.raw_orders": [],
+        "model.project.orders": ["source.project.shop.raw_orders", "seed.project.currencies"],
+        "model.project.customers": ["seed.project.countries"],
+        "model.project.revenue": ["model.project.orders"],
+        "test.project.not_null_revenue": ["model.project.revenue"],
+    },
+    "child_map": {
+        "seed.project.countries": ["model.project.customers"],
+        "seed.project.currencies": ["model.project.orders"],
+        "source.project.shop.raw_orders": ["model.project.orders"],
+        "model.project.orders": ["model.project.revenue"],
+        "model.project.customers": [],
+        "model.project.revenue": ["test.project.not_null_revenue"],
+        "test.project.not_null_revenue": [],
+    },
+}
+
+
+def test_selection_args_take_every_value_of_an_option():
+    args = ["--select", "orders", "revenue", "--full-refresh", "--exclude=customers", "--target", "prod"]
+
+    assert get_selection_args(args) == ["--select", "orders", "revenue", "--exclude=customers"]
+
+
+@pytest.mark.parametrize("command, args, expected", [
+    ("run", ["--select", "revenue"], True),
+    ("build", ["-s", "tag:daily"], True),
+    ("run", ["--full-refresh"], False),  # Nothing to prune to
+    ("run-operation", ["--select", "revenue"], False),
+    ("run", ["--select", "state:modified+"], False),  # Needs the previous run's manifest, which is not sent
+    ("test", ["--select", "result:fail"], False),
+])
+def test_can_prune(command, args, expected):
+    assert can_prune(command, args) is expected
+
+
+def test_upstream_closure_follows_the_parent_map():
+    closure = get_upstream_closure(MANIFEST, ["model.project.revenue"])
+
+    assert closure == {"model.project.revenue", "model.project.orders", "source.project.shop.raw_orders", "seed.project.currencies"}
+
+
+def test_pruning_keeps_the_closure_and_the_project_wide_entries():
+    kept_ids = get_upstream_closure(MANIFEST, ["model.project.revenue"])
+
+    pruned = prune_manifest_dict(MANIFEST, kept_ids)
+
+    assert sorted(pruned["nodes"]) == ["model.project.orders", "model.project.revenue", "seed.project.currencies"]
+    assert list(pruned["sources"]) == ["source.project.shop.raw_orders"]
+    assert pruned["macros"] == MANIFEST["macros"]
+    assert pruned["metadata"] == MANIFEST["metadata"]
+    # Edges to dropped resources are removed too, so that dbt does not look them up
+    assert pruned["child_map"]["model.project.revenue"] == []
+    assert "model.project.customers" not in pruned["parent_map"]
+    assert len(MANIFEST["nodes"]) == 6
+
+
+def test_prune_manifest_writes_the_pruned_manifest_and_returns_its_seeds(tmp_path: Path, monkeypatch):
+    (tmp_path / "manifest.json").write_text(json.dumps(MANIFEST))
+    selections = []
+
+    def select_unique_ids(manifest, selection_args, project_dir, profiles_dir, target):
+        selections.append(selection_args)
+        return ["model.project.customers"]
+
+    # The selection itself is resolved by dbt ls, which needs a full project
+    monkeypatch.setattr(manifest_pruning, "Manifest", SimpleNamespace(from_dict=lambda manifest_dict: manifest_dict))
+    monkeypatch.setattr(manifest_pruning, "select_unique_ids", select_unique_ids)
+
+    output_dir = tmp_path / "pruned"
+    seed_file_names = prune_manifest(str(tmp_path), ["--select", "customers"], str(tmp_path), str(tmp_path), None, output_dir)
+
+    assert selections == [["--select", "customers"]]
+    assert seed_file_names == {"countries.csv"}
+    pruned = json.loads((output_dir / "manifest.json").read_text())
+    assert sorted(pruned["nodes"]) == ["model.project.customers", "seed.project.countries"]
@@ -0,0 +1,100 @@
+import runpy
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from dbt_server import server
+from dbt_server.lib import metrics
+from dbt_server.lib.firestore import get_collection
+from dbt_server.lib.metrics import JobStatusCollector, RequestLatencyMiddleware
+from tests.benchmarks.fake_backends import install_fake_backends
+
+
+def sample(name: str, labels: dict = None) -> float:
+    return REGISTRY.get_sample_value(name, labels or {}) or 0.0
+
+
+def test_server_module_can_be_executed_twice(fake_backends):
+    # As uvicorn's reloader does: once as __mp_main__, once imported as the app module
+    runpy.run_path(server.__file__, run_name="__mp_main__")
+    for _ in range(2):
+        install_fake_backends()  # The clients are closed when the app shuts down
+        with TestClient(server.app) as client:
+            response = client.get("/metrics")
+            assert response.status_code == 200
+            assert "dbt_server_queue_depth" in response.text
+
+
+def test_metrics_endpoint_counts_active_jobs(fake_backends):
+    status_collection = get_collection("dbt-status")
+    for uuid, run_status in [("a", "queued"), ("b", "queued"), ("c", "running"), ("d", "success")]:
+        status_collection.document(uuid).set({"uuid": uuid, "run_status": run_status})
+
+    with TestClient(server.app) as client:
+        client.get("/metrics")
+
+        assert sample("dbt_server_jobs", {"status": "queued"}) == 2
+        assert sample("dbt_server_jobs", {"status": "running"}) == 1
+        assert sample("dbt_server_queue_depth") == 2
+        assert sample("dbt_server_request_duration_seconds_count", {"method": "GET", "route": "/metrics", "status": "200"}) >= 1
+    assert REGISTRY.get_sample_value("dbt_server_queue_depth") is None  # Unregistered on shutdown
+
+
+def test_request_latency_is_labelled_with_the_route_template():
+    app = FastAPI()
+    app.add_middleware(RequestLatencyMiddleware)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: str):
+        return {"item_id": item_id}
+
+    labels = {"method": "GET", "route": "/items/{item_id}", "status": "200"}
+    unmatched_labels = {"method": "GET", "route": "unmatched", "status": "404"}
+    before, unmatched_before = sample("dbt_server_request_duration_seconds_count", labels), sample("dbt_server_request_duration_seconds_count", unmatched_labels)
+
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/other")
+
+    assert sample("dbt_server_request_duration_seconds_count", labels) - before == 2
+    assert sample("dbt_server_request_duration_seconds_count", unmatched_labels) - unmatched_before == 1
+
+
+def test_job_status_collector_caches_counts(monkeypatch):
+    counts = [{"queued": 3}, {"queued": 1, "running": 2}]
+    calls = []
+
+    def count_jobs_by_status():
+        calls.append(1)
+        return counts[len(calls) - 1]
+
+    def collect(collector):
+        return {(family.name, tuple(s.labels.values())): s.value for family in collector.collect() for s in family.samples}
+
+    collector = JobStatusCollector(count_jobs_by_status, ["queued", "running"])
+    monkeypatch.setattr(metrics, "JOB_STATUS_METRICS_INTERVAL", 60)
+    assert collect(collector)[("dbt_server_queue_depth", ())] == 3
+    assert collect(collector)[("dbt_server_jobs", ("running",))] == 0
+    assert len(calls) == 1
+
+    monkeypatch.setattr(metrics, "JOB_STATUS_METRICS_INTERVAL", 0)
+    assert collect(collector)[("dbt_server_jobs", ("running",))] == 2
+    assert len(calls) == 2
+
+
+def test_job_status_collector_keeps_last_counts_when_counting_fails(monkeypatch):
+    results = [{"queued": 1}, Exception("Firestore unavailable")]
+
+    def count_jobs_by_status():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    collector = JobStatusCollector(count_jobs_by_status, ["queued"])
+    monkeypatch.setattr(metrics, "JOB_STATUS_METRICS_INTERVAL", 0)
+    list(collector.collect())
+    queue_depth = [family for family in collector.collect() if family.name == "dbt_server_queue_depth"][0]
+    assert queue_depth.samples[0].value == 1
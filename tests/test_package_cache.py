@@ -0,0 +1,111 @@
+import io
+from pathlib import Path
+import tarfile
+
+import pytest
+
+from dbt_server.lib.gcs import CloudStorage
+from dbt_server.lib.package_cache import PackageCache, create_archive, extract_archive, has_packages
+
+PACKAGES = "packages:\n  - package: dbt-labs/dbt_utils\n    version: 1.1.1\n"
+
+
+def install_packages(install_path: Path) -> None:
+    (install_path / "dbt_utils" / "macros").mkdir(parents=True)
+    (install_path / "dbt_utils" / "macros" / "sql.sql").write_text("{% macro star() %}{% endmacro %}")
+
+
+@pytest.fixture
+def gcs(fake_backends) -> CloudStorage:
+    return CloudStorage(bucket_name="bucket")
+
+
+def test_restore_misses_when_nothing_is_cached(gcs, tmp_path):
+    package_cache = PackageCache(gcs, PACKAGES, "1.7.0", prebaked_dir=str(tmp_path / "prebaked"))
+
+    assert package_cache.restore(str(tmp_path / "dbt_packages")) is None
+
+
+def test_saved_packages_are_restored_from_the_bucket(gcs, tmp_path):
+    install_packages(tmp_path / "installed")
+    PackageCache(gcs, PACKAGES, "1.7.0", prebaked_dir=str(tmp_path / "prebaked")).save(str(tmp_path / "installed"))
+
+    # Same packages written differently, as the server re-dumps packages.yml
+    package_cache = PackageCache(gcs, "packages: [{version: 1.1.1, package: dbt-labs/dbt_utils}]", "1.7.0", prebaked_dir=str(tmp_path / "prebaked"))
+    source = package_cache.restore(str(tmp_path / "dbt_packages"))
+
+    assert source == f"gs://bucket/{package_cache.blob_name}"
+    assert (tmp_path / "dbt_packages" / "dbt_utils" / "macros" / "sql.sql").read_text() == "{% macro star() %}{% endmacro %}"
+
+
+def test_packages_are_cached_per_dbt_version(gcs, tmp_path):
+    install_packages(tmp_path / "installed")
+    PackageCache(gcs, PACKAGES, "1.7.0", prebaked_dir=str(tmp_path / "prebaked")).save(str(tmp_path / "installed"))
+
+    assert PackageCache(gcs, PACKAGES, "1.8.0", prebaked_dir=str(tmp_path / "prebaked")).restore(str(tmp_path / "dbt_packages")) is None
+
+
+def test_prebaked_packages_are_restored_before_the_bucket(tmp_path):
+    install_packages(tmp_path / "installed")
+    PackageCache(None, PACKAGES, "1.7.0", prebaked_dir=str(tmp_path / "prebaked")).prebake(str(tmp_path / "installed"))
+
+    source = PackageCache(None, PACKAGES, "1.7.0", prebaked_dir=str(tmp_path / "prebaked")).restore(str(tmp_path / "dbt_packages"))
+
+    assert source == "image"
+    assert (tmp_path / "dbt_packages" / "dbt_utils" / "macros" / "sql.sql").is_file()
+
+
+@pytest.mark.parametrize("packages, expected", [
+    (PACKAGES, True),
+    ("{}\n", False),
+    ("", False),
+    ("null\n...\n", False),
+    ("packages: []\n", False),
+    ("packages: [unclosed\n", True),
+])
+def test_has_packages(packages, expected):
+    assert has_packages(packages) == expected
+
+
+@pytest.fixture(params=["data_filter", "checked_members"])
+def extraction(request, monkeypatch):
+    if request.param == "checked_members":
+        monkeypatch.delattr(tarfile, "data_filter", raising=False)  # Python < 3.10.12
+
+
+def test_archives_are_extracted_with_their_folders(extraction, tmp_path: Path):
+    install_packages(tmp_path / "installed")
+    create_archive(str(tmp_path / "installed"), tmp_path / "packages.tar.gz")
+
+    extract_archive(tmp_path / "packages.tar.gz", str(tmp_path / "dbt_packages"))
+
+    assert (tmp_path / "dbt_packages" / "dbt_utils" / "macros" / "sql.sql").read_text() == "{% macro star() %}{% endmacro %}"
+
+
+def add_member(tar: tarfile.TarFile, name: str, linkname: str = None) -> None:
+    member = tarfile.TarInfo(name)
+    if linkname is not None:
+        member.type, member.linkname = tarfile.SYMTYPE, linkname
+        tar.addfile(member)
+    else:
+        member.size = 4
+        tar.addfile(member, io.BytesIO(b"data"))
+
+
+@pytest.mark.parametrize("name, linkname", [("../outside.sql", None), ("dbt_utils/link", "/etc/passwd"), ("dbt_utils/link", "../../outside.sql")])
+def test_members_outside_of_the_install_path_are_rejected(extraction, tmp_path: Path, name, linkname):
+    with tarfile.open(tmp_path / "packages.tar.gz", "w:gz") as tar:
+        add_member(tar, name, linkname)
+
+    with pytest.raises(tarfile.TarError):
+        extract_archive(tmp_path / "packages.tar.gz", str(tmp_path / "dbt_packages"))
+    assert not (tmp_path / "outside.sql").exists()
+
+
+def test_absolute_members_are_extracted_in_the_install_path(extraction, tmp_path: Path):
+    with tarfile.open(tmp_path / "packages.tar.gz", "w:gz") as tar:
+        add_member(tar, "/dbt_utils/absolute.sql")
+
+    extract_archive(tmp_path / "packages.tar.gz", str(tmp_path / "dbt_packages"))
+
+    assert (tmp_path / "dbt_packages" / "dbt_utils" / "absolute.sql").read_text() == "data"
@@ -0,0 +1,183 @@
+from contextlib import contextmanager
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+
+from dbt_server import server
+from dbt_server.lib.clients import Clients, set_clients
+from dbt_server.lib.firestore import get_client
+from dbt_server.lib.job_queue import LocalJobQueue, QueuedJob, set_job_queue
+
+JOB_CREATION_TIME = 1.0
+
+
+class FakeState:
+    def __init__(self, dbt_command=None, uuid: str = None):
+        self.uuid = str(uuid4()) if uuid is None else uuid
+        self.run_status = "running"
+        self.shards = 1
+
+    @classmethod
+    def from_uuid(cls, uuid: str):
+        return cls(uuid=uuid)
+
+    def extract_artifacts(self, zipped_artifacts):
+        pass
+
+    @contextmanager
+    def batch(self):
+        yield self
+
+    def update(self, fields: dict):
+        pass
+
+    def refresh(self):
+        pass
+
+    def record_span(self, name, start, end, **details):
+        pass
+
+
+class FakeLogger:
+    def __init__(self, server: bool = False):
+        self.state = None
+
+    def log(self, severity: str, new_log: str):
+        pass
+
+
+class SlowJobStarter:
+    """Blocks like run_v2.JobsClient().create_job(...).result() does."""
+
+    def __init__(self, dbt_job_config, logger):
+        pass
+
+    def start(self):
+        time.sleep(JOB_CREATION_TIME)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "State", FakeState)
+    monkeypatch.setattr(server, "DbtLogger", FakeLogger)
+    monkeypatch.setattr(server, "DbtCloudRunJobStarter", SlowJobStarter)
+    with TestClient(server.app) as client:
+        yield client
+
+
+def submit(client: TestClient):
+    return client.post(
+        "/dbt",
+        data={"server_url": "http://testserver/", "user_command": "run", "dbt_project": "{}", "profiles": "{}"},
+        files={"zipped_artifacts": io.BytesIO(b"")},
+    )
+
+
+def test_job_status_latency_while_submissions_are_in_flight(client):
+    start = time.perf_counter()
+    response = client.get("/job/some-uuid")
+    idle_latency = time.perf_counter() - start
+    assert response.json() == {"run_status": "running"}
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        submissions = [executor.submit(submit, client) for _ in range(8)]
+        time.sleep(JOB_CREATION_TIME / 4)
+
+        latencies = []
+        for _ in range(10):
+            start = time.perf_counter()
+            client.get("/job/some-uuid")
+            latencies.append(time.perf_counter() - start)
+        in_flight = sum(not submission.done() for submission in submissions)
+
+    assert in_flight == 8
+    assert all(submission.result().status_code == 202 for submission in submissions)
+    assert max(latencies) < max(idle_latency * 10, JOB_CREATION_TIME / 5)
+
+
+class FakeClient:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_app_shares_and_closes_injected_clients():
+    firestore_client = FakeClient()
+    set_clients(Clients(firestore=firestore_client))
+    try:
+        with TestClient(server.app):
+            assert get_client() is firestore_client
+            assert get_client() is get_client()
+        assert firestore_client.closed
+    finally:
+        set_clients(None)
+
+
+def test_worker_mode_queues_commands_for_workers(client, monkeypatch):
+    from dbt_server import dbt_run_job, worker
+
+    job_queue = LocalJobQueue()
+    set_job_queue(job_queue)
+    monkeypatch.setattr(server, "EXECUTION_MODE", "worker")
+    try:
+        start = time.perf_counter()
+        response = submit(client)
+        assert response.status_code == 202
+        assert time.perf_counter() - start < JOB_CREATION_TIME
+    finally:
+        set_job_queue(None)
+
+    job = job_queue.claim(timeout=0)
+    assert job.uuid == response.json()["uuid"]
+    assert job.dbt_command == "run"
+
+    ran_jobs = []
+    monkeypatch.setattr(worker, "State", FakeState)
+    monkeypatch.setattr(dbt_run_job, "run_job", lambda uuid, dbt_command: ran_jobs.append((uuid, dbt_command)))
+    worker.Worker(job_queue).run_job(job)
+    assert ran_jobs == [(job.uuid, "run")]
+
+
+def test_worker_mode_marks_jobs_pending_before_queueing(monkeypatch):
+    state = FakeState()
+    statuses_when_queued = []
+
+    class RecordingQueue:
+        def put(self, job):
+            statuses_when_queued.append(state.run_status)
+
+    set_job_queue(RecordingQueue())
+    monkeypatch.setattr(server, "EXECUTION_MODE", "worker")
+    try:
+        server.start_job(state, "run", FakeLogger())
+    finally:
+        set_job_queue(None)
+    assert statuses_when_queued == ["pending"]
+
+
+def test_worker_runs_jobs_in_a_subprocess_without_changing_directory(monkeypatch):
+    from dbt_server import worker
+
+    runs = []
+    monkeypatch.setattr(worker, "State", FakeState)
+    monkeypatch.setattr(worker.subprocess, "run", lambda args, cwd, env, check: runs.append((cwd, env["UUID"], env["DBT_COMMAND"], os.getcwd())))
+    previous_dir = os.getcwd()
+
+    worker.Worker(LocalJobQueue(), subprocess_jobs=True).run_job(QueuedJob(uuid="job", dbt_command="run"))
+
+    [(job_dir, uuid, dbt_command, cwd)] = runs
+    assert (uuid, dbt_command) == ("job", "run")
+    assert cwd == previous_dir != job_dir
+    assert os.getcwd() == previous_dir
+
+
+def test_version_lists_the_server_features(client):
+    response = client.get("/version")
+    assert "manifest_msgpack" in response.json()["features"]
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+import threading
+
+import pytest
+
+from dbt_server.lib import sharding
+from dbt_server.lib.firestore import get_collection
+from dbt_server.lib.sharding import Shard, ShardBarrier, ShardBarrierTimeout, assign_to_shards, plan_waves
+
+PARENT_MAP = {
+    "seed.project.countries": [],
+    "model.project.stg_orders": ["source.project.shop.raw_orders"],
+    "model.project.customers": ["seed.project.countries"],
+    "model.project.orders": ["model.project.stg_orders", "model.project.customers"],
+    "test.project.not_null_orders_id": ["model.project.orders"],
+}
+
+
+def test_nodes_run_in_the_wave_after_their_last_selected_parent():
+    waves = plan_waves(PARENT_MAP, PARENT_MAP)
+
+    assert waves == [
+        ["model.project.stg_orders", "seed.project.countries"],
+        ["model.project.customers"],
+        ["model.project.orders"],
+        ["test.project.not_null_orders_id"],
+    ]
+
+
+def test_unselected_parents_are_considered_built():
+    waves = plan_waves(PARENT_MAP, ["model.project.orders", "test.project.not_null_orders_id"])
+
+    assert waves == [["model.project.orders"], ["test.project.not_null_orders_id"]]
+
+
+def test_deep_dags_do_not_hit_the_recursion_limit():
+    parent_map = {f"model.project.m{i}": [f"model.project.m{i - 1}"] if i > 0 else [] for i in range(5000)}
+
+    waves = plan_waves(parent_map, parent_map)
+
+    assert len(waves) == 5000
+    assert waves[-1] == ["model.project.m4999"]
+
+
+def test_no_selected_nodes_plan_no_waves():
+    assert plan_waves(PARENT_MAP, []) == []
+
+
+def test_waves_are_spread_evenly_and_identically_on_every_shard():
+    wave = [f"model.project.m{i}" for i in range(7)]
+
+    assignment = assign_to_shards(wave, 3)
+
+    assert [len(nodes) for nodes in assignment] == [3, 2, 2]
+    assert sorted(node for nodes in assignment for node in nodes) == sorted(wave)
+    assert assign_to_shards(list(wave), 3) == assignment
+
+
+def test_shards_beyond_the_wave_size_get_nothing():
+    assert assign_to_shards(["model.project.orders"], 3) == [["model.project.orders"], [], []]
+
+
+@pytest.fixture
+def fast_barrier(monkeypatch):
+    monkeypatch.setattr(sharding, "SHARD_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(sharding, "SHARD_BARRIER_TIMEOUT", 5)
+
+
+def test_barrier_waits_for_every_shard(fake_backends, fast_barrier):
+    barriers = [ShardBarrier("job-uuid", Shard(index, 3)) for index in range(3)]
+    barriers[0].report("wave-0", "success")
+    barriers[1].report("wave-0", "error")
+
+    results = []
+    waiting = threading.Thread(target=lambda: results.append(barriers[0].wait("wave-0")))
+    waiting.start()
+    waiting.join(0.1)
+    assert waiting.is_alive()
+
+    barriers[2].report("wave-0", "success")
+    waiting.join(5)
+
+    assert results == [{"0": "success", "1": "error", "2": "success"}]
+
+
+def test_finished_shards_release_the_barrier(fake_backends, fast_barrier):
+    # A shard that stopped before the step reports done, the others must not wait for it
+    barriers = [ShardBarrier("job-uuid", Shard(index, 2)) for index in range(2)]
+    barriers[0].report("wave-1", "success")
+    barriers[1].report("done", "error")
+
+    assert barriers[0].wait("wave-1") == {"0": "success", "1": "error"}
+
+
+def test_barrier_times_out_on_missing_shards(fake_backends, monkeypatch):
+    monkeypatch.setattr(sharding, "SHARD_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(sharding, "SHARD_BARRIER_TIMEOUT", 0.05)
+    barrier = ShardBarrier("job-uuid", Shard(0, 3))
+    barrier.report("wave-0", "success")
+
+    with pytest.raises(ShardBarrierTimeout, match=r"\['1', '2'\] did not reach step wave-0"):
+        barrier.wait("wave-0")
+
+
+def test_barrier_documents_expire_and_are_deleted(fake_backends, fast_barrier):
+    barriers = [ShardBarrier("job-uuid", Shard(index, 2)) for index in range(2)]
+    for barrier in barriers:
+        barrier.report("done", "success")
+
+    document = get_collection(sharding.SHARD_COLLECTION).document("job-uuid").get().to_dict()
+    assert document["expires_at"] > datetime.now(timezone.utc) + timedelta(seconds=sharding.SHARD_BARRIER_TIMEOUT)
+
+    barriers[0].wait("done")
+    barriers[0].delete()
+    assert not get_collection(sharding.SHARD_COLLECTION).document("job-uuid").get().exists
@@ -0,0 +1,211 @@
+import time
+
+from dbt_server.lib.firestore import get_collection
+from dbt_server.lib.gcs import CloudStorage
+from dbt_server.lib.state import DbtRunLogs, State
+from tests.benchmarks.fake_backends import FakeBlob
+
+
+def create_state(uuid: str = "job", **fields) -> State:
+    get_collection("dbt-status").document(uuid).set({"uuid": uuid, "run_status": "running", "log_next_chunk": 0, **fields})
+    return State.from_uuid(uuid)
+
+
+def test_log_chunks_are_numbered_in_order(fake_backends):
+    run_logs = DbtRunLogs("job")
+    for i in range(3):
+        run_logs.append([f"line {i}"])
+
+    assert run_logs.gcs.list_files(run_logs.log_folder) == [f"logs/job/0000000{i}.txt" for i in range(3)]
+    assert run_logs.get(0) == (["line 0", "line 1", "line 2"], 3)
+    assert run_logs.get(2) == (["line 2"], 3)
+    assert run_logs.get(3) == ([], 3)
+
+
+def test_writers_take_the_next_free_chunk(fake_backends):
+    # Two writers of the same job, e.g. the server and the job: a chunk number taken by the other one is skipped
+    first_writer, second_writer = DbtRunLogs("job"), DbtRunLogs("job")
+    first_writer.append(["first 0"])
+    second_writer.append(["second 0"])
+    first_writer.append(["first 1"])  # Chunk 1 is taken, fails its precondition and retries as chunk 2
+
+    assert first_writer.gcs.list_files(first_writer.log_folder) == [f"logs/job/0000000{i}.txt" for i in range(3)]
+    assert first_writer.get(0) == (["first 0", "second 0", "first 1"], 3)
+
+
+def test_last_logs_are_read_from_the_job_cursor(fake_backends):
+    state = create_state()
+    state.run_logs.append(["line 0", "line 1"])
+
+    assert state.get_last_logs() == ["line 0", "line 1"]
+    assert state.get_last_logs() == []
+
+    state.run_logs.append(["line 2"])
+    assert State.from_uuid("job").get_last_logs() == ["line 2"]
+
+
+def test_all_logs_include_chunks_written_after_compaction(fake_backends):
+    state = create_state()
+    state.run_logs.append(["line 0"])
+    state.run_logs.append(["line 1"])
+    state.compact_logs()
+    state.run_logs.append(["line 2"])  # e.g. the server logging after the job finished
+
+    assert CloudStorage(bucket_name=None).load("logs/job.txt") == b"line 0\nline 1\n"
+    assert state.snapshot["log_compacted_chunks"] == 2
+    assert State.from_uuid("job").get_all_logs() == ["line 0", "line 1", "line 2"]
+
+
+def test_all_logs_of_uncompacted_jobs_are_read_from_chunks(fake_backends):
+    state = create_state()
+    state.run_logs.append(["line 0"])
+    state.run_logs.append(["line 1"])
+
+    assert state.get_all_logs() == ["line 0", "line 1"]
+
+
+def test_log_chunks_are_downloaded_concurrently(fake_backends, monkeypatch):
+    state = create_state()
+    for i in range(16):
+        state.run_logs.append([f"line {i}"])
+    in_flight, max_in_flight = [], []
+    download_as_bytes = FakeBlob.download_as_bytes
+
+    def tracked_download(blob, **kwargs):
+        in_flight.append(blob.name)
+        max_in_flight.append(len(in_flight))
+        time.sleep(0.01)
+        in_flight.remove(blob.name)
+        return download_as_bytes(blob, **kwargs)
+    monkeypatch.setattr(FakeBlob, "download_as_bytes", tracked_download)
+
+    assert state.get_all_logs() == [f"line {i}" for i in range(16)]
+    assert max(max_in_flight) > 1
+
+
+def test_logs_of_jobs_started_before_chunking(fake_backends):
+    gcs = CloudStorage(bucket_name=None)
+    gcs.save("logs/job.txt", "line 0\nline 1")
+    get_collection("dbt-status").document("job").set({"uuid": "job", "run_status": "running", "log_starting_byte": 0})
+    state = State.from_uuid("job")
+
+    assert state.get_last_logs() == ["line 0", "line 1"]
+    gcs.save("logs/job.txt", "line 0\nline 1\nline 2")  # Older jobs rewrote the whole file on every log
+    assert state.get_last_logs() == ["line 2"]
+    assert state.get_last_logs() == []
+    assert State.from_uuid("job").get_all_logs() == ["line 0", "line 1", "line 2"]
+
+
+def test_find_active_job_returns_the_oldest_coalescable_job(fake_backends):
+    for uuid, run_status, created_at, fingerprint in [
+        ("finished", "success", 1, "same"),
+        ("running", "running", 2, "same"),
+        ("queued", "queued", 3, "same"),
+        ("other", "running", 0, "other"),
+    ]:
+        get_collection("dbt-status").document(uuid).set({"uuid": uuid, "run_status": run_status, "created_at": created_at, "fingerprint": fingerprint})
+
+    assert State.find_active_job("same") == "running"
+    assert State.find_active_job("unknown") is None
+
+
+class CountingDocument:
+    """Counts the reads and writes made to the wrapped Firestore document."""
+
+    def __init__(self, document):
+        self.document = document
+        self.gets = 0
+        self.updates = []
+
+    def __getattr__(self, name):
+        return getattr(self.document, name)
+
+    def get(self, **kwargs):
+        self.gets += 1
+        return self.document.get(**kwargs)
+
+    def update(self, fields: dict, **kwargs):
+        self.updates.append(fields)
+        self.document.update(fields, **kwargs)
+
+
+def counting_state(monkeypatch) -> tuple:
+    state = create_state()
+    state.refresh()
+    document = CountingDocument(state.document)
+    monkeypatch.setattr(State, "document", property(lambda self: document))
+    return state, document
+
+
+def test_properties_are_read_from_a_single_snapshot(fake_backends, monkeypatch):
+    state = create_state(user_command="run", cloud_storage_folder="folder", shards=2)
+    document = CountingDocument(state.document)
+    monkeypatch.setattr(State, "document", property(lambda self: document))
+
+    assert (state.run_status, state.user_command, state.cloud_storage_folder, state.shards) == ("running", "run", "folder", 2)
+    assert document.gets == 1
+
+    get_collection("dbt-status").document("job").update({"run_status": "success"})
+    assert state.run_status == "running"  # Until refreshed
+    state.refresh()
+    assert (state.run_status, state.user_command, state.log_next_chunk) == ("success", "run", 0)
+    assert document.gets == 2
+
+
+def test_batch_commits_its_writes_in_a_single_update(fake_backends, monkeypatch):
+    state, document = counting_state(monkeypatch)
+
+    with state.batch():
+        state.run_status = "success"
+        state.user_command = "build"
+        state.update({"worker": "worker-1"})
+        assert state.run_status == "success"  # Read from the snapshot before the commit
+        assert document.updates == []
+
+    assert len(document.updates) == 1
+    assert document.updates[0].keys() == {"run_status", "finished_at", "user_command", "worker"}
+    assert State.from_uuid("job").snapshot["worker"] == "worker-1"
+
+
+def test_nested_batches_are_committed_by_the_outermost_one(fake_backends, monkeypatch):
+    state, document = counting_state(monkeypatch)
+
+    with state.batch():
+        state.run_status = "running"
+        with state.batch():
+            state.log_next_chunk = 3
+        assert document.updates == []
+
+    assert document.updates == [{"run_status": "running", "started_at": document.updates[0]["started_at"], "log_next_chunk": 3}]
+
+
+def test_empty_batch_writes_nothing(fake_backends, monkeypatch):
+    state, document = counting_state(monkeypatch)
+
+    with state.batch():
+        pass
+
+    assert document.updates == []
+
+
+def test_failed_batch_writes_nothing_and_reloads_the_snapshot(fake_backends, monkeypatch):
+    state, document = counting_state(monkeypatch)
+
+    try:
+        with state.batch():
+            state.run_status = "failed"
+            raise RuntimeError("interrupted")
+    except RuntimeError:
+        pass
+
+    assert document.updates == []
+    assert state.run_status == "running"
+
+
+def test_writes_outside_a_batch_are_sent_right_away(fake_backends, monkeypatch):
+    state, document = counting_state(monkeypatch)
+
+    state.run_status = "running"
+    state.log_next_chunk = 1
+
+    assert len(document.updates) == 2